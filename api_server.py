@@ -1,7 +1,17 @@
+import json
 import os
 import sys
-from fastapi import FastAPI
-from pydantic import BaseModel
+import time
+from typing import Any, Dict, List, Optional
+
+# بداية قياس cold start (قبل استيراد FastAPI والنواة)
+_PROCESS_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict
+from starlette.background import BackgroundTask
 import uvicorn
 
 # 🔹 إضافة مسار الملف الحالي حتى يقدر يلاقي hawsa_core.py
@@ -9,7 +19,10 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 if BASE_DIR not in sys.path:
     sys.path.append(BASE_DIR)
 
-from hawsa_core import HawsaCore   # ✅ هذا الكلاس الصحيح
+from hawsa_admission import AdmissionRejected, admission_from_env
+from hawsa_core import HawsaCore, prepare_storage   # ✅ هذا الكلاس الصحيح
+from hawsa_context import CONTEXT_MODES
+from hawsa_tracing import CONTENT_TYPE as METRICS_CONTENT_TYPE, span
 
 app = FastAPI(
     title="Hawsa AI Local API",
@@ -17,19 +30,217 @@ app = FastAPI(
     description="Local API for Hawsa AI Core"
 )
 
-core = HawsaCore()  # ✅ إنشاء النواة
+# النواة تنشأ عند startup في كل Worker (مو وقت الاستيراد)، فالعملية الأم في وضع --workers
+# ما تفتح القواعد ولا تشغل طابور الكتابة. /ready = 503 لين تجهز النواة وتسخن.
+core: Optional[HawsaCore] = None
+_startup: Dict[str, Any] = {}
+
+# بوابة القبول (hawsa_admission.py) أمام كل مسارات التحليل، لكل Worker:
+# حد للطلبات الشغالة + طابور قصير بمهلة + عدالة بين المستخدمين، والرفض فوري (429/503 + Retry-After)
+admission = admission_from_env()
+# الدفعة تنحسب كطلب واحد في البوابة تحت مفتاح ثابت
+BATCH_ADMISSION_KEY = "__batch__"
+
+MAX_BATCH_ITEMS = int(os.environ.get("HAWSA_MAX_BATCH_ITEMS", "1000"))
 
 class AIRequest(BaseModel):
     user_id: str
     message: str
+    context_mode: Optional[str] = None  # compact (الافتراضي) / ids / full
+    timings: Optional[bool] = None      # analytics.timings_ms لكل مرحلة
+
+class AIBatchItem(BaseModel):
+    # context_mode / timings على مستوى الدفعة فقط: حقل زيادة في العنصر = 422 بدل ما ينتجاهل
+    model_config = ConfigDict(extra="forbid")
+    
+    user_id: str
+    message: str
+
+class AIBatchRequest(BaseModel):
+    items: List[AIBatchItem]
+    context_mode: Optional[str] = None
+    timings: Optional[bool] = None
+
+def _check_context_mode(mode: Optional[str]):
+    if mode is not None and mode.lower() not in CONTEXT_MODES:
+        raise HTTPException(status_code=400, detail=f"context_mode must be one of {', '.join(CONTEXT_MODES)}")
+
+@app.exception_handler(AdmissionRejected)
+def admission_rejected(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        {"detail": exc.reason, "retry_after": exc.retry_after},
+        status_code=exc.status,
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.on_event("startup")
+def startup():
+    global core
+    started = time.perf_counter()
+    core = HawsaCore()  # ✅ إنشاء النواة
+    init_seconds = time.perf_counter() - started
+    warm = core.warm_up()
+    _startup.update({
+        "pid": os.getpid(),
+        "init_ms": round(init_seconds * 1000, 2),
+        "warmup_ms": round(warm["seconds"] * 1000, 2),
+        "connections": warm["connections"],
+        # من بداية العملية (استيراد FastAPI/النواة) لين الجاهزية
+        "cold_start_ms": round((time.perf_counter() - _PROCESS_STARTED) * 1000, 2),
+    })
+
+@app.on_event("shutdown")
+def shutdown():
+    # ضمان حفظ الكتابات المؤجلة قبل إيقاف السيرفر
+    if core is not None:
+        core.close()
+
+@app.get("/health")
+def health():
+    # العملية شغالة (liveness)
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    # readiness: النواة جاهزة واتصالات القاعدة مسخنة
+    if core is None or not _startup:
+        return Response(json.dumps({"ready": False}), status_code=503, media_type="application/json")
+    return {"ready": True, **_startup}
 
 @app.post("/analyze")
-def analyze(req: AIRequest):
-    result = core.process_comprehensive_query(
+async def analyze(req: AIRequest):
+    # المسار غير المتزامن: ما يحجز خيط من threadpool لكل طلب
+    _check_context_mode(req.context_mode)
+    async with await admission.aacquire(req.user_id):
+        result = await core.aprocess_comprehensive_query(
+            user_id=req.user_id,
+            user_message=req.message,
+            context_mode=req.context_mode,
+            timings=req.timings
+        )
+    # ترميز JSON هنا (بدل jsonable_encoder) حتى ينقاس ضمن hawsa_stage_seconds{stage="serialize"}
+    with span("serialize"):
+        body = json.dumps(result, ensure_ascii=False)
+    return Response(body, media_type="application/json")
+
+@app.get("/memory/{user_id}/archive")
+def get_archived_history(user_id: str, limit: int = 20, before_id: Optional[int] = None):
+    # السجل القديم المنقول للأرشيف (hawsa_retention.py)، صفحة صفحة بـ before_id
+    return {"items": core.memory.get_archived_history(user_id, min(max(limit, 1), 200), before_id)}
+
+@app.get("/memory/{user_id}/{interaction_id}")
+def get_interaction(user_id: str, interaction_id: int):
+    # المحتوى الكامل لعنصر مختصر/مرجعي من context_used
+    item = core.memory.get_interaction(user_id, interaction_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Interaction not found")
+    return item
+
+@app.get("/stats/cache")
+def cache_stats():
+    return core.cache_stats()
+
+@app.get("/stats/admission")
+def admission_stats():
+    return admission.stats()
+
+@app.get("/metrics")
+def metrics():
+    # صيغة Prometheus النصية: مراحل، قاعدة، مهارات، كاش، طابور الكتابة
+    return Response(core.metrics_text(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/kb")
+def kb_stats():
+    # نسخة قاعدة معرفة ECU / DTC المحملة في هذا الـ Worker
+    return core.engineering_data.kb.stats()
+
+@app.post("/kb/reload")
+def kb_reload():
+    # إعادة تحميل hawsa_kb.json الآن في هذا الـ Worker؛ الباقين يلقطون التغيير من mtime خلال HAWSA_KB_RELOAD_SECONDS
+    result = core.engineering_data.kb.reload()
+    if not result["reloaded"]:
+        raise HTTPException(status_code=422, detail=result["error"])
+    return result
+
+@app.post("/analyze/batch")
+async def analyze_batch(req: AIBatchRequest):
+    # دفعة كبيرة: سياق مرة لكل مستخدم + حفظ جماعي (النتائج بنفس ترتيب items)
+    if len(req.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_ITEMS} items)")
+    _check_context_mode(req.context_mode)
+    # الانتظار في البوابة على الـ event loop، والمعالجة نفسها على threadpool بعد القبول
+    async with await admission.aacquire(BATCH_ADMISSION_KEY):
+        results = await run_in_threadpool(
+            core.process_batch,
+            [(item.user_id, item.message) for item in req.items],
+            context_mode=req.context_mode,
+            timings=req.timings
+        )
+    return {"results": results}
+
+def _encode_events(events, fmt: str, ticket=None):
+    # كل مرحلة تنرسل أول ما تجهز: سطر JSON (ndjson) أو حدث SSE
+    # ticket: مكان البوابة يرجع بعد آخر حدث (أو لو العميل قطع)
+    try:
+        for stage, payload in events:
+            with span("serialize"):
+                data = json.dumps({"stage": stage, "data": payload}, ensure_ascii=False)
+            if fmt == "sse":
+                yield f"event: {stage}\ndata: {data}\n\n"
+            else:
+                yield data + "\n"
+    except Exception as e:
+        print(f"[Stream Error] {e}")
+        data = json.dumps({"stage": "error", "data": {"detail": str(e)}}, ensure_ascii=False)
+        yield f"event: error\ndata: {data}\n\n" if fmt == "sse" else data + "\n"
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+@app.post("/analyze/stream")
+async def analyze_stream(req: AIRequest, format: str = "ndjson", context: bool = True):
+    # مولّد عادي: Starlette يمشي عليه في threadpool، وكل مرحلة تنكتب مباشرة للعميل
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+    _check_context_mode(req.context_mode)
+    # الرفض قبل ما يبدأ الرد (status 429/503 حقيقي مو حدث error داخل الستريم)
+    ticket = await admission.aacquire(req.user_id)
+    events = core.iter_comprehensive_query(
         user_id=req.user_id,
-        user_message=req.message
+        user_message=req.message,
+        include_context=context,
+        context_mode=req.context_mode,
+        timings=req.timings
+    )
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    # release مرتين آمن: الـ background يغطي عميل قطع قبل أول حدث (المولّد ما بدأ أصلاً)
+    return StreamingResponse(
+        _encode_events(events, format, ticket), media_type=media_type, background=BackgroundTask(ticket.release)
     )
-    return result
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="تشغيل Hawsa AI API")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument(
+        "--workers", type=int,
+        default=int(os.environ.get("HAWSA_WORKERS", os.environ.get("WEB_CONCURRENCY", "1"))),
+        help="عدد العمليات (كلها على نفس ملفات القاعدة)"
+    )
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    
+    if args.workers > 1:
+        # الترقية مرة وحدة هنا قبل الـ Workers، وكلهم يلقون المخطط محدث
+        applied = prepare_storage()
+        print(f"[Server] schema ready: {applied}")
+        # الـ Workers يرثون البيئة: الكاش يتحقق من القاعدة لأن عمليات ثانية تكتب لنفس المستخدمين
+        os.environ["HAWSA_WORKERS"] = str(args.workers)
+        uvicorn.run(
+            "api_server:app", host=args.host, port=args.port, workers=args.workers,
+            app_dir=BASE_DIR, log_level=args.log_level
+        )
+    else:
+        uvicorn.run(app, host=args.host, port=args.port, log_level=args.log_level)
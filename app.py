@@ -1,8 +1,15 @@
+import os
+
 import streamlit as st
-import requests
-import json
 
-API_URL = "http://localhost:8000/analyze"  # سنعدله لاحقاً بعد النشر
+from hawsa_client import HawsaClient, HawsaAPIError
+
+API_URL = os.environ.get("HAWSA_API_URL", "http://localhost:8000")  # سنعدله لاحقاً بعد النشر
+
+@st.cache_resource
+def get_client() -> HawsaClient:
+    # عميل واحد لكل عملية Streamlit: اتصالات keep-alive مشتركة بين الضغطات والجلسات
+    return HawsaClient(API_URL)
 
 st.set_page_config(page_title="Hawsa AI Web", layout="wide")
 
@@ -13,21 +20,36 @@ user_text = st.text_area("🔽 أدخل رسالتك هنا:")
 
 if st.button("تحليل"):
     if user_text.strip():
-        response = requests.post(
-            API_URL,
-            headers={"Content-Type": "application/json"},
-            json={"user_id": "web_user_1", "message": user_text}
-        )
-
-        result = response.json()
-
         st.subheader("📌 رد Hawsa AI:")
-        st.write(result["response"]["text"])
+        response_box = st.empty()
+        response_box.info("⏳ جاري التحليل...")
+
+        st.subheader("🔧 توصيات تقنية:")
+        recommendations_box = st.empty()
 
         st.subheader("🧠 السياق المستخدم:")
-        st.write(result["context_used"])
+        context_box = st.empty()
 
         st.subheader("⚙️ بيانات تقنية:")
-        st.json(result["analytics"])
+        analytics_box = st.empty()
+
+        # نعرض كل مرحلة أول ما توصل بدل انتظار الرد كامل
+        try:
+            for stage, data in get_client().stream("web_user_1", user_text):
+                if stage == "user_profile":
+                    analytics_box.json({"user_profile": data})
+                elif stage == "technical_recommendations":
+                    recommendations_box.json(data)
+                elif stage == "response":
+                    response_box.write(data["text"])
+                elif stage == "analytics":
+                    analytics_box.json(data)
+                elif stage == "context_used":
+                    context_box.write(data)
+                elif stage == "error":
+                    response_box.error(data["detail"])
+        except HawsaAPIError as e:
+            # 429/503 بعد استنفاد إعادة المحاولة، أو السيرفر مو شغال
+            response_box.error(f"تعذر الاتصال بـ Hawsa API: {e}")
     else:
         st.warning("رجاءً اكتب نصاً ليتم تحليله.")
@@ -0,0 +1,15 @@
+# ==========================
+# قياسات أداء Hawsa AI (قابلة للتكرار)
+# ==========================
+# - corpus:  مولّد رسائل عربية/إنجليزية لعدة مستخدمين (seed ثابت = نفس الرسائل كل مرة)
+# - micro:   قياس الدوال الساخنة داخل العملية (بدون سيرفر)
+# - paths:   المسار المتزامن مقابل async بنفس التوازي (req/s + async_speedup)
+# - load:    ضغط مستمر على FastAPI محليًا: throughput + p50/p95/p99 + نمو ملفات القاعدة
+# - compare: مقارنة تقريرين JSON وفشل (exit 1) لو فيه تراجع أكبر من الحد
+#
+#   python -m benchmarks.micro --out bench/micro.json
+#   python -m benchmarks.paths --concurrency 32 --skill-latency-ms 20 --out bench/paths.json
+#   python -m benchmarks.load --duration 60 --concurrency 16 --out bench/load.json
+#   python -m benchmarks.compare bench/baseline/micro.json bench/micro.json --threshold 0.10
+#
+# كل القياسات تشتغل في مجلد مؤقت، فملفات القاعدة في المستودع ما تتغير.
@@ -0,0 +1,120 @@
+import fnmatch
+from typing import Any, Dict, List, Optional, Sequence
+
+from benchmarks.report import load_report
+
+# ==========================
+# مقارنة تقريرين وبوابة التراجع (python -m benchmarks.compare base.json new.json)
+# ==========================
+# لكل مقياس موجود في الاثنين: التغير النسبي بالاتجاه "الأسوأ" (better = lower / higher).
+# أي مقياس تراجع أكثر من الحد -> exit 1، فتقدر تربطه بخطوة الإصدار.
+
+DEFAULT_THRESHOLD = 0.10
+
+def relative_regression(base: float, current: float, better: str) -> float:
+    """موجب = أسوأ. 0.25 = أسوأ بـ 25% من قيمة الأساس."""
+    if base == 0:
+        if current == 0:
+            return 0.0
+        worse = current > 0 if better == "lower" else current < 0
+        return float("inf") if worse else float("-inf")
+    change = (current - base) / abs(base)
+    return change if better == "lower" else -change
+
+def compare_reports(
+    base: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float = DEFAULT_THRESHOLD,
+    overrides: Optional[Dict[str, float]] = None,
+    patterns: Optional[Sequence[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    overrides: حد خاص لمقاييس معينة (نمط fnmatch -> حد)، مثل {"*.p99_us": 0.3}.
+    patterns: مقارنة المقاييس المطابقة فقط.
+    """
+    overrides = overrides or {}
+    rows = []
+    for name, base_metric in sorted(base["metrics"].items()):
+        if patterns and not any(fnmatch.fnmatch(name, p) for p in patterns):
+            continue
+        current_metric = current["metrics"].get(name)
+        if current_metric is None:
+            rows.append({"metric": name, "status": "missing"})
+            continue
+        better = base_metric.get("better", "lower")
+        limit = threshold
+        for pattern, value in overrides.items():
+            if fnmatch.fnmatch(name, pattern):
+                limit = value
+        regression = relative_regression(base_metric["value"], current_metric["value"], better)
+        rows.append({
+            "metric": name,
+            "unit": base_metric.get("unit", ""),
+            "base": base_metric["value"],
+            "current": current_metric["value"],
+            "regression": regression,
+            "threshold": limit,
+            "status": "regressed" if regression > limit else ("improved" if regression < -limit else "ok"),
+        })
+    return rows
+
+def _parse_overrides(values: Sequence[str]) -> Dict[str, float]:
+    overrides = {}
+    for value in values:
+        pattern, _, limit = value.partition("=")
+        if not limit:
+            raise ValueError(f"expected PATTERN=THRESHOLD, got {value}")
+        overrides[pattern] = float(limit)
+    return overrides
+
+def format_rows(rows: List[Dict[str, Any]]) -> str:
+    lines = []
+    for row in rows:
+        if row["status"] == "missing":
+            lines.append(f"  [MISSING  ] {row['metric']}")
+            continue
+        change = row["regression"]
+        change_text = f"{abs(change):.1%}" if abs(change) != float("inf") else "inf"
+        direction = "worse" if change > 0 else "better"
+        lines.append(
+            f"  [{row['status'].upper():<9}] {row['metric']}: {row['base']} -> {row['current']} {row['unit']}"
+            f" ({direction} by {change_text}, limit {row['threshold']:.0%})"
+        )
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sys
+    
+    parser = argparse.ArgumentParser(description="مقارنة تقرير قياس بالأساس وفشل عند التراجع")
+    parser.add_argument("base", help="تقرير الأساس (JSON)")
+    parser.add_argument("current", help="التقرير الجديد (JSON)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="أقصى تراجع مسموح (0.10 = 10%%)")
+    parser.add_argument("--metric-threshold", action="append", default=[], metavar="PATTERN=THRESHOLD",
+                        help='حد خاص لمقاييس معينة، مثل "*.p99_us=0.3"')
+    parser.add_argument("--metrics", nargs="*", help="أنماط المقاييس المطلوب مقارنتها فقط (fnmatch)")
+    parser.add_argument("--allow-missing", action="store_true", help="ما نفشل لو مقياس ناقص في التقرير الجديد")
+    parser.add_argument("--json", action="store_true", help="طباعة النتيجة JSON")
+    args = parser.parse_args()
+    
+    base_report = load_report(args.base)
+    current_report = load_report(args.current)
+    if base_report.get("suite") != current_report.get("suite"):
+        print(f"[Compare] suite mismatch: {base_report.get('suite')} vs {current_report.get('suite')}")
+        sys.exit(2)
+    
+    rows = compare_reports(
+        base_report, current_report, args.threshold, _parse_overrides(args.metric_threshold), args.metrics
+    )
+    regressed = [row for row in rows if row["status"] == "regressed"]
+    missing = [row for row in rows if row["status"] == "missing"]
+    
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2, default=str))
+    else:
+        print(format_rows(rows))
+        print(f"[Compare] {len(rows)} metrics, {len(regressed)} regressed, {len(missing)} missing")
+    
+    if regressed or (missing and not args.allow_missing):
+        sys.exit(1)
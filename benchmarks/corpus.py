@@ -0,0 +1,149 @@
+import json
+import random
+from typing import Any, Dict, Iterator, List, Tuple
+
+# ==========================
+# مولّد رسائل اصطناعية لعدة مستخدمين (عربي / إنجليزي / مختلط)
+# ==========================
+# نفس seed = نفس الرسائل بنفس الترتيب، فنتائج القياس قابلة للمقارنة بين التشغيلات.
+# نشاط المستخدمين غير متساوي (Zipf): قلة نشطين جدًا وكثير نادرين، مثل الاستخدام الحقيقي،
+# فالكاش والقاعدة يشوفون نفس التوزيع اللي بيشوفونه في الإنتاج.
+
+# قوالب بحسب الموضوع: كل موضوع يضرب كلمات مفتاحية مختلفة (مهارات / توصيات ECU / وسائط)
+TOPICS: Dict[str, Dict[str, List[str]]] = {
+    "engineering": {
+        "ar": [
+            "عندي مشكلة في ضغط التوربو بعد تعديل الخرائط والسيارة {car}",
+            "طلع لي رمز {dtc} على {car} وش التشخيص المناسب؟",
+            "ابغى برمجة ECU لسيارتي {car} مع رفع البوست شوي",
+            "الكمبيوتر يعطي رمز {dtc} بعد ما ركبت بخاخات جديدة",
+            "كيف أضبط خريطة الوقود والتوقيت على {car} بدون ما أخرب المحرك؟",
+        ],
+        "en": [
+            "my {car} throws {dtc} after the boost upgrade, any idea?",
+            "need an ecu remap for {car}, boost is dropping at high rpm",
+            "dtc {dtc} keeps coming back, injector or coil?",
+            "how do I tune the boost map safely on a {car}",
+        ],
+    },
+    "code": {
+        "ar": [
+            "ابغى كود بايثون يقرأ بيانات الحساسات من {car}",
+            "عندي script يحلل سجلات المحرك، كيف أسرعه؟",
+            "ساعدني في برمجة API صغير يحفظ رموز الأعطال",
+        ],
+        "en": [
+            "write code that parses OBD logs from a {car}",
+            "my python script for the dashboard is slow, how to profile it?",
+            "code review please: sqlite queries for fault codes",
+        ],
+    },
+    "design": {
+        "ar": [
+            "فكرة تصميم واجهة لتطبيق تشخيص السيارات",
+            "ابغى رسم مخطط للنظام كامل مع الواجهة",
+            "تصميم منصة لورش الصيانة، وش أفضل UX؟",
+        ],
+        "en": [
+            "ui ideas for a car diagnostics platform",
+            "draw a diagram of the system architecture",
+            "ux review for the mobile app design please",
+        ],
+    },
+    "chat": {
+        "ar": [
+            "مرحبا، كيف الحال؟",
+            "شكرًا على المساعدة",
+            "طيب وبعدين؟",
+            "تمام فهمت",
+        ],
+        "en": [
+            "hi there",
+            "thanks!",
+            "ok got it",
+            "what else should I check?",
+        ],
+    },
+}
+
+# نسب المواضيع (مجموعها 1)
+TOPIC_WEIGHTS = {"engineering": 0.4, "code": 0.2, "design": 0.15, "chat": 0.25}
+
+CARS = ["كامري 2018", "Supra MK4", "GTR R35", "لاندكروزر", "Golf GTI", "BMW 335i", "سوناتا", "Civic Type R"]
+DTC_CODES = ["P0300", "P0171", "P0299", "P0420", "P0101", "P0234", "U0100", "B1342", "C0035"]
+
+def _fill(template: str, rng: random.Random) -> str:
+    return template.format(car=rng.choice(CARS), dtc=rng.choice(DTC_CODES))
+
+def _zipf_weights(count: int, exponent: float) -> List[float]:
+    return [1.0 / (rank ** exponent) for rank in range(1, count + 1)]
+
+def make_message(rng: random.Random, arabic_ratio: float = 0.6, mixed_ratio: float = 0.15) -> str:
+    topic = rng.choices(list(TOPIC_WEIGHTS), weights=list(TOPIC_WEIGHTS.values()))[0]
+    templates = TOPICS[topic]
+    roll = rng.random()
+    if roll < mixed_ratio:
+        # رسالة مختلطة: جملة عربية + جملة إنجليزية
+        return _fill(rng.choice(templates["ar"]), rng) + " - " + _fill(rng.choice(templates["en"]), rng)
+    language = "ar" if roll < mixed_ratio + arabic_ratio else "en"
+    return _fill(rng.choice(templates[language]), rng)
+
+def generate_corpus(
+    users: int = 100,
+    messages: int = 1000,
+    seed: int = 42,
+    zipf_exponent: float = 1.1,
+    arabic_ratio: float = 0.6,
+    mixed_ratio: float = 0.15,
+    user_prefix: str = "bench_user"
+) -> Iterator[Tuple[str, str]]:
+    """يولّد (user_id, message) بالترتيب. نفس المعاملات = نفس الناتج."""
+    rng = random.Random(seed)
+    user_ids = [f"{user_prefix}_{i:05d}" for i in range(users)]
+    weights = _zipf_weights(users, zipf_exponent)
+    for _ in range(messages):
+        user_id = rng.choices(user_ids, weights=weights)[0]
+        yield user_id, make_message(rng, arabic_ratio, mixed_ratio)
+
+def corpus_stats(items: List[Tuple[str, str]]) -> Dict[str, Any]:
+    per_user: Dict[str, int] = {}
+    arabic = 0
+    for user_id, message in items:
+        per_user[user_id] = per_user.get(user_id, 0) + 1
+        if any("؀" <= ch <= "ۿ" for ch in message):
+            arabic += 1
+    counts = sorted(per_user.values(), reverse=True)
+    return {
+        "messages": len(items),
+        "active_users": len(per_user),
+        "top_user_messages": counts[0] if counts else 0,
+        "arabic_share": round(arabic / len(items), 3) if items else 0.0,
+    }
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    
+    parser = argparse.ArgumentParser(description="توليد رسائل اختبار (NDJSON: user_id + message)")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--zipf", type=float, default=1.1, help="أس توزيع نشاط المستخدمين")
+    parser.add_argument("--arabic-ratio", type=float, default=0.6)
+    parser.add_argument("--mixed-ratio", type=float, default=0.15)
+    parser.add_argument("--out", default="-", help="ملف الناتج (- = stdout)")
+    parser.add_argument("--stats", action="store_true", help="طباعة ملخص التوزيع على stderr")
+    args = parser.parse_args()
+    
+    items = list(generate_corpus(
+        args.users, args.messages, args.seed, args.zipf, args.arabic_ratio, args.mixed_ratio
+    ))
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    try:
+        for user_id, message in items:
+            out.write(json.dumps({"user_id": user_id, "message": message}, ensure_ascii=False) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if args.stats:
+        print(json.dumps(corpus_stats(items), ensure_ascii=False), file=sys.stderr)
@@ -0,0 +1,363 @@
+import http.client
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.report import (
+    REPO_ROOT, build_report, db_files_size, metric, summarize, use_workspace, write_report
+)
+
+# ==========================
+# ضغط مستمر على FastAPI محليًا (python -m benchmarks.load)
+# ==========================
+# - يشغّل api_server بـ uvicorn في مجلد مؤقت (أو يستخدم --url لسيرفر شغال)
+# - concurrency خيوط، كل خيط باتصال keep-alive واحد (http.client، بدون مكتبات إضافية)
+# - كل --interval ثانية: عدد الطلبات، p95، وحجم ملفات القاعدة (نمو القاعدة مع الوقت)
+# - التقرير: throughput + p50/p95/p99 + أخطاء + نمو القاعدة لكل طلب
+
+ENDPOINTS = {
+    "analyze": "/analyze",
+    "stream": "/analyze/stream",
+}
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(workdir: str, port: int, workers: int = 1, env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    # نفس مسار الإنتاج (python api_server.py): ترقية المخطط مرة وحدة ثم الـ Workers
+    server_env = dict(os.environ)
+    server_env["PYTHONPATH"] = REPO_ROOT + os.pathsep + server_env.get("PYTHONPATH", "")
+    server_env.update(env or {})
+    cmd = [
+        sys.executable, os.path.join(REPO_ROOT, "api_server.py"),
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning",
+    ]
+    return subprocess.Popen(cmd, cwd=workdir, env=server_env)
+
+def wait_ready(base_url: str, timeout: float = 30.0, process: Optional[subprocess.Popen] = None) -> Dict[str, Any]:
+    """انتظار GET /ready = 200، وترجع جسم الرد (cold_start_ms وغيره لأول Worker رد)."""
+    parts = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=2)
+            conn.request("GET", "/ready")
+            response = conn.getresponse()
+            body = response.read()
+            conn.close()
+            if response.status == 200:
+                return json.loads(body)
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"server at {base_url} not ready after {timeout}s")
+
+class _Recorder:
+    """نتائج كل الخيوط: (وقت الانتهاء، الزمن، ناجح؟) + عدادات."""
+    def __init__(self):
+        self.samples: List[Tuple[float, float, bool]] = []
+        self.errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+    
+    def add(self, finished: float, seconds: float, ok: bool, error: Optional[str] = None):
+        with self._lock:
+            self.samples.append((finished, seconds, ok))
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+class _Client:
+    def __init__(self, base_url: str, endpoint: str, context_mode: Optional[str], timeout: float):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = ENDPOINTS[endpoint]
+        self.context_mode = context_mode
+        self.timeout = timeout
+        self.conn: Optional[http.client.HTTPConnection] = None
+    
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.conn.connect()
+            # بدون Nagle: طلبات صغيرة متتالية على نفس الاتصال ما تنتظر delayed ACK
+            self.conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self.conn
+    
+    def send(self, user_id: str, message: str) -> Tuple[bool, Optional[str]]:
+        payload: Dict[str, Any] = {"user_id": user_id, "message": message}
+        if self.context_mode:
+            payload["context_mode"] = self.context_mode
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        try:
+            conn = self._connection()
+            conn.request("POST", self.path, body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            # قراءة الرد كامل (للـ stream = كل المراحل) قبل إيقاف الساعة
+            response.read()
+            if response.status != 200:
+                return False, f"http_{response.status}"
+            return True, None
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            return False, e.__class__.__name__
+    
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+def _worker(
+    client: _Client,
+    items: Iterator[Tuple[str, str]],
+    items_lock: threading.Lock,
+    recorder: Optional[_Recorder],
+    deadline: float,
+    interval_s: float
+):
+    next_at = time.perf_counter()
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        if interval_s > 0:
+            # --rate: كل خيط يرسل بفاصل ثابت (open-loop تقريبي)
+            if now < next_at:
+                time.sleep(min(next_at - now, deadline - now))
+                continue
+            next_at += interval_s
+        with items_lock:
+            user_id, message = next(items)
+        start = time.perf_counter()
+        ok, error = client.send(user_id, message)
+        finished = time.perf_counter()
+        if recorder is not None:
+            recorder.add(finished, finished - start, ok, error)
+    client.close()
+
+def _drive(
+    base_url: str,
+    items: Iterator[Tuple[str, str]],
+    concurrency: int,
+    duration: float,
+    endpoint: str,
+    context_mode: Optional[str],
+    rate: float,
+    timeout: float,
+    recorder: Optional[_Recorder]
+) -> float:
+    items_lock = threading.Lock()
+    interval_s = concurrency / rate if rate > 0 else 0.0
+    started = time.perf_counter()
+    deadline = started + duration
+    threads = [
+        threading.Thread(
+            target=_worker,
+            args=(_Client(base_url, endpoint, context_mode, timeout), items, items_lock, recorder, deadline, interval_s),
+            daemon=True,
+        )
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return started
+
+def _timeline(samples: List[Tuple[float, float, bool]], started: float, interval: float, sizes: List[Tuple[float, int]]) -> List[Dict[str, Any]]:
+    buckets: Dict[int, List[float]] = {}
+    for finished, seconds, ok in samples:
+        if ok:
+            buckets.setdefault(int((finished - started) // interval), []).append(seconds)
+    timeline = []
+    for index, (at, size) in enumerate(sizes):
+        latencies = buckets.get(index, [])
+        summary = summarize(latencies, scale=1e3)
+        timeline.append({
+            "t": round(at - started, 1),
+            "requests": len(latencies),
+            "rps": round(len(latencies) / interval, 1),
+            "p95_ms": summary["p95"],
+            "db_bytes": size,
+        })
+    return timeline
+
+def run_load(
+    base_url: str,
+    db_dir: Optional[str],
+    duration: float = 30.0,
+    concurrency: int = 8,
+    users: int = 200,
+    seed: int = 42,
+    endpoint: str = "analyze",
+    context_mode: Optional[str] = None,
+    rate: float = 0.0,
+    warmup: float = 3.0,
+    interval: float = 5.0,
+    timeout: float = 30.0
+) -> Dict[str, Any]:
+    # رسائل لا نهائية بنفس الترتيب لنفس seed
+    items = itertools.chain.from_iterable(
+        generate_corpus(users, 10000, seed + round_) for round_ in itertools.count()
+    )
+    
+    if warmup > 0:
+        _drive(base_url, items, concurrency, warmup, endpoint, context_mode, rate, timeout, None)
+    
+    recorder = _Recorder()
+    size_before = db_files_size(db_dir) if db_dir else 0
+    sizes: List[Tuple[float, int]] = []
+    stop = threading.Event()
+    began = time.perf_counter()
+    
+    def sample_sizes():
+        # حجم القاعدة في نهاية كل فترة
+        while not stop.wait(interval):
+            sizes.append((time.perf_counter(), db_files_size(db_dir) if db_dir else 0))
+    
+    sampler = threading.Thread(target=sample_sizes, daemon=True)
+    sampler.start()
+    started = _drive(base_url, items, concurrency, duration, endpoint, context_mode, rate, timeout, recorder)
+    stop.set()
+    sampler.join()
+    elapsed = time.perf_counter() - started
+    size_after = db_files_size(db_dir) if db_dir else 0
+    
+    ok_latencies = [seconds for _, seconds, ok in recorder.samples if ok]
+    total = len(recorder.samples)
+    failed = total - len(ok_latencies)
+    summary = summarize(ok_latencies, scale=1e3)
+    throughput = round(len(ok_latencies) / elapsed, 1) if elapsed > 0 else 0.0
+    growth = size_after - size_before
+    
+    metrics = {
+        "load.throughput_rps": metric(throughput, "req/s", "higher"),
+        "load.p50_ms": metric(summary["p50"], "ms", "lower"),
+        "load.p95_ms": metric(summary["p95"], "ms", "lower"),
+        "load.p99_ms": metric(summary["p99"], "ms", "lower"),
+        "load.error_rate": metric(round(failed / total, 4) if total else 0.0, "ratio", "lower"),
+    }
+    if db_dir:
+        metrics["load.db_bytes_per_request"] = metric(
+            round(growth / len(ok_latencies), 1) if ok_latencies else 0.0, "bytes", "lower"
+        )
+    
+    return build_report(
+        "load",
+        metrics,
+        params={
+            "url": base_url, "endpoint": endpoint, "duration_s": duration, "concurrency": concurrency,
+            "users": users, "seed": seed, "context_mode": context_mode, "rate": rate,
+            "warmup_s": warmup, "interval_s": interval,
+        },
+        details={
+            "requests": total,
+            "ok": len(ok_latencies),
+            "errors": recorder.errors,
+            "elapsed_s": round(elapsed, 3),
+            "latency_ms": summary,
+            "db_bytes_before": size_before,
+            "db_bytes_after": size_after,
+            "db_growth_bytes": growth,
+            "timeline": _timeline(recorder.samples, began, interval, sizes),
+        },
+    )
+
+def serve_and_load(workdir: str, workers: int, **load_options) -> Dict[str, Any]:
+    """سيرفر محلي جديد بعدد Workers معين + run_load، مع زمن الإقلاع (تشغيل العملية -> /ready)."""
+    base_url = f"http://127.0.0.1:{free_port()}"
+    started = time.perf_counter()
+    process = start_server(workdir, urlsplit(base_url).port, workers)
+    try:
+        ready = wait_ready(base_url, process=process)
+        cold_start_ms = round((time.perf_counter() - started) * 1000, 1)
+        report = run_load(base_url, workdir, **load_options)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    report["metrics"]["load.cold_start_ms"] = metric(cold_start_ms, "ms", "lower")
+    report["meta"]["params"]["server_workers"] = workers
+    report["details"]["server_ready"] = ready
+    return report
+
+def workers_sweep(workdir: str, counts: List[int], **load_options) -> Dict[str, Any]:
+    """
+    نفس الحمل على 1..N Workers (كل مرة ملفات جديدة): throughput لكل عدد + الكفاءة
+    (throughput(N) / (N * throughput(أول عدد))، 1.0 = تدرج خطي مع الأنوية).
+    """
+    metrics: Dict[str, Any] = {}
+    runs = {}
+    base_throughput = None
+    for count in counts:
+        run_dir = os.path.join(workdir, f"workers_{count}")
+        os.makedirs(run_dir, exist_ok=True)
+        report = serve_and_load(run_dir, count, **load_options)
+        runs[count] = report
+        for name, value in report["metrics"].items():
+            metrics[name.replace("load.", f"load.workers_{count}.", 1)] = value
+        throughput = report["metrics"]["load.throughput_rps"]["value"]
+        if base_throughput is None:
+            base_throughput = (counts[0], throughput)
+        elif base_throughput[1] > 0:
+            efficiency = throughput / (base_throughput[1] * count / base_throughput[0])
+            metrics[f"load.workers_{count}.scaling_efficiency"] = metric(round(efficiency, 3), "ratio", "higher")
+    return build_report(
+        "load",
+        metrics,
+        params={**runs[counts[0]]["meta"]["params"], "server_workers": counts, "cpu_count": os.cpu_count()},
+        details={f"workers_{count}": report["details"] for count, report in runs.items()},
+    )
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="ضغط مستمر على Hawsa AI API")
+    parser.add_argument("--url", help="سيرفر شغال (مثلاً http://127.0.0.1:8000). بدونه يتشغل سيرفر محلي مؤقت")
+    parser.add_argument("--db-dir", help="مجلد ملفات القاعدة للسيرفر الخارجي (لقياس النمو)")
+    parser.add_argument("--workdir", help="مجلد السيرفر المحلي (الافتراضي: مجلد مؤقت جديد)")
+    parser.add_argument("--server-workers", type=int, default=1)
+    parser.add_argument("--workers-sweep", type=int, nargs="+", metavar="N",
+                        help="قياس التدرج: نفس الحمل على كل عدد Workers (مثلاً 1 2 4)")
+    parser.add_argument("--duration", type=float, default=30.0, help="مدة القياس بالثواني")
+    parser.add_argument("--warmup", type=float, default=3.0, help="ثواني إحماء غير محسوبة")
+    parser.add_argument("--interval", type=float, default=5.0, help="فترة الـ timeline بالثواني")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=0.0, help="طلبات/ثانية إجمالي (0 = أقصى سرعة)")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="analyze")
+    parser.add_argument("--context-mode", choices=["compact", "ids", "full"])
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--out", default="-", help="ملف التقرير JSON (- = stdout)")
+    args = parser.parse_args()
+    
+    out = args.out if args.out == "-" else os.path.abspath(args.out)
+    load_options = dict(
+        duration=args.duration, concurrency=args.concurrency, users=args.users, seed=args.seed,
+        endpoint=args.endpoint, context_mode=args.context_mode, rate=args.rate,
+        warmup=args.warmup, interval=args.interval, timeout=args.timeout,
+    )
+    if args.url:
+        base_url = args.url.rstrip("/")
+        wait_ready(base_url)
+        report = run_load(base_url, os.path.abspath(args.db_dir) if args.db_dir else None, **load_options)
+    elif args.workers_sweep:
+        report = workers_sweep(use_workspace(args.workdir), args.workers_sweep, **load_options)
+    else:
+        report = serve_and_load(use_workspace(args.workdir), args.server_workers, **load_options)
+    write_report(report, out)
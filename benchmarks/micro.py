@@ -0,0 +1,146 @@
+import gc
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.report import build_report, metric, summarize, use_workspace, write_report
+
+# ==========================
+# قياس الدوال الساخنة داخل العملية (python -m benchmarks.micro)
+# ==========================
+# كل حالة تُستدعى على رسائل الـ corpus بالترتيب، وكل استدعاء ينقاس لوحده بـ perf_counter.
+# setup (لو موجود) يشتغل قبل كل استدعاء وخارج القياس (مثل مسح الكاش لقياس القراءة من القاعدة).
+
+Case = Tuple[str, Callable[[str, str], Any], Optional[Callable[[str, str], Any]]]
+
+def time_calls(
+    fn: Callable[[str, str], Any],
+    items: Sequence[Tuple[str, str]],
+    iterations: int,
+    warmup: int,
+    setup: Optional[Callable[[str, str], Any]] = None
+) -> List[float]:
+    # استدعاء لكل مستخدم قبل الإحماء: أول لمسة للمستخدم (cache miss) ما تدخل في القياس
+    for user_id, message in {user_id: message for user_id, message in items}.items():
+        if setup is not None:
+            setup(user_id, message)
+        fn(user_id, message)
+    for i in range(warmup):
+        user_id, message = items[i % len(items)]
+        if setup is not None:
+            setup(user_id, message)
+        fn(user_id, message)
+    
+    latencies = []
+    # GC أثناء القياس يضيف قفزات عشوائية في p99 ما لها علاقة بالكود المقاس
+    gc_was_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        for i in range(iterations):
+            user_id, message = items[i % len(items)]
+            if setup is not None:
+                setup(user_id, message)
+            start = time.perf_counter()
+            fn(user_id, message)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return latencies
+
+def seed_history(core, items: Sequence[Tuple[str, str]], chunk: int = 2000):
+    """سجل سابق لكل مستخدم (رسالة + رد قصير) حتى يكون للسياق والبحث بيانات حقيقية."""
+    rows = []
+    for user_id, message in items:
+        rows.append((user_id, "user", message, ["input"], None))
+        rows.append((user_id, "assistant", "تم تحليل الطلب: " + message, ["response"], None))
+    for start in range(0, len(rows), chunk):
+        core.memory.save_interactions(rows[start:start + chunk])
+    core.flush()
+
+def build_cases(core) -> List[Case]:
+    memory = core.memory
+    analytics = core.user_analytics
+    
+    return [
+        ("keywords.scan", lambda u, m: core.keywords.scan(m), None),
+        ("analyze_user_message", lambda u, m: analytics.analyze_user_message(u, m), None),
+        ("infer_profile", lambda u, m: analytics.infer_profile(u, m), None),
+        ("get_recent_context.cached", lambda u, m: memory.get_recent_context(u, 6), None),
+        # القراءة من SQLite: الكاش ينمسح قبل كل استدعاء (خارج القياس)
+        ("get_recent_context.db", lambda u, m: memory.get_recent_context(u, 6),
+         lambda u, m: memory.invalidate_cache(u)),
+        ("search_interactions", lambda u, m: memory.search_interactions(u, m), None),
+        ("_route_to_skill", lambda u, m: core._route_to_skill(m), None),
+        ("get_ecu_recommendations", lambda u, m: core.engineering_data.get_ecu_recommendations("UNKNOWN", m), None),
+        ("process_comprehensive_query", lambda u, m: core.process_comprehensive_query(u, m), None),
+    ]
+
+def run_micro(
+    users: int = 200,
+    history: int = 20000,
+    iterations: int = 2000,
+    warmup: int = 200,
+    seed: int = 42,
+    only: Optional[Sequence[str]] = None,
+    write_behind: bool = False
+) -> Dict[str, Any]:
+    from hawsa_core import HawsaCore
+    
+    core = HawsaCore(write_behind=write_behind)
+    try:
+        seed_history(core, list(generate_corpus(users, history, seed)))
+        # رسائل القياس من seed مختلف (نفس المستخدمين)، فما تكون نسخة من السجل
+        items = list(generate_corpus(users, max(iterations, warmup, 1), seed + 1))
+        
+        metrics: Dict[str, Dict[str, Any]] = {}
+        details: Dict[str, Any] = {}
+        for name, fn, setup in build_cases(core):
+            if only and name not in only:
+                continue
+            latencies = time_calls(fn, items, iterations, warmup, setup)
+            summary = summarize(latencies)
+            details[name] = summary
+            for key in ("p50", "p95", "p99"):
+                metrics[f"{name}.{key}_us"] = metric(summary[key], "us", "lower")
+            total = sum(latencies)
+            metrics[f"{name}.ops_per_s"] = metric(
+                round(len(latencies) / total, 1) if total else 0.0, "ops/s", "higher"
+            )
+            print(f"[Bench] {name}: p50={summary['p50']}us p95={summary['p95']}us p99={summary['p99']}us")
+        core.flush()
+        return build_report(
+            "micro",
+            metrics,
+            params={
+                "users": users, "history": history, "iterations": iterations,
+                "warmup": warmup, "seed": seed, "write_behind": write_behind,
+            },
+            details=details,
+        )
+    finally:
+        core.close()
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    
+    parser = argparse.ArgumentParser(description="قياس الدوال الساخنة في HawsaCore")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--history", type=int, default=20000, help="عدد الرسائل السابقة المحفوظة قبل القياس")
+    parser.add_argument("--iterations", type=int, default=2000, help="عدد الاستدعاءات المقاسة لكل حالة")
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", nargs="*", help="أسماء الحالات المطلوبة فقط")
+    parser.add_argument("--write-behind", action="store_true")
+    parser.add_argument("--workdir", help="مجلد ملفات القاعدة (الافتراضي: مجلد مؤقت جديد)")
+    parser.add_argument("--out", default="-", help="ملف التقرير JSON (- = stdout)")
+    args = parser.parse_args()
+    
+    out = args.out if args.out == "-" else os.path.abspath(args.out)
+    use_workspace(args.workdir)
+    report = run_micro(
+        args.users, args.history, args.iterations, args.warmup, args.seed, args.only, args.write_behind
+    )
+    write_report(report, out)
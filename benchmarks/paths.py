@@ -0,0 +1,134 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.micro import seed_history
+from benchmarks.report import build_report, metric, summarize, use_workspace, write_report
+
+# ==========================
+# المسار المتزامن مقابل async داخل العملية (python -m benchmarks.paths)
+# ==========================
+# نفس الرسائل بنفس التوازي على نسختين من HawsaCore:
+# - sync:  process_comprehensive_query على خيوط (مثل endpoint عادي في threadpool الخاص بـ FastAPI)
+# - async: aprocess_comprehensive_query على event loop واحد (مثل POST /analyze)
+# --skill-latency-ms يضيف مهارة تنتظر (مثل API خارجي)، وهي الحالة اللي يفرق فيها المسار async.
+
+def _slow_skill(latency_s: float):
+    from hawsa_core import BaseSkill
+
+    class SlowLookupSkill(BaseSkill):
+        """مهارة تنتظر latency_s (I/O خارجي) لكل رسالة فيها كلمة شائعة في الـ corpus."""
+        KEYWORDS = ["boost", "ecu", "p0300", "كود", "تصميم", "code", "design"]
+        PRIORITY = 10
+
+        def handle(self, message, master, match=None):
+            time.sleep(latency_s)
+            return "lookup done"
+
+    return SlowLookupSkill()
+
+def _new_core(workdir: str, skill_latency_ms: float):
+    from hawsa_core import DEFAULT_SKILLS, HawsaCore
+
+    use_workspace(workdir)
+    skills = [cls() for cls in DEFAULT_SKILLS]
+    if skill_latency_ms > 0:
+        skills.append(_slow_skill(skill_latency_ms / 1000.0))
+    return HawsaCore(skills=skills)
+
+def run_sync(core, items: Sequence[Tuple[str, str]], concurrency: int) -> Tuple[float, List[float]]:
+    def one(item):
+        start = time.perf_counter()
+        core.process_comprehensive_query(*item)
+        return time.perf_counter() - start
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one, items))
+    return time.perf_counter() - started, latencies
+
+def run_async(core, items: Sequence[Tuple[str, str]], concurrency: int) -> Tuple[float, List[float]]:
+    async def main():
+        gate = asyncio.Semaphore(concurrency)
+
+        async def one(item):
+            async with gate:
+                start = time.perf_counter()
+                await core.aprocess_comprehensive_query(*item)
+                return time.perf_counter() - start
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(one(item) for item in items))
+        return time.perf_counter() - started, list(latencies)
+
+    return asyncio.run(main())
+
+def run_paths(
+    users: int = 200,
+    history: int = 5000,
+    requests: int = 2000,
+    concurrency: int = 32,
+    skill_latency_ms: float = 0.0,
+    seed: int = 42,
+    workdir: Optional[str] = None
+) -> Dict[str, Any]:
+    import os
+
+    root = use_workspace(workdir)
+    history_items = list(generate_corpus(users, history, seed))
+    items = list(generate_corpus(users, requests, seed + 1))
+
+    metrics: Dict[str, Dict[str, Any]] = {}
+    details: Dict[str, Any] = {}
+    throughput: Dict[str, float] = {}
+    for name, runner in (("sync", run_sync), ("async", run_async)):
+        # كل مسار بملفات قاعدة جديدة وبنفس السجل السابق
+        core = _new_core(os.path.join(root, name), skill_latency_ms)
+        try:
+            seed_history(core, history_items)
+            seconds, latencies = runner(core, items, concurrency)
+            core.flush()
+        finally:
+            core.close()
+        summary = summarize(latencies, scale=1e3)
+        throughput[name] = round(len(items) / seconds, 1) if seconds else 0.0
+        details[name] = dict(summary, seconds=round(seconds, 3))
+        metrics[f"{name}.requests_per_s"] = metric(throughput[name], "req/s", "higher")
+        for key in ("p50", "p95", "p99"):
+            metrics[f"{name}.{key}_ms"] = metric(summary[key], "ms", "lower")
+        print(f"[Bench] {name}: {throughput[name]} req/s p95={summary['p95']}ms")
+    metrics["async_speedup"] = metric(
+        round(throughput["async"] / throughput["sync"], 3) if throughput["sync"] else 0.0, "x", "higher"
+    )
+    return build_report(
+        "paths",
+        metrics,
+        params={
+            "users": users, "history": history, "requests": requests, "concurrency": concurrency,
+            "skill_latency_ms": skill_latency_ms, "seed": seed,
+        },
+        details=details,
+    )
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="مقارنة throughput المسار المتزامن و async في HawsaCore")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--history", type=int, default=5000, help="رسائل سابقة محفوظة قبل القياس")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32, help="طلبات متزامنة (خيوط للمسار sync)")
+    parser.add_argument("--skill-latency-ms", type=float, default=0.0, help="مهارة تنتظر N ms (0 = بدون)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", help="مجلد ملفات القاعدة (الافتراضي: مجلد مؤقت جديد)")
+    parser.add_argument("--out", default="-", help="ملف التقرير JSON (- = stdout)")
+    args = parser.parse_args()
+
+    out = args.out if args.out == "-" else os.path.abspath(args.out)
+    report = run_paths(
+        args.users, args.history, args.requests, args.concurrency, args.skill_latency_ms, args.seed, args.workdir
+    )
+    write_report(report, out)
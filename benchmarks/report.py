@@ -0,0 +1,120 @@
+import glob
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+# ==========================
+# شكل تقرير JSON المشترك بين micro / load / compare
+# ==========================
+# {
+#   "suite": "micro",
+#   "meta": {"created_at": ..., "python": ..., "sqlite": ..., "params": {...}},
+#   "metrics": {"get_recent_context.p95_us": {"value": 12.3, "unit": "us", "better": "lower"}, ...},
+#   "details": {...}    # بيانات إضافية للقراءة فقط (compare ما يستخدمها)
+# }
+
+REPORT_VERSION = 1
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def use_workspace(path: Optional[str] = None) -> str:
+    """
+    الانتقال لمجلد عمل مؤقت (HawsaCore يفتح ملفات القاعدة بمسار نسبي)،
+    فالقياس ما يلمس hawsa_ai_memory.db / hawsa_ai_advanced.db في المستودع.
+    """
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    path = os.path.abspath(path) if path else tempfile.mkdtemp(prefix="hawsa-bench-")
+    os.makedirs(path, exist_ok=True)
+    os.chdir(path)
+    return path
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """percentile بالاستيفاء الخطي (sorted_values مرتبة تصاعديًا)."""
+    if not sorted_values:
+        return 0.0
+    if len(sorted_values) == 1:
+        return float(sorted_values[0])
+    rank = (len(sorted_values) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+def summarize(latencies: List[float], scale: float = 1e6) -> Dict[str, float]:
+    """latencies بالثواني -> mean/p50/p95/p99/max بوحدة scale (الافتراضي ميكروثانية)."""
+    values = sorted(latencies)
+    if not values:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values) * scale, 3),
+        "p50": round(percentile(values, 50) * scale, 3),
+        "p95": round(percentile(values, 95) * scale, 3),
+        "p99": round(percentile(values, 99) * scale, 3),
+        "max": round(values[-1] * scale, 3),
+    }
+
+def metric(value: float, unit: str, better: str = "lower") -> Dict[str, Any]:
+    if better not in ("lower", "higher"):
+        raise ValueError(f"better must be 'lower' or 'higher', got {better}")
+    return {"value": value, "unit": unit, "better": better}
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": sys.version.split()[0],
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def build_report(
+    suite: str,
+    metrics: Dict[str, Dict[str, Any]],
+    params: Optional[Dict[str, Any]] = None,
+    details: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    return {
+        "version": REPORT_VERSION,
+        "suite": suite,
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "params": params or {},
+            **environment(),
+        },
+        "metrics": metrics,
+        "details": details or {},
+    }
+
+def write_report(report: Dict[str, Any], path: Optional[str]):
+    """كتابة التقرير (أو طباعته لو path فاضي / "-")."""
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if not path or path == "-":
+        print(text)
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text + "\n")
+    print(f"[Bench] report written to {path}")
+
+def load_report(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    if "metrics" not in report:
+        raise ValueError(f"{path}: not a benchmark report (missing 'metrics')")
+    return report
+
+def db_files_size(directory: str, names: Sequence[str] = ("hawsa_ai_memory*.db", "hawsa_ai_advanced*.db")) -> int:
+    """حجم ملفات القاعدة + WAL + SHM بالبايت (الأنماط تشمل ملفات HAWSA_DB_SHARDS)."""
+    total = 0
+    for name in names:
+        for path in glob.glob(os.path.join(directory, name)):
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    total += os.path.getsize(path + suffix)
+    return total
@@ -0,0 +1,314 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+
+from hawsa_tracing import REGISTRY
+
+# ==========================
+# التحكم في القبول (admission) أمام خط المعالجة
+# ==========================
+# وقت الضغط الطلبات كانت تتكدس في threadpool حق FastAPI خلف أقفال SQLite لين العميل يقطع ويعيد
+# المحاولة، فيزيد الضغط. هنا:
+# - حد أقصى للطلبات اللي تشتغل فعليًا (MAX_CONCURRENT) لكل Worker
+# - طابور انتظار قصير (MAX_QUEUE) وكل منتظر له مهلة (QUEUE_TIMEOUT)؛ انتهت = 503 بدل انتظار مفتوح
+# - عدالة بين المستخدمين: طابور لكل user_id والمكان الفاضي يروح بالدور (round robin)،
+#   ولكل مستخدم حد لطلباته المفتوحة (شغالة + منتظرة) وبعده 429
+# - الرفض فوري مع Retry-After (تقدير من متوسط زمن الخدمة وطول الطابور)
+
+ADMISSION_ENABLED = os.environ.get("HAWSA_ADMISSION", "1") == "1"
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("HAWSA_ADMISSION_MAX_CONCURRENT", "16"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("HAWSA_ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT_S = float(os.environ.get("HAWSA_ADMISSION_QUEUE_TIMEOUT_S", "2.0"))
+ADMISSION_MAX_PER_USER = int(os.environ.get("HAWSA_ADMISSION_MAX_PER_USER", "4"))
+
+# وزن آخر طلب في متوسط زمن الخدمة (EWMA) لتقدير Retry-After
+_SERVICE_EWMA_ALPHA = 0.2
+
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "hawsa_admission_wait_seconds", "Time a request waited in the admission queue", ("outcome",)
+)
+ADMISSION_ADMITTED = REGISTRY.counter(
+    "hawsa_admission_admitted_total", "Requests admitted to the pipeline", ("queued",)
+)
+ADMISSION_REJECTED = REGISTRY.counter(
+    "hawsa_admission_rejected_total", "Requests rejected by admission control", ("reason",)
+)
+
+class AdmissionRejected(Exception):
+    """
+    الطلب انرفض قبل ما يدخل خط المعالجة.
+    status: 429 (المستخدم عنده طلبات مفتوحة كثير) أو 503 (النظام مشبع / انتهت مهلة الطابور).
+    """
+    def __init__(self, status: int, reason: str, retry_after: int):
+        super().__init__(f"{reason} (retry after {retry_after}s)")
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+class _Waiter:
+    __slots__ = ("user_id", "enqueued_at", "granted", "cancelled", "event", "loop", "future")
+    
+    def __init__(self, user_id: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.user_id = user_id
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+        self.loop = loop
+        self.event = None if loop is not None else threading.Event()
+        self.future = loop.create_future() if loop is not None else None
+    
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+    
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+class _Ticket:
+    """مكان محجوز في خط المعالجة؛ release() (أو with) يرجعه للي بعده."""
+    __slots__ = ("controller", "user_id", "started", "released")
+    
+    def __init__(self, controller: "AdmissionController", user_id: str):
+        self.controller = controller
+        self.user_id = user_id
+        self.started = time.monotonic()
+        self.released = False
+    
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+class AdmissionController:
+    """
+    بوابة قبول آمنة بين الخيوط ومع asyncio:
+        with controller.acquire(user_id): ...                # خيط عادي (ينتظر بمهلة)
+        async with await controller.aacquire(user_id): ...   # event loop (بدون حجز خيط)
+    max_concurrent <= 0 = بدون حد (كل الطلبات تنقبل فورًا).
+    """
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        max_per_user: Optional[int] = None,
+        metrics_key: str = "hawsa_admission"
+    ):
+        self.max_concurrent = ADMISSION_MAX_CONCURRENT if max_concurrent is None else max_concurrent
+        self.max_queue = ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.queue_timeout = ADMISSION_QUEUE_TIMEOUT_S if queue_timeout is None else queue_timeout
+        self.max_per_user = ADMISSION_MAX_PER_USER if max_per_user is None else max_per_user
+        
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        # user_id -> منتظرين هذا المستخدم بالترتيب؛ ترتيب المفاتيح = دور المستخدمين
+        self._queues: OrderedDict[str, Deque[_Waiter]] = OrderedDict()
+        # طلبات مفتوحة (شغالة + منتظرة) لكل مستخدم
+        self._open: Dict[str, int] = {}
+        self._service_seconds = 0.05
+        
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"user_limit": 0, "queue_full": 0, "queue_timeout": 0}
+        REGISTRY.register_collector(metrics_key, self._collect_metrics)
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0
+    
+    # ---------- داخلي (كل شي تحت self._lock) ----------
+    
+    def _retry_after_locked(self) -> int:
+        # كم "دفعة" خدمة قبل ما يفضى مكان لطلب جديد
+        rounds = (self._queued + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(rounds * self._service_seconds))
+    
+    def _reject_locked(self, reason: str, status: int) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.inc((reason,))
+        return AdmissionRejected(status, reason, self._retry_after_locked())
+    
+    def _enter_locked(self, user_id: str, loop: Optional[asyncio.AbstractEventLoop]):
+        """يرجع _Ticket (قبول فوري) أو _Waiter (لازم ينتظر)، أو يرمي AdmissionRejected."""
+        if self.max_per_user > 0 and self._open.get(user_id, 0) >= self.max_per_user:
+            raise self._reject_locked("user_limit", 429)
+        # قبول فوري بس لو ما فيه أحد ينتظر (اللي وصل بعدين ما يتقدم على الطابور)
+        if self._active < self.max_concurrent and self._queued == 0:
+            self._active += 1
+            self._open[user_id] = self._open.get(user_id, 0) + 1
+            self._admitted_locked(False)
+            return _Ticket(self, user_id)
+        if self._queued >= self.max_queue:
+            raise self._reject_locked("queue_full", 503)
+        waiter = _Waiter(user_id, loop)
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self._queued += 1
+        self._open[user_id] = self._open.get(user_id, 0) + 1
+        return waiter
+    
+    def _admitted_locked(self, queued: bool):
+        self.admitted += 1
+        ADMISSION_ADMITTED.inc(("true" if queued else "false",))
+    
+    def _close_locked(self, user_id: str):
+        count = self._open.get(user_id, 0) - 1
+        if count > 0:
+            self._open[user_id] = count
+        else:
+            self._open.pop(user_id, None)
+    
+    def _grant_next_locked(self) -> Optional[_Waiter]:
+        # المستخدم اللي عليه الدور ياخذ أقدم طلب له، ثم ينتقل لآخر الدور لو عنده غيره
+        while self._queues and self._active < self.max_concurrent:
+            user_id, waiters = next(iter(self._queues.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            if waiter.cancelled:
+                continue
+            self._queued -= 1
+            self._active += 1
+            waiter.granted = True
+            self._admitted_locked(True)
+            return waiter
+        return None
+    
+    def _cancel_locked(self, waiter: _Waiter) -> bool:
+        """إلغاء منتظر (مهلة / إلغاء). False = كان انقبل قبل الإلغاء بلحظة."""
+        if waiter.granted:
+            return False
+        waiter.cancelled = True
+        self._queued -= 1
+        self._close_locked(waiter.user_id)
+        waiters = self._queues.get(waiter.user_id)
+        if waiters is not None:
+            try:
+                waiters.remove(waiter)
+            except ValueError:
+                pass
+            if not waiters:
+                del self._queues[waiter.user_id]
+        return True
+    
+    def _release(self, ticket: _Ticket):
+        seconds = time.monotonic() - ticket.started
+        with self._lock:
+            self._active -= 1
+            self._close_locked(ticket.user_id)
+            self._service_seconds += _SERVICE_EWMA_ALPHA * (seconds - self._service_seconds)
+            waiter = self._grant_next_locked()
+        if waiter is not None:
+            waiter.wake()
+    
+    def _timed_out(self, waiter: _Waiter) -> AdmissionRejected:
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - waiter.enqueued_at, ("timeout",))
+        with self._lock:
+            return self._reject_locked("queue_timeout", 503)
+    
+    # ---------- الواجهة ----------
+    
+    def acquire(self, user_id: str) -> _Ticket:
+        """حجز مكان (ينتظر في الطابور لين QUEUE_TIMEOUT)، أو AdmissionRejected."""
+        if not self.enabled:
+            return _Ticket(_NO_LIMIT, user_id)
+        with self._lock:
+            entry = self._enter_locked(user_id, None)
+        if isinstance(entry, _Ticket):
+            return entry
+        waiter = entry
+        if not waiter.event.wait(self.queue_timeout):
+            with self._lock:
+                cancelled = self._cancel_locked(waiter)
+            if cancelled:
+                raise self._timed_out(waiter)
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - waiter.enqueued_at, ("admitted",))
+        return _Ticket(self, user_id)
+    
+    async def aacquire(self, user_id: str) -> _Ticket:
+        """نفس acquire لكن الانتظار على الـ event loop بدون حجز خيط."""
+        if not self.enabled:
+            return _Ticket(_NO_LIMIT, user_id)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._enter_locked(user_id, loop)
+        if isinstance(entry, _Ticket):
+            return entry
+        waiter = entry
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                cancelled = self._cancel_locked(waiter)
+            if not cancelled:
+                # انقبل بنفس اللحظة: نرجع المكان (العميل قطع) أو نكمل (المهلة)
+                ticket = _Ticket(self, user_id)
+                if isinstance(e, asyncio.CancelledError):
+                    ticket.release()
+                    raise
+                return ticket
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self._timed_out(waiter)
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - waiter.enqueued_at, ("admitted",))
+        return _Ticket(self, user_id)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "active": self._active,
+                "queue_depth": self._queued,
+                "queued_users": len(self._queues),
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "queue_timeout_s": self.queue_timeout,
+                "max_per_user": self.max_per_user,
+                "avg_service_seconds": round(self._service_seconds, 4),
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+            }
+    
+    def _collect_metrics(self):
+        stats = self.stats()
+        yield "hawsa_admission_active", "gauge", "Requests currently running in the pipeline", [({}, stats["active"])]
+        yield "hawsa_admission_queue_depth", "gauge", "Requests waiting for admission", [({}, stats["queue_depth"])]
+        yield "hawsa_admission_queued_users", "gauge", "Distinct users with queued requests", [({}, stats["queued_users"])]
+        yield "hawsa_admission_limit", "gauge", "Configured admission limits", [
+            ({"limit": "max_concurrent"}, stats["max_concurrent"]),
+            ({"limit": "max_queue"}, stats["max_queue"]),
+            ({"limit": "max_per_user"}, stats["max_per_user"]),
+        ]
+
+class _Unlimited:
+    """بوابة معطلة (HAWSA_ADMISSION=0 أو max_concurrent <= 0): release ما يسوي شي."""
+    def _release(self, ticket: _Ticket):
+        pass
+
+_NO_LIMIT = _Unlimited()
+
+def admission_from_env() -> AdmissionController:
+    # HAWSA_ADMISSION=0 = بدون حد (نفس السلوك القديم)
+    return AdmissionController(max_concurrent=None if ADMISSION_ENABLED else 0)
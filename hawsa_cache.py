@@ -0,0 +1,261 @@
+import copy
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+# ==========================
+# كاش لكل مستخدم داخل العملية (LRU + TTL + سقف ذاكرة)
+# ==========================
+# المستخدم النشط يقرأ سياقه وبروفايله من الذاكرة بدل SQLite. الكتابة تمر على القاعدة أولاً
+# ثم تحدّث الكاش (write-through)، فالكاش ما يرجع بيانات أقدم من آخر كتابة في نفس العملية.
+# TTL يحدد أقصى عمر للقيمة لو تغيرت القاعدة من خارج العملية (أدوات الضغط/الأرشفة مثلاً).
+
+CACHE_MAX_USERS = int(os.environ.get("HAWSA_CACHE_MAX_USERS", "10000"))
+CACHE_TTL_SECONDS = float(os.environ.get("HAWSA_CACHE_TTL_S", "300"))
+CACHE_MAX_MB = float(os.environ.get("HAWSA_CACHE_MAX_MB", "64"))
+CONTEXT_CACHE_ROWS = int(os.environ.get("HAWSA_CONTEXT_CACHE_ROWS", "20"))
+
+# عدة عمليات (Workers) تكتب لنفس الملفات: write-through يغطي كتابات العملية نفسها فقط،
+# فالسياق المخزن يُتحقق من آخر id بالقاعدة قبل استخدامه، وكاش البروفايل يتعطل (api_server --workers)
+# WEB_CONCURRENCY = عدد الـ Workers لما gunicorn/uvicorn يشغلونا مباشرة بدون api_server
+MULTI_PROCESS = int(os.environ.get("HAWSA_WORKERS", os.environ.get("WEB_CONCURRENCY", "1"))) > 1
+
+# عدد شرائح عدادات الكتابة (تمنع تحميل قديم من الكتابة فوق كتابة أحدث)
+_WRITE_STRIPES = 64
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at")
+    
+    def __init__(self, value: Any, size: int, expires_at: float):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+
+class UserCache:
+    """
+    كاش key -> value آمن بين الخيوط بحد لعدد المفاتيح، عمر أقصى، وسقف تقريبي للبايتات.
+    القراءة من القاعدة عند الـ miss تمشي هكذا:
+        token = cache.begin_load(key); value = load(); cache.put(key, value, token)
+    و put يتجاهل القيمة لو صار update لنفس المفتاح بعد begin_load (القيمة المحملة قديمة).
+    """
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        size_of: Optional[Callable[[Any], int]] = None
+    ):
+        self.max_entries = CACHE_MAX_USERS if max_entries is None else max_entries
+        self.ttl_seconds = CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_bytes = int(CACHE_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.size_of = size_of or sys.getsizeof
+        
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._writes = [0] * _WRITE_STRIPES
+        self._bytes = 0
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+    
+    def _stripe(self, key: Hashable) -> int:
+        return hash(key) % _WRITE_STRIPES
+    
+    def _drop(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+    
+    def _store(self, key: Hashable, value: Any):
+        self._drop(key)
+        size = self.size_of(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = _Entry(value, size, time.monotonic() + self.ttl_seconds)
+        self._bytes += size
+        # الأقدم استخدامًا يطلع أول لين نرجع تحت الحدين
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _key, old = self._entries.popitem(last=False)
+            self._bytes -= old.size
+            self.evictions += 1
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+    
+    def begin_load(self, key: Hashable) -> int:
+        with self._lock:
+            return self._writes[self._stripe(key)]
+    
+    def put(self, key: Hashable, value: Any, token: Optional[int] = None):
+        if not self.enabled:
+            return
+        with self._lock:
+            if token is not None and token != self._writes[self._stripe(key)]:
+                return
+            self._store(key, value)
+    
+    def set(self, key: Hashable, value: Any):
+        """write-through بقيمة كاملة (بعد كتابة القاعدة): تلغي أي تحميل جاري لنفس المفتاح."""
+        with self._lock:
+            self._writes[self._stripe(key)] += 1
+            if self.enabled:
+                self._store(key, value)
+    
+    def update(self, key: Hashable, fn: Callable[[Any], Any]):
+        """
+        write-through بعد كتابة القاعدة: fn تستلم القيمة الحالية (لو موجودة) وترجع الجديدة
+        (أو None لحذف المفتاح). لو المفتاح مو بالكاش ما نحمّله، بس نلغي أي تحميل جاري.
+        """
+        with self._lock:
+            self._writes[self._stripe(key)] += 1
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= time.monotonic():
+                self._drop(key)
+                return
+            value = fn(entry.value)
+            if value is None:
+                self._drop(key)
+            else:
+                self._store(key, value)
+    
+    def invalidate(self, key: Optional[Hashable] = None):
+        with self._lock:
+            if key is None:
+                self._writes = [w + 1 for w in self._writes]
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                self._writes[self._stripe(key)] += 1
+                self._drop(key)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+# ==========================
+# حلقة آخر رسائل المستخدم (recent context)
+# ==========================
+
+_ROW_OVERHEAD_BYTES = 400
+
+def context_row_size(row: Dict[str, Any]) -> int:
+    """تقدير تقريبي لحجم صف سياق (dict + نصوص + tags) بالبايت."""
+    size = _ROW_OVERHEAD_BYTES + sys.getsizeof(row.get("content") or "")
+    for tag in row.get("tags") or ():
+        size += sys.getsizeof(tag)
+    return size
+
+class ContextRing:
+    """
+    آخر N صفوف لمستخدم (أقدم -> أحدث) بعد فك tags.
+    complete = الحلقة فيها كل سجل المستخدم (أقل من N صف بالقاعدة)، فأي limit يتخدم منها.
+    الحلقة ما تتعدل بعد إنشائها (append ترجع نسخة)، فالقارئ خارج قفل الكاش يشوف لقطة ثابتة.
+    """
+    __slots__ = ("rows", "complete", "size")
+    
+    def __init__(self, rows: Iterable[Dict[str, Any]], maxlen: int, complete: bool):
+        self.rows: "deque[Dict[str, Any]]" = deque(rows, maxlen=maxlen)
+        self.complete = complete and len(self.rows) < maxlen
+        self.size = sum(context_row_size(r) for r in self.rows)
+    
+    def covers(self, limit: int) -> bool:
+        return limit <= len(self.rows) or self.complete
+    
+    def tail(self, limit: int) -> List[Dict[str, Any]]:
+        # نسخ حتى ما يعدل المستدعي على الصفوف المشتركة
+        rows = list(self.rows)[-limit:] if limit > 0 else []
+        return [dict(row, tags=list(row["tags"])) for row in rows]
+    
+    def append(self, row: Dict[str, Any]) -> "ContextRing":
+        ring = ContextRing.__new__(ContextRing)
+        ring.rows = deque(self.rows, maxlen=self.rows.maxlen)
+        ring.complete = self.complete
+        ring.size = self.size
+        if len(ring.rows) == ring.rows.maxlen:
+            ring.size -= context_row_size(ring.rows[0])
+            ring.complete = False
+        ring.rows.append(row)
+        ring.size += context_row_size(row)
+        return ring
+
+def ring_size(ring: ContextRing) -> int:
+    return ring.size
+
+# البروفايل حجمه شبه ثابت (enums + قائمة اهتمامات قصيرة)
+PROFILE_ENTRY_BYTES = 1024
+
+# ==========================
+# كاش أجزاء الرد (رسائل مكررة: تحية، نفس سؤال DTC، إعادة محاولة من الواجهة)
+# ==========================
+# التوصيات + رد المهارة + النص المخصص + الوسائط تعتمد على نص الرسالة وحقول البروفايل اللي
+# تأثر في الصياغة فقط، فتُحفظ مرة وتنعاد لنفس المفتاح. الحفظ في الذاكرة والبروفايل والسياق
+# يصير لكل طلب كالعادة. المفتاح فيه نسخة المهارات وقاعدة المعرفة، فأي تغيير فيهم = مفاتيح جديدة.
+
+RESPONSE_CACHE_ENTRIES = int(os.environ.get("HAWSA_RESPONSE_CACHE_ENTRIES", "5000"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("HAWSA_RESPONSE_CACHE_TTL_S", "600"))
+RESPONSE_CACHE_MAX_MB = float(os.environ.get("HAWSA_RESPONSE_CACHE_MAX_MB", "32"))
+# رسائل أطول من كذا نادرًا تتكرر، فما نحجز لها مكان
+RESPONSE_CACHE_MAX_MESSAGE_CHARS = int(os.environ.get("HAWSA_RESPONSE_CACHE_MAX_CHARS", "2000"))
+
+def response_key(message: str, *parts: Hashable) -> Optional[Tuple[Hashable, ...]]:
+    """
+    مفتاح الكاش: الرسالة كما وصلت + باقي المكونات. بدون NFC لأن النص المحفوظ يقتبس
+    الرسالة حرفيًا، فنفس الكلام بترميز ثاني (NFD) لازم ياخذ رده الخاص.
+    """
+    if len(message) > RESPONSE_CACHE_MAX_MESSAGE_CHARS:
+        return None
+    return (message, *parts)
+
+class ResponseFragment:
+    """أجزاء الرد المحفوظة؛ كل قراءة ترجع نسخة حتى ما يعدل طلب على طلب ثاني."""
+    __slots__ = ("recommendations", "skill_response", "text", "media", "size")
+    
+    def __init__(self, recommendations: List[Dict[str, Any]], skill_response: Optional[str], text: str, media: Dict[str, Any]):
+        self.recommendations = copy.deepcopy(recommendations)
+        self.skill_response = skill_response
+        self.text = text
+        self.media = copy.deepcopy(media)
+        self.size = (
+            _ROW_OVERHEAD_BYTES * (1 + len(recommendations))
+            + sys.getsizeof(text) + sys.getsizeof(skill_response or "")
+            + sum(sys.getsizeof(str(r.get("description", ""))) for r in recommendations)
+            + sys.getsizeof(str(media.get("content", "")))
+        )
+    
+    def copy(self) -> Tuple[List[Dict[str, Any]], Optional[str], str, Dict[str, Any]]:
+        return copy.deepcopy(self.recommendations), self.skill_response, self.text, copy.deepcopy(self.media)
+
+def fragment_size(fragment: ResponseFragment) -> int:
+    return fragment.size
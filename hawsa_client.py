@@ -0,0 +1,541 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+try:
+    import httpx  # اختياري: للعميل غير المتزامن فقط
+except ImportError:
+    httpx = None
+
+# ==========================
+# عميل Hawsa API (للواجهة وأي مستدعي داخلي)
+# ==========================
+# بدل requests.post لكل ضغطة (اتصال TCP جديد، بدون مهلة ولا إعادة محاولة):
+# - Session واحدة باتصالات keep-alive مجمّعة (HTTPAdapter)، ونسخة async عبر httpx لو موجود
+# - مهلة اتصال + مهلة قراءة لكل طلب
+# - إعادة محاولة بتأخير أُسّي عشوائي (jitter) للحالات الآمنة فقط: فشل الاتصال قبل الإرسال،
+#   و429/503 من بوابة القبول (hawsa_admission.py) مع احترام Retry-After. الطلب اللي وصل للسيرفر
+#   وانقطع أثناء المعالجة ما ينعاد (POST /analyze يحفظ في الذاكرة، والإعادة تكرر التفاعل)
+# - تجميع رسائل متزامنة في طلب /analyze/batch واحد (MicroBatcher) لو السيرفر يدعمه
+# - قراءة /analyze/stream مرحلة مرحلة
+
+API_URL = os.environ.get("HAWSA_API_URL", "http://localhost:8000")
+CLIENT_CONNECT_TIMEOUT_S = float(os.environ.get("HAWSA_CLIENT_CONNECT_TIMEOUT_S", "3"))
+CLIENT_READ_TIMEOUT_S = float(os.environ.get("HAWSA_CLIENT_TIMEOUT_S", "30"))
+CLIENT_RETRIES = int(os.environ.get("HAWSA_CLIENT_RETRIES", "3"))
+CLIENT_BACKOFF_S = float(os.environ.get("HAWSA_CLIENT_BACKOFF_S", "0.2"))
+CLIENT_BACKOFF_MAX_S = float(os.environ.get("HAWSA_CLIENT_BACKOFF_MAX_S", "5"))
+CLIENT_POOL_SIZE = int(os.environ.get("HAWSA_CLIENT_POOL_SIZE", "10"))
+# التجميع: أقصى عدد رسائل في الطلب، وأقصى انتظار لرسائل إضافية بعد أول رسالة
+CLIENT_BATCH_MAX = int(os.environ.get("HAWSA_CLIENT_BATCH_MAX", "32"))
+CLIENT_BATCH_WAIT_MS = float(os.environ.get("HAWSA_CLIENT_BATCH_WAIT_MS", "10"))
+
+# ردود السيرفر اللي معناها "ما بدأت المعالجة، جرب بعدين"
+RETRY_STATUSES = (429, 503)
+
+class HawsaAPIError(Exception):
+    """رد غير ناجح من السيرفر (status = None: فشل اتصال / مهلة)."""
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+def _retry_after(headers) -> Optional[float]:
+    value = headers.get("Retry-After") if headers is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def _error_detail(status: int, text: str) -> str:
+    try:
+        detail = json.loads(text).get("detail")
+    except (ValueError, AttributeError):
+        detail = None
+    return f"HTTP {status}: {detail or text[:200]}"
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None, base: float = CLIENT_BACKOFF_S, cap: float = CLIENT_BACKOFF_MAX_S) -> float:
+    """full jitter: عشوائي بين 0 و min(cap, base*2^attempt)، وبعد Retry-After لو السيرفر حدده."""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay += retry_after
+    return delay
+
+def _payload(user_id: str, message: str, context_mode: Optional[str], timings: Optional[bool]) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {"user_id": user_id, "message": message}
+    if context_mode is not None:
+        payload["context_mode"] = context_mode
+    if timings is not None:
+        payload["timings"] = timings
+    return payload
+
+def _not_sent(error: requests.ConnectionError) -> bool:
+    """
+    فشل قبل ما يوصل الطلب للسيرفر (مهلة اتصال / رفض الاتصال)، فالإعادة آمنة.
+    باقي ConnectionError (RemoteDisconnected / ProtocolError بعد الإرسال) ممكن السيرفر حفظ فيها الطلب.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    # requests يلف خطأ urllib3: MaxRetryError(reason=NewConnectionError) أو NewConnectionError مباشرة
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, NewConnectionError)
+
+def _batch_item_error(result: Dict[str, Any]) -> Optional[HawsaAPIError]:
+    """رسالة ما انحفظت في الدفعة (process_batch يرجع success=False): خطأ مثل analyze العادي."""
+    if result.get("success", True):
+        return None
+    return HawsaAPIError(f"batch item failed: {result.get('error')}", status=500)
+
+def _parse_event(line: str) -> Optional[Tuple[str, Any]]:
+    if not line:
+        return None
+    event = json.loads(line)
+    return event["stage"], event["data"]
+
+class HawsaClient:
+    """
+    عميل متزامن آمن بين الخيوط (requests.Session وحدة لكل نسخة).
+        client = HawsaClient()
+        client.analyze("u1", "boost P0300")
+        for stage, data in client.stream("u1", "..."): ...
+    """
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        pool_size: Optional[int] = None,
+        session: Optional[requests.Session] = None
+    ):
+        self.base_url = (base_url or API_URL).rstrip("/")
+        self.timeout = (
+            CLIENT_CONNECT_TIMEOUT_S if connect_timeout is None else connect_timeout,
+            CLIENT_READ_TIMEOUT_S if read_timeout is None else read_timeout,
+        )
+        self.retries = CLIENT_RETRIES if retries is None else retries
+        pool_size = pool_size or CLIENT_POOL_SIZE
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+        # None = ما نعرف بعد؛ False = السيرفر ما عنده /analyze/batch (نرجع لطلب لكل رسالة)
+        self.batch_supported: Optional[bool] = None
+    
+    def _request(self, method: str, path: str, stream: bool = False, **kwargs) -> requests.Response:
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                response = self.session.request(
+                    method, self.base_url + path, timeout=self.timeout, stream=stream, **kwargs
+                )
+            except requests.ConnectionError as e:
+                # نعيد بس رفض الاتصال / مهلة الاتصال (نفس httpx.ConnectError / ConnectTimeout في العميل async).
+                # انقطاع بعد الإرسال (worker مات أثناء الطلب) ما ينعاد: POST /analyze ممكن حفظ التفاعل
+                if not _not_sent(e) or attempt >= self.retries:
+                    raise HawsaAPIError(f"connection failed: {e}") from e
+            except requests.RequestException as e:
+                raise HawsaAPIError(f"request failed: {e}") from e
+            else:
+                if response.status_code < 400:
+                    return response
+                retry_after = _retry_after(response.headers)
+                error = HawsaAPIError(
+                    _error_detail(response.status_code, response.text), response.status_code, retry_after
+                )
+                response.close()
+                if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    raise error
+            time.sleep(backoff_delay(attempt, retry_after))
+            attempt += 1
+    
+    def analyze(
+        self,
+        user_id: str,
+        message: str,
+        context_mode: Optional[str] = None,
+        timings: Optional[bool] = None
+    ) -> Dict[str, Any]:
+        return self._request("POST", "/analyze", json=_payload(user_id, message, context_mode, timings)).json()
+    
+    def analyze_batch(
+        self,
+        items: List[Tuple[str, str]],
+        context_mode: Optional[str] = None,
+        timings: Optional[bool] = None
+    ) -> List[Dict[str, Any]]:
+        """(user_id, message) كثيرة بطلب واحد؛ النتائج بنفس الترتيب."""
+        body: Dict[str, Any] = {"items": [{"user_id": u, "message": m} for u, m in items]}
+        if context_mode is not None:
+            body["context_mode"] = context_mode
+        if timings is not None:
+            body["timings"] = timings
+        try:
+            results = self._request("POST", "/analyze/batch", json=body).json()["results"]
+        except HawsaAPIError as e:
+            if e.status in (404, 405):
+                self.batch_supported = False
+            raise
+        self.batch_supported = True
+        return results
+    
+    def stream(
+        self,
+        user_id: str,
+        message: str,
+        context: bool = True,
+        context_mode: Optional[str] = None,
+        timings: Optional[bool] = None
+    ) -> Iterator[Tuple[str, Any]]:
+        """(stage, data) لكل مرحلة أول ما توصل (NDJSON)، وآخرها done أو error."""
+        response = self._request(
+            "POST", "/analyze/stream", stream=True,
+            params={"format": "ndjson", "context": "true" if context else "false"},
+            json=_payload(user_id, message, context_mode, timings)
+        )
+        with response:
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    event = _parse_event(line)
+                    if event is not None:
+                        yield event
+            except requests.RequestException as e:
+                # انقطاع في نص الرد (ChunkedEncodingError / ReadTimeout / ConnectionError): ما ينعاد،
+                # المراحل اللي وصلت ممكن تكون انعرضت
+                raise HawsaAPIError(f"stream interrupted: {e}") from e
+    
+    def get(self, path: str, **params) -> Any:
+        """GET لأي مسار قراءة (/ready، /kb، /stats/cache ...)."""
+        return self._request("GET", path, params=params or None).json()
+    
+    def close(self):
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+class MicroBatcher:
+    """
+    تجميع رسائل من عدة خيوط في طلب /analyze/batch واحد:
+    أول رسالة تنتظر لين max_wait_ms أو لين يكتمل max_batch، ثم ترسل كلها.
+    submit() ترجع Future بنتيجة الرسالة نفسها. لو السيرفر ما يدعم batch، كل رسالة تنرسل لحالها.
+    """
+    def __init__(
+        self,
+        client: HawsaClient,
+        max_batch: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+        context_mode: Optional[str] = None
+    ):
+        self.client = client
+        self.max_batch = max_batch or CLIENT_BATCH_MAX
+        self.max_wait = (CLIENT_BATCH_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self.context_mode = context_mode
+        self._pending: List[Tuple[str, str, Future]] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="hawsa-client-batcher", daemon=True)
+        self._thread.start()
+    
+    def submit(self, user_id: str, message: str) -> Future:
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._pending.append((user_id, message, future))
+            self._cond.notify()
+        return future
+    
+    def analyze(self, user_id: str, message: str) -> Dict[str, Any]:
+        return self.submit(user_id, message).result()
+    
+    def _take(self) -> List[Tuple[str, str, Future]]:
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return []
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_batch and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            return batch
+    
+    def _send(self, batch: List[Tuple[str, str, Future]]):
+        if len(batch) > 1 and self.client.batch_supported is not False:
+            try:
+                results = self.client.analyze_batch([(u, m) for u, m, _ in batch], context_mode=self.context_mode)
+            except HawsaAPIError as e:
+                if self.client.batch_supported is not False:
+                    for _, _, future in batch:
+                        future.set_exception(e)
+                    return
+            else:
+                for (_, _, future), result in zip(batch, results):
+                    error = _batch_item_error(result)
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(error)
+                return
+        for user_id, message, future in batch:
+            try:
+                future.set_result(self.client.analyze(user_id, message, context_mode=self.context_mode))
+            except Exception as e:
+                future.set_exception(e)
+    
+    def _run(self):
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            self._send(batch)
+    
+    def close(self):
+        """إرسال المتبقي ثم إيقاف خيط التجميع."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+class AsyncHawsaClient:
+    """
+    نفس HawsaClient لكن asyncio (httpx.AsyncClient باتصالات مجمّعة).
+    batch_wait_ms > 0: استدعاءات analyze المتزامنة تتجمع في /analyze/batch تلقائيًا.
+    """
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        pool_size: Optional[int] = None,
+        batch_wait_ms: float = 0.0,
+        max_batch: Optional[int] = None
+    ):
+        if httpx is None:
+            raise ImportError("AsyncHawsaClient needs httpx (pip install httpx)")
+        self.base_url = (base_url or API_URL).rstrip("/")
+        self.retries = CLIENT_RETRIES if retries is None else retries
+        pool_size = pool_size or CLIENT_POOL_SIZE
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(
+                CLIENT_READ_TIMEOUT_S if read_timeout is None else read_timeout,
+                connect=CLIENT_CONNECT_TIMEOUT_S if connect_timeout is None else connect_timeout
+            ),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            headers={"Content-Type": "application/json"}
+        )
+        self.batch_supported: Optional[bool] = None
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.max_batch = max_batch or CLIENT_BATCH_MAX
+        self._pending: List[Tuple[str, str, Optional[str], asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+    
+    async def _send(self, method: str, path: str, stream: bool = False, **kwargs):
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                request = self.client.build_request(method, path, **kwargs)
+                response = await self.client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                if attempt >= self.retries:
+                    raise HawsaAPIError(f"connection failed: {e}") from e
+            except httpx.HTTPError as e:
+                raise HawsaAPIError(f"request failed: {e}") from e
+            else:
+                if response.status_code < 400:
+                    return response
+                await response.aread()
+                retry_after = _retry_after(response.headers)
+                error = HawsaAPIError(
+                    _error_detail(response.status_code, response.text), response.status_code, retry_after
+                )
+                await response.aclose()
+                if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    raise error
+            await asyncio.sleep(backoff_delay(attempt, retry_after))
+            attempt += 1
+    
+    async def _analyze_one(self, user_id: str, message: str, context_mode: Optional[str], timings: Optional[bool]) -> Dict[str, Any]:
+        response = await self._send("POST", "/analyze", json=_payload(user_id, message, context_mode, timings))
+        return response.json()
+    
+    async def analyze(
+        self,
+        user_id: str,
+        message: str,
+        context_mode: Optional[str] = None,
+        timings: Optional[bool] = None
+    ) -> Dict[str, Any]:
+        if self.batch_wait <= 0 or self.batch_supported is False or timings is not None:
+            return await self._analyze_one(user_id, message, context_mode, timings)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((user_id, message, context_mode, future))
+        if len(self._pending) >= self.max_batch:
+            self._start_flush(delay=0.0)
+        elif self._flush_task is None:
+            self._start_flush(delay=self.batch_wait)
+        return await future
+    
+    def _start_flush(self, delay: float):
+        if delay > 0:
+            self._flush_task = self._spawn(self._flush_later(delay))
+            return
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        batch, self._pending = self._pending, []
+        self._spawn(self._flush(batch))
+    
+    def _spawn(self, coro) -> asyncio.Task:
+        # نحتفظ بمرجع للمهمة لين تخلص (الـ loop يحتفظ بمرجع ضعيف فقط)
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+    
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        batch, self._pending = self._pending, []
+        await self._flush(batch)
+    
+    async def _flush(self, batch):
+        # رسائل بـ context_mode مختلف تنرسل كل مجموعة في طلب
+        groups: Dict[Optional[str], list] = {}
+        for item in batch:
+            groups.setdefault(item[2], []).append(item)
+        for context_mode, items in groups.items():
+            if len(items) > 1 and self.batch_supported is not False:
+                try:
+                    results = await self.analyze_batch([(u, m) for u, m, _, _ in items], context_mode=context_mode)
+                except HawsaAPIError as e:
+                    if self.batch_supported is not False:
+                        for *_, future in items:
+                            if not future.done():
+                                future.set_exception(e)
+                        continue
+                else:
+                    for (*_, future), result in zip(items, results):
+                        if future.done():
+                            continue
+                        error = _batch_item_error(result)
+                        if error is None:
+                            future.set_result(result)
+                        else:
+                            future.set_exception(error)
+                    continue
+            for user_id, message, mode, future in items:
+                try:
+                    result = await self._analyze_one(user_id, message, mode, None)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+    
+    async def analyze_batch(
+        self,
+        items: List[Tuple[str, str]],
+        context_mode: Optional[str] = None,
+        timings: Optional[bool] = None
+    ) -> List[Dict[str, Any]]:
+        body: Dict[str, Any] = {"items": [{"user_id": u, "message": m} for u, m in items]}
+        if context_mode is not None:
+            body["context_mode"] = context_mode
+        if timings is not None:
+            body["timings"] = timings
+        try:
+            response = await self._send("POST", "/analyze/batch", json=body)
+        except HawsaAPIError as e:
+            if e.status in (404, 405):
+                self.batch_supported = False
+            raise
+        self.batch_supported = True
+        return response.json()["results"]
+    
+    async def stream(
+        self,
+        user_id: str,
+        message: str,
+        context: bool = True,
+        context_mode: Optional[str] = None,
+        timings: Optional[bool] = None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        response = await self._send(
+            "POST", "/analyze/stream", stream=True,
+            params={"format": "ndjson", "context": "true" if context else "false"},
+            json=_payload(user_id, message, context_mode, timings)
+        )
+        try:
+            async for line in response.aiter_lines():
+                event = _parse_event(line)
+                if event is not None:
+                    yield event
+        except httpx.HTTPError as e:
+            raise HawsaAPIError(f"stream interrupted: {e}") from e
+        finally:
+            await response.aclose()
+    
+    async def get(self, path: str, **params) -> Any:
+        response = await self._send("GET", path, params=params or None)
+        return response.json()
+    
+    async def aclose(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._pending:
+            batch, self._pending = self._pending, []
+            await self._flush(batch)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.client.aclose()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+        return False
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="إرسال رسالة لـ Hawsa API")
+    parser.add_argument("message")
+    parser.add_argument("--url", default=API_URL)
+    parser.add_argument("--user", default="cli_user")
+    parser.add_argument("--stream", action="store_true", help="عرض المراحل أول ما توصل")
+    args = parser.parse_args()
+    
+    with HawsaClient(args.url) as client:
+        if args.stream:
+            for stage, data in client.stream(args.user, args.message):
+                print(json.dumps({"stage": stage, "data": data}, ensure_ascii=False))
+        else:
+            print(json.dumps(client.analyze(args.user, args.message), ensure_ascii=False, indent=2))
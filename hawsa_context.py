@@ -0,0 +1,170 @@
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# ==========================
+# تجميع context_used بميزانية (compact / ids / full)
+# ==========================
+# ردود المساعد السابقة تحتوي رسائل المستخدم القديمة داخلها، فإرجاع المحتوى الكامل لآخر 6
+# رسائل يكبر الرد مع طول المحادثة. الافتراضي: آخر دور بنص مقصوص، الأقدم بالملخص
+# (عمود summary يُعبأ وقت الحفظ)، وما يتجاوز الميزانية يرجع كمرجع id فقط.
+
+CONTEXT_MODES = ("compact", "ids", "full")
+DEFAULT_CONTEXT_MODE = os.environ.get("HAWSA_CONTEXT_MODE", "compact")
+CONTEXT_BUDGET_CHARS = int(os.environ.get("HAWSA_CONTEXT_BUDGET_CHARS", "1200"))
+CONTEXT_ITEM_CHARS = int(os.environ.get("HAWSA_CONTEXT_ITEM_CHARS", "280"))
+# عدد أحدث العناصر التي تأخذ المحتوى نفسه (مقصوص) بدل الملخص = آخر دور (user + assistant)
+CONTEXT_RECENT_ITEMS = int(os.environ.get("HAWSA_CONTEXT_RECENT_ITEMS", "2"))
+SUMMARY_CHARS = int(os.environ.get("HAWSA_SUMMARY_CHARS", "160"))
+
+_ELLIPSIS = "…"
+
+def clip_text(text: str, max_chars: int) -> Tuple[str, bool]:
+    """
+    توحيد المسافات + قص على حدود كلمة قدر الإمكان مع "…". ترجع (النص، هل انقص).
+    نشتغل على بداية النص فقط، فالكلفة ما تكبر مع طول الرسالة.
+    """
+    text = text or ""
+    head = text[:max(max_chars, 0) + 64]
+    collapsed = " ".join(head.split())
+    if len(head) < len(text) and len(collapsed) <= max_chars:
+        # نادر: مسافات كثيرة في البداية، نرجع للنص كامل
+        head = text
+        collapsed = " ".join(text.split())
+    if len(collapsed) <= max_chars and len(head) == len(text):
+        return collapsed, False
+    if max_chars <= 1:
+        return (_ELLIPSIS if max_chars == 1 else ""), True
+    cut = collapsed[:max_chars - 1]
+    space = cut.rfind(" ")
+    if space > max_chars // 2:
+        cut = cut[:space]
+    return cut.rstrip() + _ELLIPSIS, True
+
+def truncate_text(text: str, max_chars: int) -> str:
+    return clip_text(text, max_chars)[0]
+
+def summarize_text(text: str, max_chars: Optional[int] = None) -> str:
+    """الملخص المخزن في conversation_memory.summary (يُحسب مرة وحدة وقت الحفظ)."""
+    return truncate_text(text, SUMMARY_CHARS if max_chars is None else max_chars)
+
+def resolve_context_mode(mode: Optional[str]) -> str:
+    mode = (mode or DEFAULT_CONTEXT_MODE).lower()
+    if mode not in CONTEXT_MODES:
+        raise ValueError(f"Invalid context mode: {mode} (expected one of {', '.join(CONTEXT_MODES)})")
+    return mode
+
+def assemble_context(
+    rows: List[Dict[str, Any]],
+    mode: Optional[str] = None,
+    budget_chars: Optional[int] = None,
+    item_chars: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    rows: صفوف get_recent_context (أقدم -> أحدث). ترجع عناصر جديدة (ما تشارك dicts مع rows).
+    - full: المحتوى الكامل (الشكل القديم + id)
+    - ids: مراجع فقط (id / role / created_at / tags)
+    - compact: أحدث CONTEXT_RECENT_ITEMS بالمحتوى المقصوص، الأقدم بالملخص،
+      وبعد نفاد budget_chars مراجع فقط. text مجموع أطوالها ما يتجاوز الميزانية.
+    """
+    mode = resolve_context_mode(mode)
+    if mode == "full":
+        items = []
+        for row in rows:
+            item = {
+                "id": row.get("id"),
+                "role": row["role"],
+                "content": row["content"],
+                "created_at": row["created_at"],
+                "tags": list(row["tags"])
+            }
+            if "relevance" in row:
+                item["relevance"] = row["relevance"]
+            items.append(item)
+        return items
+    
+    budget = CONTEXT_BUDGET_CHARS if budget_chars is None else budget_chars
+    item_chars = CONTEXT_ITEM_CHARS if item_chars is None else item_chars
+    
+    items = []
+    for age, row in enumerate(reversed(rows)):
+        item = {
+            "id": row.get("id"),
+            "role": row["role"],
+            "created_at": row["created_at"],
+            "tags": list(row["tags"])
+        }
+        # رسالة قديمة جابها البحث النصي (hawsa_search.py) مو من آخر N
+        if "relevance" in row:
+            item["relevance"] = row["relevance"]
+        if mode == "compact" and budget > 0:
+            content = row["content"] or ""
+            summary = row.get("summary") if age >= CONTEXT_RECENT_ITEMS else None
+            text, clipped = clip_text(summary or content, min(item_chars, budget))
+            item["text"] = text
+            item["truncated"] = clipped or bool(summary and summary != content)
+            budget -= len(text)
+        else:
+            item["ref"] = True
+        items.append(item)
+    items.reverse()
+    return items
+
+def payload_size(value: Any) -> int:
+    """حجم JSON (UTF-8) كما يرسله السيرفر."""
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+# ==========================
+# مقارنة حجم الحمولة قبل/بعد (python hawsa_context.py)
+# ==========================
+
+def _synthetic_history(turns: int) -> List[Dict[str, Any]]:
+    # ردود المساعد تكرر رسالة المستخدم داخلها (مثل _generate_base_response)
+    rows = []
+    for i in range(turns):
+        message = f"رسالة رقم {i}: عندي مشكلة في ضغط البوست وكود P0300 بعد تعديل الخرائط " * 3
+        reply = (
+            "واضح إنك تحب النتائج العملية 👊، فبنركز على خطوات واضحة وسريعة.\n\n"
+            f"🔍 تحليل أولي لرسالتك:\n- المحتوى: {message}\n"
+            "- سيتم الآن دمج خبرة Hawsa AI مع أسلوبك الشخصي في البرمجة والتحليل.\n\n"
+            + "🔧 [Engineering Skill] " + "تحليل هندسي مفصل. " * 40
+        )
+        for role, content, tags in (("user", message, ["input"]), ("assistant", reply, ["response"])):
+            rows.append({
+                "id": len(rows) + 1,
+                "role": role,
+                "content": content,
+                "summary": summarize_text(content),
+                "created_at": "2024-01-01 00:00:00",
+                "tags": tags
+            })
+    return rows
+
+def benchmark_payloads(limit: int = 6, repeat: int = 2000) -> List[Dict[str, Any]]:
+    rows = _synthetic_history(limit)[-limit:]
+    report = []
+    for mode in CONTEXT_MODES:
+        payload = assemble_context(rows, mode)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            json.dumps(assemble_context(rows, mode), ensure_ascii=False)
+        elapsed = time.perf_counter() - start
+        report.append({
+            "mode": mode,
+            "items": len(payload),
+            "bytes": payload_size(payload),
+            "assemble_and_dumps_us": round(elapsed / repeat * 1e6, 1),
+        })
+    return report
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="مقارنة حجم context_used لكل وضع (full / compact / ids)")
+    parser.add_argument("--limit", type=int, default=6, help="عدد رسائل السياق (مثل get_recent_context)")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    
+    for item in benchmark_payloads(args.limit, args.repeat):
+        print(json.dumps(item, ensure_ascii=False))
@@ -1,9 +1,42 @@
-import sqlite3
+import asyncio
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Set, Tuple
 from enum import Enum
 
+from hawsa_cache import (
+    CONTEXT_CACHE_ROWS, MULTI_PROCESS, PROFILE_ENTRY_BYTES, RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_MAX_MB,
+    RESPONSE_CACHE_TTL_SECONDS, ContextRing, ResponseFragment, UserCache, fragment_size, response_key, ring_size
+)
+from hawsa_context import assemble_context, resolve_context_mode, summarize_text
+from hawsa_kb import KBSnapshot, KnowledgeBase, extract_codes
+from hawsa_keywords import KeywordIndex, KeywordMatch, index_for
+from hawsa_db import (
+    AsyncDBExecutor, SQLitePool, WriteBehindQueue, get_async_executor, register_sql_function
+)
+from hawsa_migrations import ANALYTICS_MIGRATIONS, MEMORY_MIGRATIONS, ensure_schema
+from hawsa_notes import (
+    MAX_NOTES_PER_USER, NOTE_CAP_SQL, SQL_FUNCTIONS as NOTE_SQL_FUNCTIONS,
+    normalize_note_text, note_score, now_days
+)
+from hawsa_retention import ARCHIVE_DIR, ConversationArchive
+from hawsa_storage import SingleFileStorage, Storage, open_storage
+from hawsa_tracing import (
+    REGISTRY as METRICS, TIMING_BREAKDOWN, Trace, activate, record_request, record_skill, record_stage_error,
+    render_metrics, span
+)
+from hawsa_search import (
+    RERANK_PER_HIT, RETRIEVAL_CANDIDATES, RETRIEVAL_ENABLED, RETRIEVAL_NOTES, RETRIEVAL_TURNS,
+    SEARCH_NOTES_SQL, SEARCH_TERM_SQL, fts_document, match_any, query_terms, rank_hits, term_phrase
+)
+
+for _name, (_nargs, _fn) in NOTE_SQL_FUNCTIONS.items():
+    register_sql_function(_name, _nargs, _fn)
+
 # ==========================
 # 1) نظام الذاكرة المتقدمة
 # ==========================
@@ -16,41 +49,104 @@ class HawsaAdvancedMemory:
     - قرارات سابقة
     وتسمح باسترجاع سياق ذكي لكل مستخدم.
     """
-    def __init__(self, db_path: str = "hawsa_ai_memory.db"):
+    # الاستعلامات الساخنة: خططها تُفحص عبر `python hawsa_migrations.py --check`
+    RECENT_CONTEXT_SQL = """
+        SELECT id, role, content, summary, created_at, tags
+        FROM conversation_memory
+        WHERE user_id = ?
+        ORDER BY id DESC
+        LIMIT ?
+    """
+    # تحقق السياق المخزن في وضع عدة عمليات (MULTI_PROCESS)
+    LAST_ID_SQL = "SELECT MAX(id) FROM conversation_memory WHERE user_id = ?"
+    # عناصر context_used المرجعية (id فقط) تُجلب كاملة من هنا
+    INTERACTION_SQL = """
+        SELECT id, role, content, summary, created_at, tags
+        FROM conversation_memory
+        WHERE id = ? AND user_id = ?
+    """
+    # صفوف مرشحي البحث النصي (ids من conversation_fts)
+    INTERACTIONS_BY_ID_SQL = """
+        SELECT id, role, content, summary, created_at, tags
+        FROM conversation_memory
+        WHERE id IN ({ids}) AND user_id = ?
+    """
+    # score = أهمية متلاشية مع الزمن (hawsa_notes.py)، فالترتيب حسبها = حسب الأهمية الحالية
+    NOTES_SQL = """
+        SELECT note_text FROM long_term_notes
+        WHERE user_id = ?
+        ORDER BY score DESC
+    """
+    NOTES_BY_TYPE_SQL = """
+        SELECT note_text FROM long_term_notes
+        WHERE user_id = ? AND note_type = ?
+        ORDER BY score DESC
+    """
+    NOTE_UPSERT_SQL = """
+        INSERT INTO long_term_notes
+            (user_id, note_type, note_text, note_key, importance, hit_count, score, last_seen_at, fts_body)
+        VALUES (?, ?, ?, ?, ?, 1, ?, CURRENT_TIMESTAMP, ?)
+        ON CONFLICT(user_id, note_type, note_key) DO UPDATE SET
+            note_text = excluded.note_text,
+            fts_body = excluded.fts_body,
+            importance = MAX(importance, excluded.importance),
+            hit_count = hit_count + 1,
+            score = hawsa_note_merge(score, excluded.importance, ?),
+            last_seen_at = CURRENT_TIMESTAMP
+    """
+    HOT_QUERIES = {
+        "get_recent_context": (RECENT_CONTEXT_SQL, ("user", 8)),
+        "get_recent_context(last_id)": (LAST_ID_SQL, ("user",)),
+        "get_interaction": (INTERACTION_SQL, (1, "user")),
+        "get_long_term_notes": (NOTES_SQL, ("user",)),
+        "get_long_term_notes(note_type)": (NOTES_BY_TYPE_SQL, ("user", "preference")),
+        "add_long_term_note(cap)": (NOTE_CAP_SQL, ("user", MAX_NOTES_PER_USER)),
+        "search_interactions(term)": (SEARCH_TERM_SQL, (term_phrase("user", "boost"), RETRIEVAL_CANDIDATES)),
+        "search_interactions(rows)": (INTERACTIONS_BY_ID_SQL.format(ids="?, ?"), (1, 2, "user")),
+        "search_notes": (SEARCH_NOTES_SQL, (match_any("user", ["boost", "turbo"]), 12)),
+    }
+    
+    def __init__(
+        self,
+        db_path: str = "hawsa_ai_memory.db",
+        pool: Optional[SQLitePool] = None,
+        write_behind: Optional[WriteBehindQueue] = None,
+        archive_dir: Optional[str] = None,
+        storage: Optional[Storage] = None,
+        multi_process: Optional[bool] = None
+    ):
         self.db_path = db_path
+        # storage: ملف واحد أو عدة ملفات حسب user_id (hawsa_storage.py)؛ pool = ملف واحد جاهز
+        self.storage = storage or (SingleFileStorage(db_path, pool=pool) if pool is not None else open_storage(db_path))
+        self.write_behind = write_behind
+        
+        # الأرشيف الشهري المضغوط بجانب القاعدة (hawsa_retention.py)، يُقرأ عند الطلب فقط
+        # أرشيف واحد لكل الملفات (مفتاحه user_id + id)
+        pools = self.storage.pools()
+        if all(p.is_memory for p in pools) and archive_dir is None:
+            self.archive = None
+        else:
+            self.archive = ConversationArchive(
+                archive_dir or os.path.join(os.path.dirname(os.path.abspath(pools[0].db_path)), ARCHIVE_DIR)
+            )
+        
+        # رسائل في طابور الكتابة لم تُحفظ بعد (لكل مستخدم) حتى يشوفها get_recent_context
+        self._pending: Dict[str, List[tuple]] = {}
+        self._pending_lock = threading.Lock()
+        
+        # آخر CONTEXT_CACHE_ROWS رسالة لكل مستخدم نشط (hawsa_cache.py)
+        self.context_rows = CONTEXT_CACHE_ROWS
+        self.context_cache = UserCache(size_of=ring_size)
+        # عمليات ثانية تكتب لنفس الملفات: الحلقة المخزنة تُستخدم بعد التحقق من آخر id (استعلام فهرس واحد)
+        self.multi_process = MULTI_PROCESS if multi_process is None else multi_process
+        # الكتابة + تحديث الكاش خطوة وحدة، حتى يبقى ترتيب الحلقة نفس ترتيب id بالقاعدة
+        self._write_lock = threading.Lock()
         self._init_memory_tables()
     
     def _init_memory_tables(self):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        
-        # سجل المحادثات
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS conversation_memory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT,
-                role TEXT,                -- 'user' أو 'assistant'
-                content TEXT,
-                summary TEXT,
-                tags TEXT,                -- JSON list
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # ملاحظات طويلة المدى (معرفة المستخدم / تفضيلاته)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS long_term_notes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT,
-                note_type TEXT,           -- 'preference', 'project', 'skill'
-                note_text TEXT,
-                importance REAL DEFAULT 1.0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        conn.commit()
-        conn.close()
+        # المخطط والفهارس تُدار عبر ترحيلات مرقمة (hawsa_migrations.py)
+        for pool in self.storage.pools():
+            ensure_schema(pool, MEMORY_MIGRATIONS)
     
     def save_interaction(
         self,
@@ -60,42 +156,259 @@ class HawsaAdvancedMemory:
         tags: Optional[List[str]] = None,
         summary: Optional[str] = None
     ):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO conversation_memory (user_id, role, content, summary, tags)
-            VALUES (?, ?, ?, ?, ?)
-        """, (user_id, role, content, summary or "", json.dumps(tags or [], ensure_ascii=False)))
-        conn.commit()
-        conn.close()
+        tags_json = json.dumps(tags or [], ensure_ascii=False)
+        # الملخص يُحسب مرة وحدة هنا ويُستخدم لاحقًا في context_used المختصر
+        if summary is None:
+            summary = summarize_text(content)
+        # نثبت وقت الإنشاء (بصيغة CURRENT_TIMESTAMP) حتى يطابق الصف في الكاش/المعلق الصف المحفوظ
+        created_at = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        cached_row = self._row_dict(None, role, content, summary, created_at, list(tags or []))
+        # النص المفهرس للبحث (hawsa_search.py) يُحسب هنا، والـ trigger ينسخه لجدول FTS
+        fts_body = fts_document(user_id, content)
+        pool = self.storage.pool_for(user_id)
+        
+        if self.write_behind is None:
+            with self._write_lock:
+                with pool.transaction() as conn:
+                    cached_row["id"] = conn.execute("""
+                        INSERT INTO conversation_memory (user_id, role, content, summary, tags, created_at, fts_body)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """, (user_id, role, content, summary, tags_json, created_at, fts_body)).lastrowid
+                # بعد الـ commit فقط، حتى ما يثبت تحميل متزامن حلقة ناقصة هذا الصف
+                self.context_cache.update(user_id, lambda ring: ring.append(cached_row))
+            return
+        
+        # وضع الكتابة المؤجلة: الصف يظهر فورًا من الكاش أو من قائمة المعلق (id = None لين يُحفظ)
+        row = (None, role, content, summary, created_at, tags_json)
+        
+        def _committed(rowid: Optional[int]):
+            # يُستدعى والـ guard ممسوك، فلا نحتاج أخذ القفل هنا
+            cached_row["id"] = rowid
+            if rowid is None:
+                # الكتابة انحذفت: الحلقة المخزنة فيها صف ما وصل القاعدة
+                self.context_cache.invalidate(user_id)
+            pending = self._pending.get(user_id)
+            if pending:
+                pending.remove(row)
+                if not pending:
+                    del self._pending[user_id]
+        
+        # الكاتب ما ياخذ _write_lock، فالانتظار في submit (طابور ممتلئ) ما يسبب deadlock
+        with self._write_lock:
+            with self._pending_lock:
+                self._pending.setdefault(user_id, []).append(row)
+            self.context_cache.update(user_id, lambda ring: ring.append(cached_row))
+            self.write_behind.submit(
+                pool,
+                """
+                INSERT INTO conversation_memory (user_id, role, content, summary, tags, created_at, fts_body)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (user_id, role, content, summary, tags_json, created_at, fts_body),
+                guard=self._pending_lock,
+                on_commit=_committed
+            )
+    
+    @staticmethod
+    def _row_dict(row_id, role, content, summary, created_at, tags_list) -> Dict[str, Any]:
+        return {
+            "id": row_id,
+            "role": role,
+            "content": content,
+            "summary": summary,
+            "created_at": created_at,
+            "tags": tags_list
+        }
+    
+    def save_interactions(self, rows: List[tuple]) -> List[int]:
+        """
+        حفظ جماعي بمعاملة واحدة (مسار الدفعات process_batch).
+        rows: (user_id, role, content, tags, summary) بالترتيب. ترجع id كل صف بنفس الترتيب.
+        """
+        if self.write_behind is not None:
+            # نحافظ على ترتيب الصفوف: المؤجل القديم يُكتب قبل الدفعة
+            self.write_behind.flush()
+        created_at = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        rows = [
+            (user_id, role, content, list(tags or []), summarize_text(content) if summary is None else summary)
+            for user_id, role, content, tags, summary in rows
+        ]
+        ids: List[int] = [0] * len(rows)
+        with self._write_lock:
+            # معاملة وحدة لكل ملف (كل الدفعة في ملف واحد لو التخزين غير موزع)
+            for pool, items in self.storage.group_by_pool(rows, lambda row: row[0]):
+                with pool.transaction() as conn:
+                    # execute لكل صف بدل executemany حتى نرجع lastrowid (نفس المعاملة ونفس الاستعلام المجهز)
+                    for position, (user_id, role, content, tags, summary) in items:
+                        ids[position] = conn.execute("""
+                            INSERT INTO conversation_memory (user_id, role, content, summary, tags, created_at, fts_body)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                        """, (
+                            user_id, role, content, summary, json.dumps(tags, ensure_ascii=False), created_at,
+                            fts_document(user_id, content)
+                        )).lastrowid
+            for row_id, (user_id, role, content, tags, summary) in zip(ids, rows):
+                row = self._row_dict(row_id, role, content, summary, created_at, tags)
+                self.context_cache.update(user_id, lambda ring, row=row: ring.append(row))
+        return ids
+    
+    def cached_recent_context(self, user_id: str, limit: int = 8) -> Optional[List[Dict[str, Any]]]:
+        """السياق من الكاش فقط (بدون قاعدة)، أو None لو لازم نقرأ من SQLite."""
+        if self.multi_process:
+            # لازم تحقق من القاعدة (get_recent_context)
+            return None
+        ring = self.context_cache.get(user_id)
+        if ring is None or not ring.covers(limit):
+            return None
+        return ring.tail(limit)
+    
+    def _validated_recent_context(self, user_id: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """الحلقة المخزنة لو آخر id لها = آخر id بالقاعدة (ما كتبت عملية ثانية لنفس المستخدم بعدها)."""
+        ring = self.context_cache.get(user_id)
+        if ring is None or not ring.covers(limit):
+            return None
+        known = max((row["id"] for row in ring.rows if row["id"] is not None), default=0)
+        with self.storage.pool_for(user_id).connection() as conn:
+            last = conn.execute(self.LAST_ID_SQL, (user_id,)).fetchone()[0] or 0
+        if last != known:
+            self.context_cache.invalidate(user_id)
+            return None
+        return ring.tail(limit)
     
     def get_recent_context(self, user_id: str, limit: int = 8) -> List[Dict[str, Any]]:
-        """إرجاع آخر N رسائل كمصدر سياق للذكاء."""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("""
-            SELECT role, content, created_at, tags
-            FROM conversation_memory
-            WHERE user_id = ?
-            ORDER BY id DESC
-            LIMIT ?
-        """, (user_id, limit))
-        rows = c.fetchall()
-        conn.close()
-        
-        context = []
-        for role, content, created_at, tags in rows[::-1]:
-            try:
-                tags_list = json.loads(tags) if tags else []
-            except Exception:
-                tags_list = []
-            context.append({
-                "role": role,
-                "content": content,
-                "created_at": created_at,
-                "tags": tags_list
-            })
-        return context
+        """إرجاع آخر N رسائل كمصدر سياق للذكاء (المستخدم النشط يُخدم من الكاش)."""
+        if limit <= 0:
+            return []
+        cached = self.cached_recent_context(user_id, limit)
+        if cached is None and self.multi_process:
+            cached = self._validated_recent_context(user_id, limit)
+        if cached is not None:
+            return cached
+        
+        # نقرأ حلقة كاملة (مو بس limit) حتى تخدم الطلبات الجاية
+        token = self.context_cache.begin_load(user_id)
+        fetch = max(limit, self.context_rows)
+        pool = self.storage.pool_for(user_id)
+        if self.write_behind is None:
+            with pool.connection() as conn:
+                rows = conn.execute(self.RECENT_CONTEXT_SQL, (user_id, fetch)).fetchall()
+            stored = len(rows)
+            rows = rows[::-1]
+        else:
+            # القراءة + لقطة المعلق تحت نفس القفل الذي يمسكه الكاتب وقت الـ commit
+            with self._pending_lock:
+                with pool.connection() as conn:
+                    rows = conn.execute(self.RECENT_CONTEXT_SQL, (user_id, fetch)).fetchall()
+                pending = list(self._pending.get(user_id, ()))
+            stored = len(rows)
+            rows = (rows[::-1] + pending)[-fetch:]
+        
+        context = [self._parse_row(row) for row in rows]
+        
+        if self.context_rows > 0:
+            ring = ContextRing(context, self.context_rows, complete=stored < fetch)
+            self.context_cache.put(user_id, ring, token)
+        return [dict(row, tags=list(row["tags"])) for row in context[-limit:]]
+    
+    def _parse_row(self, row: tuple) -> Dict[str, Any]:
+        row_id, role, content, summary, created_at, tags = row
+        try:
+            tags_list = json.loads(tags) if tags else []
+        except Exception:
+            tags_list = []
+        return self._row_dict(row_id, role, content, summary or "", created_at, tags_list)
+    
+    def search_interactions(
+        self,
+        user_id: str,
+        text: str,
+        limit: int = RETRIEVAL_TURNS,
+        exclude_ids: Optional[set] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        أنسب رسائل سابقة للنص (FTS5: BM25 + الحداثة)، الأنسب أولاً.
+        exclude_ids: رسائل موجودة أصلاً في السياق (آخر N) ما نكررها.
+        لكل كلمة أحدث RETRIEVAL_CANDIDATES تطابق، ومجموع BM25 للرسالة عبر الكلمات (OR).
+        بعدها نقرأ صفوف أعلى المرشحين فقط ونعيد ترتيبهم بالحداثة.
+        """
+        terms = query_terms(text)
+        if not terms or limit <= 0:
+            return []
+        exclude_ids = exclude_ids or set()
+        scores: Dict[int, float] = {}
+        with self.storage.pool_for(user_id).connection() as conn:
+            for term in terms:
+                for row_id, bm25 in conn.execute(
+                    SEARCH_TERM_SQL, (term_phrase(user_id, term), RETRIEVAL_CANDIDATES)
+                ):
+                    if row_id not in exclude_ids:
+                        scores[row_id] = scores.get(row_id, 0.0) + bm25
+            if not scores:
+                return []
+            top = sorted(scores, key=scores.get, reverse=True)[:limit * RERANK_PER_HIT]
+            sql = self.INTERACTIONS_BY_ID_SQL.format(ids=", ".join("?" * len(top)))
+            rows = conn.execute(sql, (*top, user_id)).fetchall()
+        hits = []
+        for row in rows:
+            hit = self._parse_row(row)
+            hit["bm25"] = scores[hit["id"]]
+            hits.append(hit)
+        return rank_hits(hits, limit, "created_at")
+    
+    def search_notes(self, user_id: str, text: str, limit: int = RETRIEVAL_NOTES) -> List[Dict[str, Any]]:
+        """أنسب ملاحظات طويلة المدى للنص (نفس ترتيب search_interactions، الحداثة = last_seen_at)."""
+        terms = query_terms(text)
+        if not terms or limit <= 0:
+            return []
+        with self.storage.pool_for(user_id).connection() as conn:
+            rows = conn.execute(SEARCH_NOTES_SQL, (match_any(user_id, terms), limit * RERANK_PER_HIT)).fetchall()
+        hits = [
+            {"id": note_id, "note_type": note_type, "note_text": note_text, "last_seen_at": last_seen, "bm25": bm25}
+            for note_id, note_type, note_text, last_seen, bm25 in rows
+        ]
+        return rank_hits(hits, limit, "last_seen_at")
+    
+    def get_interaction(self, user_id: str, interaction_id: int) -> Optional[Dict[str, Any]]:
+        """رسالة وحدة كاملة بالـ id (لعناصر context_used المختصرة أو المرجعية)."""
+        with self.storage.pool_for(user_id).connection() as conn:
+            row = conn.execute(self.INTERACTION_SQL, (interaction_id, user_id)).fetchone()
+        if row is None and self.archive is not None:
+            row = self.archive.get(user_id, interaction_id)
+            return dict(self._parse_row(row), archived=True) if row else None
+        return self._parse_row(row) if row else None
+    
+    def get_archived_history(
+        self,
+        user_id: str,
+        limit: int = 20,
+        before_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """رسائل مؤرشفة (أقدم -> أحدث)، للصفحات: before_id = أصغر id في الصفحة السابقة."""
+        if self.archive is None:
+            return []
+        return [dict(self._parse_row(row), archived=True) for row in self.archive.history(user_id, limit, before_id)]
+    
+    def archive_old_turns(self, **options) -> Dict[str, Any]:
+        """
+        تشغيل الأرشفة من داخل العملية (نفس hawsa_retention.archive_old_turns).
+        أحدث RETENTION_MIN_KEEP_ROWS صف لكل مستخدم ما تتأرشف، فحلقة الكاش ما تتأثر؛ نفرغها احتياطًا.
+        """
+        if self.archive is None:
+            raise RuntimeError("Retention needs a file-backed database")
+        from hawsa_retention import archive_old_turns
+        reports = [archive_old_turns(pool.db_path, self.archive.directory, **options) for pool in self.storage.pools()]
+        rows_archived = sum(report["rows_archived"] for report in reports)
+        if rows_archived:
+            self.invalidate_cache()
+        return {
+            "rows_archived": rows_archived,
+            "hot_bytes_reclaimed": sum(report["hot_bytes_reclaimed"] for report in reports),
+            "files": reports,
+        }
+    
+    def invalidate_cache(self, user_id: Optional[str] = None):
+        """لأي أداة تعدل conversation_memory مباشرة (حذف/أرشفة/استيراد)."""
+        self.context_cache.invalidate(user_id)
     
     def add_long_term_note(
         self,
@@ -104,39 +417,54 @@ class HawsaAdvancedMemory:
         note_type: str = "preference",
         importance: float = 1.0
     ):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO long_term_notes (user_id, note_type, note_text, importance)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, note_type, note_text, importance))
-        conn.commit()
-        conn.close()
+        """
+        الملاحظة المكررة لا تضيف صف جديد: نزيد hit_count ونجمع الأهمية بعد التلاشي،
+        ثم نحذف الأضعف فوق MAX_NOTES_PER_USER.
+        """
+        at_days = now_days()
+        upsert_params = (
+            user_id, note_type, note_text, normalize_note_text(note_text),
+            importance, note_score(importance, at_days), fts_document(user_id, note_text), at_days
+        )
+        cap_params = (user_id, MAX_NOTES_PER_USER)
+        pool = self.storage.pool_for(user_id)
+        if self.write_behind is not None:
+            self.write_behind.submit(pool, self.NOTE_UPSERT_SQL, upsert_params)
+            self.write_behind.submit(pool, NOTE_CAP_SQL, cap_params)
+            return
+        with pool.transaction() as conn:
+            conn.execute(self.NOTE_UPSERT_SQL, upsert_params)
+            conn.execute(NOTE_CAP_SQL, cap_params)
+    
+    def add_long_term_notes(self, notes: List[tuple]):
+        """نسخة جماعية من add_long_term_note بمعاملة واحدة. notes: (user_id, note_text, note_type, importance)."""
+        at_days = now_days()
+        if self.write_behind is not None:
+            self.write_behind.flush()
+        for pool, items in self.storage.group_by_pool(notes, lambda note: note[0]):
+            with pool.transaction() as conn:
+                conn.executemany(self.NOTE_UPSERT_SQL, [
+                    (
+                        user_id, note_type, note_text, normalize_note_text(note_text),
+                        importance, note_score(importance, at_days), fts_document(user_id, note_text), at_days
+                    )
+                    for _position, (user_id, note_text, note_type, importance) in items
+                ])
+                for user_id in dict.fromkeys(note[0] for _position, note in items):
+                    conn.execute(NOTE_CAP_SQL, (user_id, MAX_NOTES_PER_USER))
     
     def get_long_term_notes(
         self,
         user_id: str,
         note_type: Optional[str] = None
     ) -> List[str]:
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        
-        if note_type:
-            c.execute("""
-                SELECT note_text FROM long_term_notes
-                WHERE user_id = ? AND note_type = ?
-                ORDER BY importance DESC, id DESC
-            """, (user_id, note_type))
-        else:
-            c.execute("""
-                SELECT note_text FROM long_term_notes
-                WHERE user_id = ?
-                ORDER BY importance DESC, id DESC
-            """, (user_id,))
-        
-        notes = [row[0] for row in c.fetchall()]
-        conn.close()
-        return notes
+        with self.storage.pool_for(user_id).connection() as conn:
+            if note_type:
+                rows = conn.execute(self.NOTES_BY_TYPE_SQL, (user_id, note_type)).fetchall()
+            else:
+                rows = conn.execute(self.NOTES_SQL, (user_id,)).fetchall()
+        
+        return [row[0] for row in rows]
 
 # ==========================
 # 2) أنواع وتحليل المستخدم
@@ -182,36 +510,73 @@ class AdvancedUserAnalytics:
     - الاهتمامات التقنية
     ويحفظ بروفايل في قاعدة بيانات منفصلة.
     """
-    def __init__(self, db_path: str = "hawsa_ai_advanced.db", memory: HawsaAdvancedMemory = None):
+    # كلمات التحليل تُسجل في فهرس الكلمات المشترك داخل HawsaCore
+    KEYWORD_GROUPS = {
+        "analytics.code": ["كود", "code", "script", "برمجة"],
+        "analytics.design": ["تصميم", "ui", "ux", "واجهة"],
+    }
+    
+    # upsert البروفايل يعتمد على البحث بالمفتاح الأساسي user_id
+    HOT_QUERIES = {
+        "profile_upsert_lookup": ("SELECT 1 FROM user_profiles WHERE user_id = ?", ("user",)),
+    }
+    
+    def __init__(
+        self,
+        db_path: str = "hawsa_ai_advanced.db",
+        memory: HawsaAdvancedMemory = None,
+        pool: Optional[SQLitePool] = None,
+        write_behind: Optional[WriteBehindQueue] = None,
+        storage: Optional[Storage] = None,
+        multi_process: Optional[bool] = None
+    ):
         self.db_path = db_path
+        self.storage = storage or (SingleFileStorage(db_path, pool=pool) if pool is not None else open_storage(db_path))
+        self.write_behind = write_behind
         self.memory = memory  # لربط التحليل بالذاكرة الطويلة
+        
+        # آخر بروفايل محفوظ لكل مستخدم: (UserProfile, params) — params = الصف كما في القاعدة
+        # عدة عمليات: الكاش معطل (كل حفظ upsert، وكل قراءة من القاعدة) لأن عملية ثانية ممكن تكون غيرته
+        multi_process = MULTI_PROCESS if multi_process is None else multi_process
+        self.profile_cache = UserCache(
+            max_entries=0 if multi_process else None, size_of=lambda _entry: PROFILE_ENTRY_BYTES
+        )
+        # المقارنة بالكاش + الكتابة + تحديث الكاش خطوة وحدة (SQLite يسلسل الكتابات أصلاً)
+        self._profile_write_lock = threading.Lock()
         self._init_analytics_tables()
     
     def _init_analytics_tables(self):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS user_profiles (
-                user_id TEXT PRIMARY KEY,
-                personality TEXT,
-                expertise TEXT,
-                interests TEXT,
-                confidence REAL,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.commit()
-        conn.close()
+        for pool in self.storage.pools():
+            ensure_schema(pool, ANALYTICS_MIGRATIONS)
     
-    def analyze_user_message(self, user_id: str, message: str, base_confidence: float = 0.0) -> UserProfile:
-        msg_lower = message.lower()
+    def analyze_user_message(
+        self,
+        user_id: str,
+        message: str,
+        base_confidence: float = 0.0,
+        match: Optional[KeywordMatch] = None
+    ) -> UserProfile:
+        profile = self.infer_profile(user_id, message, base_confidence, match)
+        self.save_profile(profile)
+        return profile
+    
+    def infer_profile(
+        self,
+        user_id: str,
+        message: str,
+        base_confidence: float = 0.0,
+        match: Optional[KeywordMatch] = None
+    ) -> UserProfile:
+        """استنتاج البروفايل من الرسالة فقط (بدون أي I/O)."""
+        if match is None:
+            match = index_for(self.KEYWORD_GROUPS).scan(message)
         
         # تحليل بسيط مبدئي حسب الكلمات
-        if any(k in msg_lower for k in ["كود", "code", "script", "برمجة"]):
+        if match.has("analytics.code"):
             personality = PersonalityType.ANALYTICAL
             expertise = ExpertiseLevel.ADVANCED
             interests = ["programming", "systems", "automation"]
-        elif any(k in msg_lower for k in ["تصميم", "ui", "ux", "واجهة"]):
+        elif match.has("analytics.design"):
             personality = PersonalityType.CREATIVE
             expertise = ExpertiseLevel.INTERMEDIATE
             interests = ["design", "ui/ux"]
@@ -226,7 +591,7 @@ class AdvancedUserAnalytics:
         if len(message) > 60:
             preferred.append(ContentType.BULLETS)
         
-        profile = UserProfile(
+        return UserProfile(
             user_id=user_id,
             personality_type=personality,
             expertise_level=expertise,
@@ -234,76 +599,252 @@ class AdvancedUserAnalytics:
             confidence_score=confidence,
             preferred_content_types=preferred
         )
-        
-        # حفظ البروفايل في قاعدة البيانات
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO user_profiles (user_id, personality, expertise, interests, confidence, updated_at)
-            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(user_id) DO UPDATE SET
-                personality=excluded.personality,
-                expertise=excluded.expertise,
-                interests=excluded.interests,
-                confidence=excluded.confidence,
-                updated_at=CURRENT_TIMESTAMP
-        """, (
-            user_id,
+    
+    PROFILE_SELECT_SQL = """
+        SELECT personality, expertise, interests, confidence
+        FROM user_profiles
+        WHERE user_id = ?
+    """
+    
+    PROFILE_UPSERT_SQL = """
+        INSERT INTO user_profiles (user_id, personality, expertise, interests, confidence, updated_at)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id) DO UPDATE SET
+            personality=excluded.personality,
+            expertise=excluded.expertise,
+            interests=excluded.interests,
+            confidence=excluded.confidence,
+            updated_at=CURRENT_TIMESTAMP
+    """
+    
+    # بروفايل ما تغير: نحدّث updated_at بس (export --since على user_profiles يعتمد عليه)
+    PROFILE_TOUCH_SQL = "UPDATE user_profiles SET updated_at = CURRENT_TIMESTAMP WHERE user_id = ?"
+    
+    @staticmethod
+    def _profile_params(profile: UserProfile) -> tuple:
+        return (
+            profile.user_id,
             profile.personality_type.value,
             profile.expertise_level.value,
-            json.dumps(interests, ensure_ascii=False),
-            confidence
-        ))
-        conn.commit()
-        conn.close()
+            json.dumps(profile.technical_interests, ensure_ascii=False),
+            profile.confidence_score
+        )
+    
+    @staticmethod
+    def _interests_note(profile: UserProfile) -> tuple:
+        """(user_id, note_text, note_type, importance) لملاحظة الاهتمامات التقنية."""
+        return (
+            profile.user_id,
+            f"اهتمامات تقنية: {', '.join(profile.technical_interests)}",
+            "tech_interests",
+            1.5
+        )
+    
+    @staticmethod
+    def _copy_profile(profile: UserProfile) -> UserProfile:
+        return UserProfile(
+            user_id=profile.user_id,
+            personality_type=profile.personality_type,
+            expertise_level=profile.expertise_level,
+            technical_interests=list(profile.technical_interests),
+            confidence_score=profile.confidence_score,
+            preferred_content_types=list(profile.preferred_content_types)
+        )
+    
+    def _cached_params(self, user_id: str) -> Optional[tuple]:
+        entry = self.profile_cache.get(user_id)
+        return entry[1] if entry is not None else None
+    
+    def get_profile(self, user_id: str) -> Optional[UserProfile]:
+        """آخر بروفايل للمستخدم: من الكاش، أو من user_profiles عند أول طلب."""
+        entry = self.profile_cache.get(user_id)
+        if entry is not None:
+            return self._copy_profile(entry[0])
+        
+        token = self.profile_cache.begin_load(user_id)
+        with self.storage.pool_for(user_id).connection() as conn:
+            row = conn.execute(self.PROFILE_SELECT_SQL, (user_id,)).fetchone()
+        if row is None:
+            return None
+        personality, expertise, interests, confidence = row
+        try:
+            interests_list = json.loads(interests) if interests else []
+        except Exception:
+            interests_list = []
+        profile = UserProfile(
+            user_id=user_id,
+            personality_type=PersonalityType(personality),
+            expertise_level=ExpertiseLevel(expertise),
+            technical_interests=interests_list,
+            confidence_score=confidence
+        )
+        self.profile_cache.put(user_id, (profile, self._profile_params(profile)), token)
+        return self._copy_profile(profile)
+    
+    def save_profile(self, profile: UserProfile):
+        """حفظ البروفايل + ملاحظة الاهتمامات في الذاكرة الطويلة."""
+        # حفظ البروفايل في قاعدة البيانات (لو الصف المحفوظ مطابق: تحديث updated_at بدل الـ upsert كامل)
+        params = self._profile_params(profile)
+        with self._profile_write_lock:
+            if params != self._cached_params(profile.user_id):
+                sql, sql_params = self.PROFILE_UPSERT_SQL, params
+            else:
+                sql, sql_params = self.PROFILE_TOUCH_SQL, (profile.user_id,)
+            pool = self.storage.pool_for(profile.user_id)
+            if self.write_behind is not None:
+                self.write_behind.submit(pool, sql, sql_params)
+            else:
+                with pool.transaction() as conn:
+                    conn.execute(sql, sql_params)
+            self.profile_cache.set(profile.user_id, (self._copy_profile(profile), params))
         
         # حفظ ملاحظة طويلة المدى عن اهتمامات المستخدم
         try:
-            if self.memory and interests:
+            if self.memory and profile.technical_interests:
+                user_id, note_text, note_type, importance = self._interests_note(profile)
                 self.memory.add_long_term_note(
                     user_id=user_id,
-                    note_text=f"اهتمامات تقنية: {', '.join(interests)}",
-                    note_type="tech_interests",
-                    importance=1.5
+                    note_text=note_text,
+                    note_type=note_type,
+                    importance=importance
                 )
         except Exception:
             pass
-        
-        return profile
+    
+    def save_profiles(self, profiles: List[UserProfile]):
+        """حفظ جماعي (بالترتيب) بمعاملة واحدة لكل قاعدة؛ الحالة النهائية مثل حفظها واحد واحد."""
+        if not profiles:
+            return
+        if self.write_behind is not None:
+            self.write_behind.flush()
+        # بالترتيب: كل بروفايل يُقارن بآخر صف محفوظ لنفس المستخدم (من الكاش أو من الدفعة نفسها)
+        with self._profile_write_lock:
+            latest: Dict[str, Tuple[UserProfile, tuple]] = {}
+            writes = []
+            for profile in profiles:
+                params = self._profile_params(profile)
+                previous = latest[profile.user_id][1] if profile.user_id in latest else self._cached_params(profile.user_id)
+                if params != previous:
+                    writes.append((self.PROFILE_UPSERT_SQL, params))
+                else:
+                    writes.append((self.PROFILE_TOUCH_SQL, (profile.user_id,)))
+                latest[profile.user_id] = (profile, params)
+            # params[0] = user_id في الاستعلامين
+            for pool, items in self.storage.group_by_pool(writes, lambda write: write[1][0]):
+                with pool.transaction() as conn:
+                    for _position, (sql, params) in items:
+                        conn.execute(sql, params)
+            for user_id, (profile, params) in latest.items():
+                self.profile_cache.set(user_id, (self._copy_profile(profile), params))
+        try:
+            if self.memory:
+                notes = [self._interests_note(p) for p in profiles if p.technical_interests]
+                if notes:
+                    self.memory.add_long_term_notes(notes)
+        except Exception:
+            pass
 
 # ==========================
 # 3) بيانات هندسية + ميديا
 # ==========================
 
 class EngineeringDataIntegration:
-    """نواة بسيطة لتوصيات ECU / تشخيص."""
-    def __init__(self):
-        pass
+    """
+    توصيات ECU / تشخيص من قاعدة المعرفة (hawsa_kb.py + hawsa_kb.json):
+    قواعد بالكلمات المفتاحية أو ببادئة الرمز، وشرح لكل رمز DTC مذكور في الرسالة،
+    مع ملاحظات وقواعد خاصة بالسيارة (vehicle_id أو اسم السيارة في الرسالة).
+    """
+    def __init__(self, kb: Optional[KnowledgeBase] = None):
+        self.kb = kb or KnowledgeBase()
+        self._keywords: Optional[KeywordIndex] = None
+        self.kb.on_reload(self._register_keywords)
+    
+    @property
+    def KEYWORD_GROUPS(self) -> Dict[str, Any]:
+        return self.kb.snapshot.keyword_groups()
+    
+    def attach_keywords(self, keywords: KeywordIndex):
+        """تسجيل كلمات القاعدة في فهرس HawsaCore المشترك (وإعادة تسجيلها بعد كل reload)."""
+        self._keywords = keywords
+        keywords.register_groups(self.KEYWORD_GROUPS)
     
-    def get_ecu_recommendations(self, vehicle_id: str, description: str) -> List[Dict[str, Any]]:
+    def _register_keywords(self, snapshot: KBSnapshot):
+        # الفهرس المشترك يكبر بس؛ كلمة انحذفت من قاعدة ما تأثر لأن المطابقة تُفلتر بكلمات النسخة الحالية
+        if self._keywords is not None:
+            self._keywords.register_groups(snapshot.keyword_groups())
+    
+    def get_ecu_recommendations(
+        self,
+        vehicle_id: str,
+        description: str,
+        match: Optional[KeywordMatch] = None
+    ) -> List[Dict[str, Any]]:
+        # نسخة وحدة لكامل الطلب حتى لو صار reload بالنص
+        kb = self.kb.snapshot
+        if match is None:
+            match = kb.keywords.scan(description)
+        vehicle = kb.resolve_vehicle(vehicle_id, match)
+        
         recs = []
-        desc_low = description.lower()
-        
-        if "boost" in desc_low or "توربو" in desc_low:
-            recs.append({
-                "code": "BOOST_MAP_TUNE",
-                "description": "ضبط خرائط البوست مع مراعاة حدود الأمان للـ AFR والحرارة."
-            })
-        if "dtc" in desc_low or "رمز" in desc_low:
-            recs.append({
-                "code": "DTC_ANALYSIS",
-                "description": "تحليل رموز الأعطال وربطها بحالات فعلية من سجلات سابقة."
-            })
+        fired = set()
+        
+        def add_rule(rule):
+            if rule.code in fired or (rule.vehicles and vehicle not in rule.vehicles):
+                return
+            fired.add(rule.code)
+            rec = {"code": rule.code, "description": rule.description}
+            if rule.vehicles:
+                rec["vehicle"] = vehicle
+            recs.append(rec)
+        
+        for rule in kb.rules:
+            if rule.keywords and match.matched(rule.group) & rule.keywords:
+                add_rule(rule)
+        
+        for code in extract_codes(description):
+            entry, family, rules = kb.resolve(code)
+            if entry is None and family is None:
+                continue
+            base = entry or family
+            fallback = family or base
+            advice = base.advice or fallback.advice
+            rec = {
+                "code": code,
+                "description": f"{code}: {base.title or fallback.title}. {advice}".strip(),
+                "system": base.system or fallback.system,
+                "severity": base.severity or fallback.severity,
+                "family": family.code if family else None,
+                "known": entry is not None,
+            }
+            if entry is not None and entry.causes:
+                rec["causes"] = list(entry.causes)
+            if entry is not None and vehicle in entry.vehicle_notes:
+                rec["vehicle"] = vehicle
+                rec["vehicle_note"] = entry.vehicle_notes[vehicle]
+            recs.append(rec)
+            for rule in rules:
+                add_rule(rule)
         
         return recs
 
 class MediaGenerator:
     """مولّد وسائط بسيط (ممكن تربطه لاحقًا بـ DALL·E أو غيره)."""
+    KEYWORD_GROUPS = {
+        "media.diagram": ["رسم", "diagram", "مخطط"],
+    }
+    
     def __init__(self):
         pass
     
-    def generate_media(self, message: str, profile: UserProfile) -> Dict[str, Any]:
-        if any(k in message.lower() for k in ["رسم", "diagram", "مخطط"]):
+    def generate_media(
+        self,
+        message: str,
+        profile: UserProfile,
+        match: Optional[KeywordMatch] = None
+    ) -> Dict[str, Any]:
+        if match is None:
+            match = index_for(self.KEYWORD_GROUPS).scan(message)
+        if match.has("media.diagram"):
             return {
                 "type": "diagram_description",
                 "content": "مخطط نصي يشرح العلاقة بين وحدات النظام المقترح."
@@ -319,23 +860,47 @@ class MediaGenerator:
 # ==========================
 
 class BaseSkill:
-    """واجهة عامة لأي مهارة داخل Hawsa AI."""
-    def can_handle(self, message: str) -> bool:
-        raise NotImplementedError
+    """
+    واجهة عامة لأي مهارة داخل Hawsa AI.
+    المهارة اللي تعرّف KEYWORDS تُطابق عبر فهرس الكلمات المشترك (match)،
+    وغيرها لازم تعيد تعريف can_handle.
+    PRIORITY: الأعلى يُجرب أولًا. TIMEOUT_SECONDS: None = المهلة الافتراضية للسجل.
+    CACHEABLE: نفس الرسالة = نفس الرد (كاش أجزاء الرد)؛ False لمهارة ردها يتغير (وقت، API خارجي).
+    """
+    KEYWORDS: List[str] = []
+    PRIORITY: int = 0
+    TIMEOUT_SECONDS: Optional[float] = None
+    CACHEABLE: bool = True
+    
+    @classmethod
+    def keyword_group(cls) -> str:
+        return f"skill.{cls.__name__}"
+    
+    @classmethod
+    def keyword_groups(cls) -> Dict[str, List[str]]:
+        # نحفظ القاموس على الكلاس نفسه حتى يبقى الفهرس الاحتياطي واحد لكل مهارة
+        groups = cls.__dict__.get("_keyword_groups")
+        if groups is None:
+            groups = {cls.keyword_group(): list(cls.KEYWORDS)} if cls.KEYWORDS else {}
+            cls._keyword_groups = groups
+        return groups
     
-    def handle(self, message: str, master: "HawsaCore") -> str:
+    def can_handle(self, message: str, match: Optional[KeywordMatch] = None) -> bool:
+        if not self.KEYWORDS:
+            raise NotImplementedError
+        if match is None:
+            match = index_for(self.keyword_groups()).scan(message)
+        return match.has(self.keyword_group())
+    
+    def handle(self, message: str, master: "HawsaCore", match: Optional[KeywordMatch] = None) -> str:
         raise NotImplementedError
 
 class EngineeringSkill(BaseSkill):
     """مهارة للمواضيع الهندسية / ECU / تشخيص / أنظمة."""
     KEYWORDS = ['ecu', 'برمجة', 'تشخيص', 'dtc', 'كود', 'رمز', 'خريطة', 'boost', 'توربو', 'خرائط']
     
-    def can_handle(self, message: str) -> bool:
-        low = message.lower()
-        return any(k in low for k in self.KEYWORDS)
-    
-    def handle(self, message: str, master: "HawsaCore") -> str:
-        recs = master.engineering_data.get_ecu_recommendations("UNKNOWN", message)
+    def handle(self, message: str, master: "HawsaCore", match: Optional[KeywordMatch] = None) -> str:
+        recs = master.engineering_data.get_ecu_recommendations("UNKNOWN", message, match=match)
         lines = ["🛠 *معالجة هندسية متقدمة للطلب:*", f"- الوصف: {message}", ""]
         if recs:
             lines.append("*توصيات Hawsa AI:*")
@@ -349,11 +914,7 @@ class CreativeDesignSkill(BaseSkill):
     """مهارة للأفكار الإبداعية (تصميم، منصات، أفكار جديدة)."""
     KEYWORDS = ['فكرة', 'تصميم', 'منصة', 'واجهة', 'system', 'platform', 'ui', 'ux']
     
-    def can_handle(self, message: str) -> bool:
-        low = message.lower()
-        return any(k in low for k in self.KEYWORDS)
-    
-    def handle(self, message: str, master: "HawsaCore") -> str:
+    def handle(self, message: str, master: "HawsaCore", match: Optional[KeywordMatch] = None) -> str:
         return (
             "🎨 *تحليل وتصميم إبداعي للطلب:*\n"
             f"النص المدخل: {message}\n\n"
@@ -362,10 +923,322 @@ class CreativeDesignSkill(BaseSkill):
             "- تحديد نقاط التكامل مع Hawsa AI Core\n"
         )
 
+# المهارات الافتراضية (بالترتيب) اللي يسجلها HawsaCore لو ما انعطى قائمة مخصصة
+DEFAULT_SKILLS: List[type] = [
+    EngineeringSkill,
+    CreativeDesignSkill,
+    # لاحقًا تضيف Skills جديدة هنا
+]
+
+class SkillStats:
+    """عدادات أداء لكل مهارة (بدل طباعة الأخطاء)."""
+    def __init__(self):
+        self.hits = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_error: Optional[str] = None
+    
+    def as_dict(self) -> Dict[str, Any]:
+        calls = self.hits + self.errors + self.timeouts
+        return {
+            "hits": self.hits,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "avg_seconds": (self.total_seconds / calls) if calls else 0.0,
+            "max_seconds": self.max_seconds,
+            "last_error": self.last_error,
+        }
+
+class SkillRegistry:
+    """
+    سجل المهارات:
+    - فهرس مقلوب: مجموعة الكلمات في KeywordMatch -> المهارة (بدون تجربة كل مهارة)
+    - أولويات (PRIORITY) ثم ترتيب التسجيل
+    - تشغيل مهارة واحدة (أول نجاح) أو عدة مهارات بالتوازي (fan_out)
+    - مهلة لكل مهارة حتى ما توقف مهارة بطيئة الطلب كامل
+    """
+    def __init__(
+        self,
+        keywords: KeywordIndex,
+        default_timeout: Optional[float] = None,
+        max_workers: Optional[int] = None
+    ):
+        self.keywords = keywords
+        if default_timeout is None:
+            default_timeout = float(os.environ.get("HAWSA_SKILL_TIMEOUT_S", "2.0"))
+        self.default_timeout = default_timeout
+        self._max_workers = max_workers or int(os.environ.get("HAWSA_SKILL_WORKERS", "8"))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        
+        self._entries: List[tuple] = []            # (-priority, order, skill)
+        self._by_group: Dict[str, BaseSkill] = {}  # keyword_group -> skill
+        self._probe_only: List[BaseSkill] = []     # مهارات بدون KEYWORDS (can_handle مخصص)
+        self._stats: Dict[str, SkillStats] = {}
+        self._lock = threading.Lock()
+        # يزيد مع كل تسجيل (جزء من مفتاح كاش أجزاء الرد)
+        self.version = 0
+        self._listeners = []
+    
+    def on_change(self, callback):
+        """callback() بعد تسجيل أي مهارة (مثلاً لمسح كاش الردود)."""
+        self._listeners.append(callback)
+    
+    def register(self, skill: BaseSkill, priority: Optional[int] = None):
+        name = skill.__class__.__name__
+        priority = skill.PRIORITY if priority is None else priority
+        with self._lock:
+            self.version += 1
+            self._entries.append((-priority, len(self._entries), skill))
+            self._entries.sort(key=lambda e: (e[0], e[1]))
+            self._stats.setdefault(name, SkillStats())
+            if skill.KEYWORDS:
+                self._by_group[skill.keyword_group()] = skill
+            else:
+                self._probe_only.append(skill)
+        if skill.KEYWORDS:
+            self.keywords.register_groups(skill.keyword_groups())
+        for callback in self._listeners:
+            callback()
+    
+    @property
+    def skills(self) -> List[BaseSkill]:
+        return [entry[2] for entry in self._entries]
+    
+    def candidates(
+        self,
+        message: str,
+        match: KeywordMatch,
+        volatile: Optional[List[BaseSkill]] = None
+    ) -> List[BaseSkill]:
+        """
+        المهارات المطابقة مرتبة حسب الأولوية.
+        volatile (اختياري): يتعبأ بالمهارات اللي نتيجتها ما تنعاد من الكاش
+        (CACHEABLE=False، أو فشلت / انتهت مهلتها في هذا الطلب).
+        """
+        matched = {id(self._by_group[g]) for g in match.groups if g in self._by_group}
+        result = []
+        for _, _, skill in self._entries:
+            if id(skill) in matched:
+                result.append(skill)
+            elif not skill.KEYWORDS:
+                try:
+                    if skill.can_handle(message, match):
+                        result.append(skill)
+                except Exception as e:
+                    self._record(skill, 0.0, error=e, volatile=volatile)
+        if volatile is not None:
+            volatile.extend(skill for skill in result if not skill.CACHEABLE)
+        return result
+    
+    def _timeout_for(self, skill: BaseSkill) -> Optional[float]:
+        timeout = skill.TIMEOUT_SECONDS if skill.TIMEOUT_SECONDS is not None else self.default_timeout
+        return timeout if timeout and timeout > 0 else None
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self._max_workers, thread_name_prefix="hawsa-skill"
+                    )
+        return self._executor
+    
+    def _record(
+        self,
+        skill: BaseSkill,
+        seconds: float,
+        error: Optional[BaseException] = None,
+        timeout: bool = False,
+        volatile: Optional[List[BaseSkill]] = None
+    ):
+        name = skill.__class__.__name__
+        if volatile is not None and (timeout or error is not None):
+            volatile.append(skill)
+        with self._lock:
+            stats = self._stats.setdefault(name, SkillStats())
+            if timeout:
+                stats.timeouts += 1
+                stats.last_error = f"timeout after {seconds:.3f}s"
+            elif error is not None:
+                stats.errors += 1
+                stats.last_error = f"{error.__class__.__name__}: {error}"
+            else:
+                stats.hits += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+        record_skill(name, seconds, "timeout" if timeout else "error" if error is not None else "ok")
+    
+    def _timed_handle(self, skill: BaseSkill, message: str, master: "HawsaCore", match: KeywordMatch):
+        start = time.perf_counter()
+        result = skill.handle(message, master, match=match)
+        return result, time.perf_counter() - start
+    
+    def _collect(
+        self,
+        skill: BaseSkill,
+        future,
+        started: float,
+        deadline: Optional[float],
+        volatile: Optional[List[BaseSkill]] = None
+    ) -> Optional[str]:
+        try:
+            remaining = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            result, seconds = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            # الخيط يكمل بالخلفية، لكن الطلب ما ينتظره
+            self._record(skill, time.perf_counter() - started, timeout=True, volatile=volatile)
+            return None
+        except Exception as e:
+            self._record(skill, time.perf_counter() - started, error=e, volatile=volatile)
+            return None
+        self._record(skill, seconds)
+        return result
+    
+    def _run_one(
+        self,
+        skill: BaseSkill,
+        message: str,
+        master: "HawsaCore",
+        match: KeywordMatch,
+        volatile: Optional[List[BaseSkill]] = None
+    ) -> Optional[str]:
+        timeout = self._timeout_for(skill)
+        started = time.perf_counter()
+        if timeout is None:
+            try:
+                result, seconds = self._timed_handle(skill, message, master, match)
+            except Exception as e:
+                self._record(skill, time.perf_counter() - started, error=e, volatile=volatile)
+                return None
+            self._record(skill, seconds)
+            return result
+        future = self._get_executor().submit(self._timed_handle, skill, message, master, match)
+        return self._collect(skill, future, started, started + timeout, volatile)
+    
+    def dispatch(
+        self,
+        message: str,
+        master: "HawsaCore",
+        match: KeywordMatch,
+        fan_out: bool = False,
+        volatile: Optional[List[BaseSkill]] = None
+    ) -> Optional[str]:
+        candidates = self.candidates(message, match, volatile)
+        if not candidates:
+            return None
+        
+        if not fan_out or len(candidates) == 1:
+            # أول مهارة تنجح حسب الأولوية (نفس سلوك التوجيه القديم)
+            for skill in candidates:
+                result = self._run_one(skill, message, master, match, volatile)
+                if result:
+                    return result
+            return None
+        
+        # كل المهارات المطابقة بالتوازي، والنتائج تُدمج بترتيب الأولوية
+        executor = self._get_executor()
+        started = time.perf_counter()
+        futures = [
+            (skill, executor.submit(self._timed_handle, skill, message, master, match))
+            for skill in candidates
+        ]
+        results = []
+        for skill, future in futures:
+            timeout = self._timeout_for(skill)
+            result = self._collect(skill, future, started, None if timeout is None else started + timeout, volatile)
+            if result:
+                results.append(result)
+        return "\n\n".join(results) if results else None
+    
+    async def adispatch(
+        self,
+        message: str,
+        master: "HawsaCore",
+        match: KeywordMatch,
+        fan_out: bool = False,
+        volatile: Optional[List[BaseSkill]] = None
+    ) -> Optional[str]:
+        """نسخة async من dispatch: انتظار المهارات بدون حجز خيط الـ event loop."""
+        candidates = self.candidates(message, match, volatile)
+        if not candidates:
+            return None
+        
+        executor = self._get_executor()
+        
+        async def run(skill: BaseSkill) -> Optional[str]:
+            timeout = self._timeout_for(skill)
+            started = time.perf_counter()
+            future = asyncio.wrap_future(
+                executor.submit(self._timed_handle, skill, message, master, match)
+            )
+            try:
+                result, seconds = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                self._record(skill, time.perf_counter() - started, timeout=True, volatile=volatile)
+                return None
+            except Exception as e:
+                self._record(skill, time.perf_counter() - started, error=e, volatile=volatile)
+                return None
+            self._record(skill, seconds)
+            return result
+        
+        if not fan_out or len(candidates) == 1:
+            for skill in candidates:
+                result = await run(skill)
+                if result:
+                    return result
+            return None
+        
+        results = await asyncio.gather(*(run(skill) for skill in candidates))
+        results = [r for r in results if r]
+        return "\n\n".join(results) if results else None
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: s.as_dict() for name, s in self._stats.items()}
+    
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
 # ==========================
 # 5) HawsaCore - العقل الموحد
 # ==========================
 
+class RequestContext:
+    """
+    حالة طلب واحد داخل خط المعالجة (بدل تخزينها على HawsaCore المشترك)،
+    حتى تقدر نسخة وحدة من HawsaCore تخدم طلبات متوازية بدون تداخل بين المستخدمين.
+    """
+    def __init__(self, user_id: str, user_message: str, context_mode: str = "compact", timings: bool = False):
+        self.user_id = user_id
+        self.user_message = user_message
+        self.context_mode = context_mode
+        # perf_counter (monotonic) بدل datetime.now()
+        self.start_time = time.perf_counter()
+        # أوقات المراحل لهذا الطلب (analytics.timings_ms) لو طلبها
+        self.trace: Optional[Trace] = Trace() if timings else None
+        self.match: Optional[KeywordMatch] = None
+        self.recent_context: List[Dict[str, Any]] = []
+        self.relevant_context: List[Dict[str, Any]] = []
+        self.personalized_notes: List[str] = []
+        self.context_used: List[Dict[str, Any]] = []
+        self.profile: Optional[UserProfile] = None
+        self.technical_recommendations: List[Dict[str, Any]] = []
+        self.skill_response: Optional[str] = None
+        self.personalized_response: str = ""
+        self.media_content: Dict[str, Any] = {}
+        self.processing_time: float = 0.0
+        # كاش أجزاء الرد: المفتاح (None = ما ينحفظ) + هل الأجزاء جت من الكاش
+        self.response_key: Optional[tuple] = None
+        self.response_cached = False
+        self.volatile_skills: List["BaseSkill"] = []
+
+MEMORY_DB = "hawsa_ai_memory.db"
+ANALYTICS_DB = "hawsa_ai_advanced.db"
+
 class HawsaCore:
     """
     هذا هو اللب / النواة:
@@ -374,21 +1247,91 @@ class HawsaCore:
     - يختار Skill
     - يولد رد مخصص
     """
-    def __init__(self, api_key: str = None):
+    # حقول البروفايل اللي تأثر في أجزاء الرد (مفتاح كاش الردود)؛
+    # أي كلاس فرعي يخصص الرد بحقول ثانية لازم يضيفها هنا
+    RESPONSE_PROFILE_FIELDS: Tuple[str, ...] = ("personality_type",)
+    
+    def __init__(
+        self,
+        api_key: str = None,
+        pool_size: Optional[int] = None,
+        write_behind: Optional[bool] = None,
+        skills: Optional[List[BaseSkill]] = None,
+        skill_fan_out: Optional[bool] = None,
+        retrieval: Optional[bool] = None,
+        shards: Optional[int] = None
+    ):
         self.api_key = api_key
-        self.memory = HawsaAdvancedMemory()
-        self.user_analytics = AdvancedUserAnalytics(memory=self.memory)
+        # retrieval: بحث FTS5 عن رسائل وملاحظات قديمة مناسبة للرسالة (الافتراضي من HAWSA_RETRIEVAL)
+        self.retrieval = RETRIEVAL_ENABLED if retrieval is None else retrieval
+        
+        # write_behind: كتابة مؤجلة بمعاملات مجمّعة (الافتراضي من HAWSA_WRITE_BEHIND=1)
+        if write_behind is None:
+            write_behind = os.environ.get("HAWSA_WRITE_BEHIND", "0") == "1"
+        self.write_behind: Optional[WriteBehindQueue] = WriteBehindQueue() if write_behind else None
+        
+        # pool_size: عدد اتصالات SQLite لكل Worker ولكل ملف (الافتراضي من HAWSA_DB_POOL_SIZE)
+        # shards: توزيع المستخدمين على عدة ملفات لكل قاعدة (الافتراضي من HAWSA_DB_SHARDS=1)
+        self.memory = HawsaAdvancedMemory(
+            storage=open_storage(MEMORY_DB, shards, pool_size),
+            write_behind=self.write_behind
+        )
+        self.user_analytics = AdvancedUserAnalytics(
+            memory=self.memory,
+            storage=open_storage(ANALYTICS_DB, shards, pool_size),
+            write_behind=self.write_behind
+        )
         self.engineering_data = EngineeringDataIntegration()
         self.media_generator = MediaGenerator()
         
-        self.current_user_profile: Optional[UserProfile] = None
+        # خيوط القاعدة للمسار غير المتزامن (aprocess_comprehensive_query)
+        self.db_executor: AsyncDBExecutor = get_async_executor()
         
-        # تسجيل المهارات
-        self.skills: List[BaseSkill] = [
-            EngineeringSkill(),
-            CreativeDesignSkill(),
-            # لاحقًا تضيف Skills جديدة هنا
-        ]
+        # آخر بروفايل لكل خيط (للتوافق مع CLI القديم؛ خط المعالجة ما يعتمد عليه)
+        self._thread_state = threading.local()
+        
+        # فهرس كلمات واحد لكل المكوّنات: الرسالة تُمسح مرة وحدة لكل طلب
+        self.keywords = KeywordIndex()
+        for component in (self.user_analytics, self.media_generator):
+            self.keywords.register_groups(component.KEYWORD_GROUPS)
+        self.engineering_data.attach_keywords(self.keywords)
+        
+        # تسجيل المهارات (كلماتها تدخل نفس الفهرس)
+        if skill_fan_out is None:
+            skill_fan_out = os.environ.get("HAWSA_SKILL_FANOUT", "0") == "1"
+        self.skill_fan_out = skill_fan_out
+        self.skill_registry = SkillRegistry(self.keywords)
+        for skill in (skills if skills is not None else [cls() for cls in DEFAULT_SKILLS]):
+            self.skill_registry.register(skill)
+        self.keywords.build()
+        
+        # كاش أجزاء الرد (hawsa_cache.py): ينمسح عند تسجيل مهارة أو إعادة تحميل قاعدة المعرفة
+        self.response_cache = UserCache(
+            max_entries=RESPONSE_CACHE_ENTRIES,
+            ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+            max_bytes=int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+            size_of=fragment_size
+        )
+        self.skill_registry.on_change(self.invalidate_responses)
+        self.engineering_data.kb.on_reload(lambda _snapshot: self.invalidate_responses())
+        
+        # قيم الكاش / طابور الكتابة / المهارات تنقرأ وقت عرض /metrics
+        METRICS.register_collector("hawsa_core", self._collect_metrics)
+    
+    @property
+    def current_user_profile(self) -> Optional[UserProfile]:
+        return getattr(self._thread_state, "profile", None)
+    
+    @current_user_profile.setter
+    def current_user_profile(self, profile: Optional[UserProfile]):
+        self._thread_state.profile = profile
+    
+    @property
+    def skills(self) -> List[BaseSkill]:
+        return self.skill_registry.skills
+    
+    def register_skill(self, skill: BaseSkill, priority: Optional[int] = None):
+        self.skill_registry.register(skill, priority)
     
     def _generate_base_response(self, message: str) -> str:
         return (
@@ -408,98 +1351,553 @@ class HawsaCore:
         
         return intro + "\n" + base_response
     
-    def _generate_media_content(self, message: str, profile: UserProfile) -> Dict[str, Any]:
-        return self.media_generator.generate_media(message, profile)
+    def _generate_media_content(
+        self,
+        message: str,
+        profile: UserProfile,
+        match: Optional[KeywordMatch] = None
+    ) -> Dict[str, Any]:
+        return self.media_generator.generate_media(message, profile, match=match)
     
-    def _get_personalized_notes(self) -> List[str]:
-        # ممكن لاحقًا تسترجع ملاحظات من الذاكرة حسب user_id
-        return []
+    def _get_personalized_notes(self, ctx: "RequestContext") -> List[str]:
+        # ملاحظات طويلة المدى مناسبة للرسالة الحالية (تنحسب في _stage_retrieval)
+        return list(ctx.personalized_notes)
     
-    def _route_to_skill(self, message: str) -> Optional[str]:
+    def _route_to_skill(
+        self,
+        message: str,
+        match: Optional[KeywordMatch] = None,
+        volatile: Optional[List[BaseSkill]] = None
+    ) -> Optional[str]:
         """اختيار المهارة الأنسب للرسالة (لو فيه مهارة مناسبة)."""
-        for skill in self.skills:
-            try:
-                if skill.can_handle(message):
-                    return skill.handle(message, self)
-            except Exception as e:
-                print(f"[Skill Error] {skill.__class__.__name__}: {e}")
-        return None
+        if match is None:
+            match = self.keywords.scan(message)
+        return self.skill_registry.dispatch(message, self, match, fan_out=self.skill_fan_out, volatile=volatile)
     
-    def process_comprehensive_query(self, user_id: str, user_message: str) -> Dict[str, Any]:
-        """الدالة الرئيسية لمعالجة أي رسالة."""
-        start_time = datetime.now()
+    def invalidate_responses(self):
+        """مسح كاش أجزاء الرد (تغيرت المهارات أو قاعدة المعرفة أو منطق الصياغة)."""
+        self.response_cache.invalidate()
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """إحصائيات كاش السياق والبروفايل وأجزاء الرد (hits / misses / evictions / bytes)."""
+        return {
+            "context": self.memory.context_cache.stats(),
+            "profiles": self.user_analytics.profile_cache.stats(),
+            "responses": self.response_cache.stats(),
+        }
+    
+    def _collect_metrics(self):
+        caches = self.cache_stats()
+        yield "hawsa_cache_entries", "gauge", "Entries in the per-user cache", [
+            ({"cache": name}, stats["entries"]) for name, stats in caches.items()
+        ]
+        yield "hawsa_cache_bytes", "gauge", "Approximate bytes held by the per-user cache", [
+            ({"cache": name}, stats["bytes"]) for name, stats in caches.items()
+        ]
+        for field in ("hits", "misses", "evictions", "expirations"):
+            yield f"hawsa_cache_{field}_total", "counter", f"Per-user cache {field}", [
+                ({"cache": name}, stats[field]) for name, stats in caches.items()
+            ]
         
-        # 0. قراءة سياق سابق لنفس المستخدم
-        recent_context = self.memory.get_recent_context(user_id, limit=6)
+        skills = self.skill_registry.stats()
+        for field in ("hits", "errors", "timeouts"):
+            yield f"hawsa_skill_{field}_total", "counter", f"Skill {field}", [
+                ({"skill": name}, stats[field]) for name, stats in skills.items()
+            ]
         
-        # 1. تحليل المستخدم
-        self.current_user_profile = self.user_analytics.analyze_user_message(
-            user_id, user_message, 0.0
-        )
+        kb = self.engineering_data.kb.stats()
+        yield "hawsa_kb_entries", "gauge", "Entries in the loaded ECU/DTC knowledge base", [
+            ({"kind": kind}, kb[kind]) for kind in ("codes", "families", "vehicles", "rules")
+        ]
+        yield "hawsa_kb_reloads_total", "counter", "Knowledge base reloads", [
+            ({"result": "ok"}, kb["reloads"]), ({"result": "error"}, kb["reload_errors"])
+        ]
         
+        if self.write_behind is not None:
+            wb = self.write_behind.stats()
+            yield "hawsa_write_behind_queue_depth", "gauge", "Pending write-behind operations", [({}, wb["queue_depth"])]
+            yield "hawsa_write_behind_writer_up", "gauge", "1 while the write-behind writer thread is alive", [
+                ({}, int(wb["writer_alive"]))
+            ]
+            for field in ("enqueued", "committed", "batches", "errors", "dropped", "callback_errors"):
+                yield f"hawsa_write_behind_{field}_total", "counter", f"Write-behind {field}", [({}, wb[field])]
+    
+    def metrics_text(self) -> str:
+        """كل المقاييس بصيغة Prometheus النصية (لـ GET /metrics)."""
+        return render_metrics()
+    
+    def warm_up(self) -> Dict[str, Any]:
+        """
+        تجهيز الـ Worker قبل ما يستقبل طلبات (api_server: /ready):
+        كل اتصالات المجمّعات + الاستعلامات الساخنة (قراءة فقط) + مسح كلمات تجريبي.
+        """
+        started = time.perf_counter()
+        connections = 0
+        for component in (self.memory, self.user_analytics):
+            statements = [
+                (sql, params) for sql, params in component.HOT_QUERIES.values()
+                if sql.lstrip().upper().startswith("SELECT")
+            ]
+            for pool in component.storage.pools():
+                connections += pool.warm(statements)
+        self.keywords.scan("warm up P0300 boost code design")
+        self.engineering_data.get_ecu_recommendations("UNKNOWN", "warm up P0300 boost")
+        return {"connections": connections, "seconds": round(time.perf_counter() - started, 4)}
+    
+    def flush(self) -> int:
+        """
+        انتظار حفظ كل الكتابات المؤجلة (لو وضع write-behind مفعل).
+        ترجع عدد الكتابات اللي فشلت من آخر flush (WriteBehindError لو خيط الكتابة وقف).
+        """
+        if self.write_behind is not None:
+            return self.write_behind.flush()
+        return 0
+    
+    def close(self):
+        """إغلاق نظيف: تفريغ طابور الكتابة قبل إيقاف السيرفر / CLI."""
+        if self.write_behind is not None:
+            self.write_behind.close()
+        self.skill_registry.close()
+    
+    # ---------- مراحل خط المعالجة (كل الحالة داخل RequestContext) ----------
+    
+    def _new_request(
+        self,
+        user_id: str,
+        user_message: str,
+        context_mode: Optional[str] = None,
+        timings: Optional[bool] = None,
+        reload_kb: bool = True
+    ) -> "RequestContext":
+        if timings is None:
+            timings = TIMING_BREAKDOWN
+        ctx = RequestContext(user_id, user_message, resolve_context_mode(context_mode), timings)
+        # مسح واحد للكلمات المفتاحية يُشارك بين كل المراحل
+        # (قاعدة المعرفة تتحدث قبله حتى تدخل كلمات أي قواعد جديدة في نفس المسح؛
+        # المسار async يسويها على خيط قبل ما يوصل هنا، reload_kb=False)
+        if reload_kb:
+            self.engineering_data.kb.maybe_reload()
+        with span("keywords", ctx.trace):
+            ctx.match = self.keywords.scan(user_message)
+        return ctx
+    
+    def _finish_timing(self, ctx: "RequestContext", path: str):
+        ctx.processing_time = time.perf_counter() - ctx.start_time
+        record_request(path, ctx.processing_time)
+    
+    def _stage_context(self, ctx: "RequestContext"):
+        # 0. قراءة سياق سابق لنفس المستخدم
+        with span("context", ctx.trace):
+            ctx.recent_context = self.memory.get_recent_context(ctx.user_id, limit=6)
+        self._stage_retrieval(ctx)
+        self._stage_context_payload(ctx)
+    
+    def _stage_retrieval(self, ctx: "RequestContext"):
+        # 0.1 رسائل أقدم + ملاحظات مناسبة للرسالة (FTS5، hawsa_search.py)
+        if not self.retrieval:
+            return
+        with span("retrieval", ctx.trace):
+            try:
+                # أقل من 6 رسائل = كل سجل المستخدم موجود أصلاً في السياق
+                if len(ctx.recent_context) >= 6:
+                    recent_ids = {row["id"] for row in ctx.recent_context if row.get("id") is not None}
+                    ctx.relevant_context = self.memory.search_interactions(
+                        ctx.user_id, ctx.user_message, exclude_ids=recent_ids
+                    )
+                ctx.personalized_notes = [
+                    note["note_text"] for note in self.memory.search_notes(ctx.user_id, ctx.user_message)
+                ]
+            except Exception:
+                # الطلب يكمل بدون سياق مسترجع، والفشل يظهر في /metrics (hawsa_stage_errors_total)
+                record_stage_error("retrieval")
+    
+    def _stage_context_payload(self, ctx: "RequestContext"):
+        # 0.2 السياق المرسل للعميل: الرسائل المسترجعة (بترتيبها الزمني) ثم آخر N،
+        # مختصر بميزانية (hawsa_context.py) إلا لو طلب full
+        with span("context_payload", ctx.trace):
+            relevant = sorted(ctx.relevant_context, key=lambda row: row["id"])
+            ctx.context_used = assemble_context(relevant + ctx.recent_context, ctx.context_mode)
+    
+    def _stage_profile(self, ctx: "RequestContext"):
+        # 1. تحليل المستخدم
+        with span("profile", ctx.trace):
+            ctx.profile = self.user_analytics.analyze_user_message(
+                ctx.user_id, ctx.user_message, 0.0, match=ctx.match
+            )
+    
+    def _stage_recommendations(self, ctx: "RequestContext"):
         # 2. البحث في المعرفة الهندسية
-        technical_recommendations = self.engineering_data.get_ecu_recommendations(
-            "UNKNOWN", user_message
-        )
-        
-        # 3. توليد الرد الأساسي
-        base_response = self._generate_base_response(user_message)
-        
+        with span("recommendations", ctx.trace):
+            ctx.technical_recommendations = self.engineering_data.get_ecu_recommendations(
+                "UNKNOWN", ctx.user_message, match=ctx.match
+            )
+    
+    def _stage_skills(self, ctx: "RequestContext"):
         # 3.1 معالجة متقدمة عبر المهارات
-        skill_response = self._route_to_skill(user_message)
-        if skill_response:
-            base_response = base_response + "\n\n" + skill_response
-        
-        # 4. تخصيص الرد حسب شخصية المستخدم وخبرته
-        personalized_response = self._personalize_response(
-            base_response, self.current_user_profile
-        )
-        
+        with span("skills", ctx.trace):
+            ctx.skill_response = self._route_to_skill(ctx.user_message, ctx.match, ctx.volatile_skills)
+    
+    def _stage_cached_response(self, ctx: "RequestContext") -> bool:
+        """
+        بعد البروفايل: لو نفس الرسالة (بنفس حقول البروفايل المؤثرة) انحسبت قبل،
+        التوصيات + رد المهارة + النص + الوسائط تنقرأ من الكاش. True = لقيناها.
+        """
+        if not self.response_cache.enabled:
+            return False
+        with span("response_cache", ctx.trace):
+            ctx.response_key = response_key(
+                ctx.user_message,
+                self.engineering_data.kb.version,
+                self.skill_registry.version,
+                self.skill_fan_out,
+                *(getattr(ctx.profile, field) for field in self.RESPONSE_PROFILE_FIELDS)
+            )
+            fragment = self.response_cache.get(ctx.response_key) if ctx.response_key is not None else None
+            if fragment is None:
+                return False
+            (ctx.technical_recommendations, ctx.skill_response,
+             ctx.personalized_response, ctx.media_content) = fragment.copy()
+            ctx.response_cached = True
+            return True
+    
+    def _remember_response(self, ctx: "RequestContext"):
+        # مهارة فشلت / انتهت مهلتها / CACHEABLE=False: الرد الجاي ممكن يختلف، فما ينحفظ
+        if ctx.response_key is None or ctx.response_cached or ctx.volatile_skills:
+            return
+        self.response_cache.put(ctx.response_key, ResponseFragment(
+            ctx.technical_recommendations, ctx.skill_response, ctx.personalized_response, ctx.media_content
+        ))
+    
+    def _stage_response(self, ctx: "RequestContext"):
+        self._stage_skills(ctx)
+        self._compose_response(ctx)
+    
+    def _compose_response(self, ctx: "RequestContext"):
+        with span("compose", ctx.trace):
+            # 3. توليد الرد الأساسي
+            base_response = self._generate_base_response(ctx.user_message)
+            if ctx.skill_response:
+                base_response = base_response + "\n\n" + ctx.skill_response
+            
+            # 4. تخصيص الرد حسب شخصية المستخدم وخبرته
+            ctx.personalized_response = self._personalize_response(base_response, ctx.profile)
+    
+    def _stage_media(self, ctx: "RequestContext"):
         # 5. إنشاء الوسائط المناسبة
-        media_content = self._generate_media_content(user_message, self.current_user_profile)
-        
-        end_time = datetime.now()
-        processing_time = (end_time - start_time).total_seconds()
-        
+        with span("media", ctx.trace):
+            ctx.media_content = self._generate_media_content(ctx.user_message, ctx.profile, ctx.match)
+    
+    def _stage_persist(self, ctx: "RequestContext"):
         # 6. حفظ التفاعل في الذاكرة (user + assistant)
-        try:
-            self.memory.save_interaction(
-                user_id=user_id,
-                role="user",
-                content=user_message,
-                tags=["input"]
-            )
-            self.memory.save_interaction(
-                user_id=user_id,
-                role="assistant",
-                content=personalized_response,
-                tags=["response"]
-            )
-        except Exception as e:
-            print(f"[Memory Error] {e}")
-        
+        with span("persist", ctx.trace):
+            try:
+                self.memory.save_interaction(
+                    user_id=ctx.user_id,
+                    role="user",
+                    content=ctx.user_message,
+                    tags=["input"]
+                )
+                self.memory.save_interaction(
+                    user_id=ctx.user_id,
+                    role="assistant",
+                    content=ctx.personalized_response,
+                    tags=["response"]
+                )
+            except Exception as e:
+                print(f"[Memory Error] {e}")
+    
+    def _profile_payload(self, ctx: "RequestContext") -> Dict[str, Any]:
+        profile = ctx.profile
+        return {
+            'personality': profile.personality_type.value,
+            'expertise': profile.expertise_level.value,
+            'interests': profile.technical_interests,
+            'confidence': profile.confidence_score
+        }
+    
+    def _analytics_payload(self, ctx: "RequestContext") -> Dict[str, Any]:
+        analytics = {
+            'processing_time_seconds': ctx.processing_time,
+            'content_types_generated': [ct.value for ct in ctx.profile.preferred_content_types],
+            'interaction_quality': 'HIGH' if len(ctx.user_message) > 20 else 'MEDIUM',
+            'response_cached': ctx.response_cached
+        }
+        if ctx.trace is not None:
+            # مللي ثانية لكل مرحلة + وقت/عدد عمليات القاعدة + total
+            analytics['timings_ms'] = ctx.trace.as_dict(time.perf_counter() - ctx.start_time)
+        return analytics
+    
+    def _build_result(self, ctx: "RequestContext") -> Dict[str, Any]:
         return {
             'success': True,
-            'user_id': user_id,
-            'user_profile': {
-                'personality': self.current_user_profile.personality_type.value,
-                'expertise': self.current_user_profile.expertise_level.value,
-                'interests': self.current_user_profile.technical_interests,
-                'confidence': self.current_user_profile.confidence_score
-            },
-            'context_used': recent_context,
+            'user_id': ctx.user_id,
+            'user_profile': self._profile_payload(ctx),
+            'context_used': ctx.context_used,
             'response': {
-                'text': personalized_response,
-                'technical_recommendations': technical_recommendations,
-                'personalized_notes': self._get_personalized_notes()
+                'text': ctx.personalized_response,
+                'technical_recommendations': ctx.technical_recommendations,
+                'personalized_notes': self._get_personalized_notes(ctx)
             },
-            'media': media_content,
-            'analytics': {
-                'processing_time_seconds': processing_time,
-                'content_types_generated': [ct.value for ct in self.current_user_profile.preferred_content_types],
-                'interaction_quality': 'HIGH' if len(user_message) > 20 else 'MEDIUM'
-            }
+            'media': ctx.media_content,
+            'analytics': self._analytics_payload(ctx)
         }
+    
+    def _iter_stages(
+        self,
+        ctx: "RequestContext",
+        include_context: bool = True,
+        path: str = "sync"
+    ) -> Iterator[Tuple[str, Any]]:
+        """
+        خط المعالجة كمولّد: كل مرحلة تُرجع (اسم المرحلة، بياناتها) أول ما تجهز.
+        لو المستهلك وقف بعد ما وصله الرد (العميل قطع الاتصال)، التفاعل ينحفظ مع ذلك.
+        """
+        persisted = False
+        try:
+            self._stage_context(ctx)
+            self._stage_profile(ctx)
+            yield 'user_profile', self._profile_payload(ctx)
+            
+            cached = self._stage_cached_response(ctx)
+            if not cached:
+                self._stage_recommendations(ctx)
+            yield 'technical_recommendations', ctx.technical_recommendations
+            
+            if not cached:
+                self._stage_skills(ctx)
+            yield 'skill_response', ctx.skill_response
+            
+            if not cached:
+                self._compose_response(ctx)
+            yield 'response', {
+                'text': ctx.personalized_response,
+                'personalized_notes': self._get_personalized_notes(ctx)
+            }
+            
+            if not cached:
+                self._stage_media(ctx)
+                self._remember_response(ctx)
+            yield 'media', ctx.media_content
+            
+            self._finish_timing(ctx, path)
+            self._stage_persist(ctx)
+            persisted = True
+            self.current_user_profile = ctx.profile
+            yield 'analytics', self._analytics_payload(ctx)
+            
+            # السياق آخر شي وبس لو العميل طلبه (أكبر جزء في الرد)
+            if include_context:
+                yield 'context_used', ctx.context_used
+        finally:
+            if not persisted and ctx.personalized_response:
+                self._stage_persist(ctx)
+    
+    def iter_comprehensive_query(
+        self,
+        user_id: str,
+        user_message: str,
+        include_context: bool = True,
+        context_mode: Optional[str] = None,
+        timings: Optional[bool] = None
+    ) -> Iterator[Tuple[str, Any]]:
+        """
+        نسخة متدفقة من process_comprehensive_query (لـ /analyze/stream):
+        user_profile, technical_recommendations, skill_response, response, media, analytics,
+        ثم context_used (اختياري)، وأخيرًا done.
+        """
+        ctx = self._new_request(user_id, user_message, context_mode, timings)
+        for stage, payload in self._iter_stages(ctx, include_context, path="stream"):
+            yield stage, payload
+        yield 'done', {'success': True, 'user_id': user_id}
+    
+    def process_comprehensive_query(
+        self,
+        user_id: str,
+        user_message: str,
+        context_mode: Optional[str] = None,
+        timings: Optional[bool] = None
+    ) -> Dict[str, Any]:
+        """
+        الدالة الرئيسية لمعالجة أي رسالة.
+        آمنة للاستدعاء المتوازي على نفس النسخة: حالة الطلب كلها في RequestContext.
+        context_mode: compact (الافتراضي) / ids / full لشكل context_used.
+        timings: إضافة analytics.timings_ms (الافتراضي من HAWSA_TIMING_BREAKDOWN).
+        """
+        ctx = self._new_request(user_id, user_message, context_mode, timings)
+        for _stage in self._iter_stages(ctx):
+            pass
+        return self._build_result(ctx)
+    
+    def process_batch(
+        self,
+        items: List[Tuple[str, str]],
+        context_mode: Optional[str] = None,
+        timings: Optional[bool] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        معالجة دفعة (user_id, message) بالترتيب مع حفظ جماعي:
+        البروفايلات + الملاحظات + التفاعلات تتجمع وتنحفظ بمعاملات قليلة، وتنكتب قبل أي رسالة
+        ثانية لنفس المستخدم. فكل رسالة تشوف (سياق + بحث نصي + ملاحظات) مثل معالجتها واحدة واحدة،
+        والنتائج مطابقة لـ process_comprehensive_query بالترتيب (ما عدا id والتوقيت).
+        لو فشل الحفظ: نتائج الرسائل اللي ما انحفظت + اللي بعدها {'success': False, 'error': ...}.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        pending: List[Tuple[int, RequestContext]] = []
+        pending_users: Set[str] = set()
+        
+        def flush_pending():
+            if not pending:
+                return
+            ctxs = [ctx for _position, ctx in pending]
+            self.user_analytics.save_profiles([ctx.profile for ctx in ctxs])
+            self.memory.save_interactions([
+                (ctx.user_id, role, content, [tag], None)
+                for ctx in ctxs
+                for role, content, tag in (
+                    ("user", ctx.user_message, "input"),
+                    ("assistant", ctx.personalized_response, "response")
+                )
+            ])
+            for position, ctx in pending:
+                results[position] = self._build_result(ctx)
+            pending.clear()
+            pending_users.clear()
+        
+        position = 0
+        try:
+            for position, (user_id, message) in enumerate(items):
+                if user_id in pending_users:
+                    # الرسالة السابقة لنفس المستخدم لازم تكون في القاعدة قبل سياق هذي الرسالة
+                    flush_pending()
+                ctx = self._new_request(user_id, message, context_mode, timings)
+                self._stage_context(ctx)
+                with span("profile", ctx.trace):
+                    ctx.profile = self.user_analytics.infer_profile(user_id, ctx.user_message, 0.0, match=ctx.match)
+                if not self._stage_cached_response(ctx):
+                    self._stage_recommendations(ctx)
+                    self._stage_response(ctx)
+                    self._stage_media(ctx)
+                    self._remember_response(ctx)
+                self._finish_timing(ctx, "batch")
+                pending.append((position, ctx))
+                pending_users.add(user_id)
+            position = len(items)
+            flush_pending()
+        except Exception as e:
+            # ما نرجع نجاح لرسالة ما انحفظت: الدفعة تقف هنا
+            print(f"[Batch Error] {e}")
+            record_stage_error("batch")
+            failed = [p for p, _ctx in pending] + list(range(position, len(items)))
+            for p in failed:
+                if results[p] is None:
+                    results[p] = {'success': False, 'user_id': items[p][0], 'error': str(e)}
+        return results
+    
+    async def aprocess_comprehensive_query(
+        self,
+        user_id: str,
+        user_message: str,
+        context_mode: Optional[str] = None,
+        timings: Optional[bool] = None
+    ) -> Dict[str, Any]:
+        """
+        نفس خط المعالجة لكن async (لـ FastAPI): عمليات القاعدة تشتغل على خيوط القاعدة،
+        والمراحل الحسابية (توصيات ECU، الوسائط، المهارات) تشتغل وقت انتظار القاعدة.
+        ترتيب القراءة والكتابة نفس process_comprehensive_query (السياق والاسترجاع قبل حفظ
+        البروفايل وملاحظته)، فالنتيجة مطابقة لها.
+        """
+        kb = self.engineering_data.kb
+        if kb.reload_due():
+            # فحص الملف (stat + قراءة لو تغير) على خيط، مو على الـ event loop
+            await self.db_executor.run(kb.maybe_reload)
+        ctx = self._new_request(user_id, user_message, context_mode, timings, reload_kb=False)
+        # المهام وخيوط القاعدة ترث trace الطلب (وقت القاعدة ينحسب عليه حتى لو بالتوازي)
+        with activate(ctx.trace):
+            return await self._aprocess(ctx)
+    
+    def _retrieve_then_save_profile(self, ctx: "RequestContext"):
+        # الاسترجاع يشوف الملاحظات قبل ملاحظة اهتمامات هذه الرسالة (نفس ترتيب المسار المتزامن)
+        self._stage_retrieval(ctx)
+        self.user_analytics.save_profile(ctx.profile)
+    
+    async def _aprocess(self, ctx: "RequestContext") -> Dict[str, Any]:
+        user_id, user_message = ctx.user_id, ctx.user_message
+        tasks: List[asyncio.Future] = []
+        
+        def launch(awaitable) -> asyncio.Future:
+            task = asyncio.ensure_future(awaitable)
+            tasks.append(task)
+            return task
+        
+        try:
+            # استنتاج البروفايل بدون I/O، ثم إطلاق عمليات القاعدة
+            with span("profile", ctx.trace):
+                ctx.profile = self.user_analytics.infer_profile(user_id, user_message, 0.0, match=ctx.match)
+            # المستخدم النشط: السياق من الكاش مباشرة بدون خيط قاعدة
+            cached_context = self.memory.cached_recent_context(user_id, 6)
+            if cached_context is None:
+                context_task = launch(self.db_executor.run(self.memory.get_recent_context, user_id, 6))
+            # المهارات ممكن تكون بطيئة (لها مهلة)، فتنتظر بدون حجز خيط الـ event loop
+            cached = self._stage_cached_response(ctx)
+            if not cached:
+                skill_task = launch(self.skill_registry.adispatch(
+                    user_message, self, ctx.match, fan_out=self.skill_fan_out, volatile=ctx.volatile_skills
+                ))
+            
+            # الاسترجاع يحتاج ids آخر N (عادة من الكاش فورًا)، وبعده حفظ البروفايل على نفس خيط القاعدة
+            if cached_context is not None:
+                ctx.recent_context = cached_context
+            else:
+                with span("context", ctx.trace):
+                    ctx.recent_context = await context_task
+            if self.write_behind is not None:
+                # الكتابة المؤجلة مجرد إضافة للطابور، فما تحتاج خيط
+                retrieval_task = launch(self.db_executor.run(self._stage_retrieval, ctx))
+            else:
+                retrieval_task = launch(self.db_executor.run(self._retrieve_then_save_profile, ctx))
+            
+            if not cached:
+                self._stage_recommendations(ctx)
+                self._stage_media(ctx)
+                
+                with span("skills", ctx.trace):
+                    ctx.skill_response = await skill_task
+                self._compose_response(ctx)
+                self._remember_response(ctx)
+            await retrieval_task
+            if self.write_behind is not None:
+                self.user_analytics.save_profile(ctx.profile)
+            self._stage_context_payload(ctx)
+        finally:
+            # خطأ في أي مرحلة: ما نترك مهام معلقة (ولا استثناءات ما أحد قراها)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+        
+        self._finish_timing(ctx, "async")
+        
+        if self.write_behind is not None:
+            self._stage_persist(ctx)
+        else:
+            await self.db_executor.run(self._stage_persist, ctx)
+        
+        return self._build_result(ctx)
+
+def prepare_storage(shards: Optional[int] = None) -> Dict[str, List[int]]:
+    """
+    ترقية مخطط كل الملفات مرة وحدة قبل تشغيل الـ Workers (api_server --workers N)،
+    فكل Worker يلقى المخطط محدث ويكتفي بقراءة user_version.
+    ترجع الترحيلات المطبقة لكل ملف.
+    """
+    applied = {}
+    for db_path, migrations in ((MEMORY_DB, MEMORY_MIGRATIONS), (ANALYTICS_DB, ANALYTICS_MIGRATIONS)):
+        for pool in open_storage(db_path, shards, pool_size=1).pools():
+            applied[pool.db_path] = ensure_schema(pool, migrations)
+            # العملية الأم ما تخدم طلبات: get_pool ينشئ مجمّع جديد بالحجم الكامل لو احتاجته
+            pool.close()
+    return applied
 
 # ==========================
 # 6) وضع التشغيل التجريبي (CLI)
@@ -523,3 +1921,5 @@ if __name__ == "__main__":
         
         result = core.process_comprehensive_query(user_id, msg)
         print("\nHawsa AI:\n", result["response"]["text"])
+    
+    core.close()
@@ -0,0 +1,499 @@
+import asyncio
+import atexit
+import contextvars
+import functools
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from hawsa_tracing import db_tracing, record_db
+
+# ==========================
+# طبقة اتصالات SQLite المشتركة (Connection Pool)
+# ==========================
+
+# إعدادات قابلة للضبط لكل Worker عبر متغيرات البيئة
+DEFAULT_POOL_SIZE = int(os.environ.get("HAWSA_DB_POOL_SIZE", "4"))
+DEFAULT_SYNCHRONOUS = os.environ.get("HAWSA_DB_SYNCHRONOUS", "NORMAL")
+DEFAULT_CACHE_SIZE_KB = int(os.environ.get("HAWSA_DB_CACHE_KB", "8192"))
+DEFAULT_BUSY_TIMEOUT_MS = int(os.environ.get("HAWSA_DB_BUSY_TIMEOUT_MS", "5000"))
+
+# عدد الاستعلامات المجهزة (prepared statements) المحفوظة لكل اتصال
+STATEMENT_CACHE_SIZE = 128
+
+_SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+# دوال SQL مخصصة تُسجل على كل اتصال جديد (سجّلها وقت الاستيراد قبل فتح أي اتصال)
+_SQL_FUNCTIONS: Dict[str, tuple] = {}
+
+def register_sql_function(name: str, nargs: int, fn: Callable[..., Any]):
+    _SQL_FUNCTIONS[name] = (nargs, fn)
+
+class SQLitePool:
+    """
+    مجمّع اتصالات SQLite آمن بين الخيوط:
+    - اتصالات دائمة بدل فتح/إغلاق الملف مع كل استعلام
+    - وضع WAL مع إعدادات synchronous / cache قابلة للضبط
+    - إعادة استخدام الاستعلامات المجهزة عبر statement cache لكل اتصال
+    """
+    def __init__(
+        self,
+        db_path: str,
+        pool_size: Optional[int] = None,
+        synchronous: Optional[str] = None,
+        cache_size_kb: Optional[int] = None,
+        busy_timeout_ms: Optional[int] = None
+    ):
+        self.db_path = db_path
+        # label "db" في مقاييس /metrics
+        self.name = os.path.basename(db_path)
+        self.pool_size = max(1, pool_size or DEFAULT_POOL_SIZE)
+        self.synchronous = (synchronous or DEFAULT_SYNCHRONOUS).upper()
+        if self.synchronous not in _SYNCHRONOUS_MODES:
+            raise ValueError(f"Invalid synchronous mode: {self.synchronous}")
+        self.cache_size_kb = cache_size_kb or DEFAULT_CACHE_SIZE_KB
+        self.busy_timeout_ms = busy_timeout_ms or DEFAULT_BUSY_TIMEOUT_MS
+        
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        
+        # قاعدة في الذاكرة: كل اتصال جديد يفتح قاعدة مستقلة، فنكتفي باتصال واحد مشترك
+        self.is_memory = db_path == ":memory:"
+        if self.is_memory:
+            self.pool_size = 1
+            self._created = 1
+            self._idle.put(self._connect())
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000.0,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        if not self.is_memory:
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        for name, (nargs, fn) in _SQL_FUNCTIONS.items():
+            conn.create_function(name, nargs, fn, deterministic=True)
+        return conn
+    
+    def _acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError(f"SQLitePool for {self.db_path} is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        
+        # كل الاتصالات مشغولة: ننتظر أول اتصال يرجع
+        try:
+            return self._idle.get(timeout=self.busy_timeout_ms / 1000.0)
+        except queue.Empty:
+            raise TimeoutError(f"No free connection in pool for {self.db_path}")
+    
+    def _release(self, conn: sqlite3.Connection):
+        if self._closed:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+    
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """استعارة اتصال للقراءة (بدون commit)."""
+        traced = db_tracing()
+        start = time.perf_counter() if traced else 0.0
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._release(conn)
+            if traced:
+                record_db(self.name, "query", time.perf_counter() - start)
+    
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """استعارة اتصال داخل معاملة واحدة: commit عند النجاح و rollback عند الخطأ."""
+        traced = db_tracing()
+        start = time.perf_counter() if traced else 0.0
+        committed = False
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+            committed = True
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._release(conn)
+            if traced:
+                record_db(self.name, "transaction", time.perf_counter() - start, committed)
+    
+    def warm(self, statements: Sequence[Tuple[str, Sequence[Any]]] = ()) -> int:
+        """
+        فتح كل اتصالات المجمّع مسبقًا وتشغيل الاستعلامات الساخنة على كل واحد
+        (PRAGMAs + statement cache + صفحات الفهارس)، حتى ما يدفع أول طلبات الـ Worker الثمن.
+        ترجع عدد الاتصالات المجهزة.
+        """
+        held = []
+        try:
+            while len(held) < self.pool_size:
+                try:
+                    held.append(self._acquire())
+                except TimeoutError:
+                    break
+            for conn in held:
+                for sql, params in statements:
+                    conn.execute(sql, params).fetchall()
+                if conn.in_transaction:
+                    conn.rollback()
+        finally:
+            for conn in held:
+                self._release(conn)
+        return len(held)
+    
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+# ==========================
+# واجهة async فوق المجمّع (مسار /analyze غير المتزامن)
+# ==========================
+
+class AsyncDBExecutor:
+    """
+    تشغيل عمليات SQLite من كود asyncio على خيوط مخصصة للقاعدة
+    (بنفس أسلوب aiosqlite)، بدل حجز خيوط threadpool الخاصة بـ FastAPI.
+    """
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or int(
+            os.environ.get("HAWSA_DB_ASYNC_WORKERS", str(DEFAULT_POOL_SIZE * 2))
+        )
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hawsa-db")
+    
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        # نسخ الـ context حتى يوصل trace الطلب (hawsa_tracing.py) لخيط القاعدة
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(context.run, fn, *args, **kwargs)
+        )
+    
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+_async_executor: Optional[AsyncDBExecutor] = None
+
+def get_async_executor() -> AsyncDBExecutor:
+    global _async_executor
+    if _async_executor is None:
+        with _pools_lock:
+            if _async_executor is None:
+                _async_executor = AsyncDBExecutor()
+    return _async_executor
+
+# ==========================
+# سجل المجمّعات المشتركة بين الكلاسات
+# ==========================
+
+_pools: Dict[str, SQLitePool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path: str, pool_size: Optional[int] = None, **options) -> SQLitePool:
+    """إرجاع مجمّع مشترك لنفس ملف القاعدة (ينشأ مرة واحدة لكل Worker)."""
+    if db_path == ":memory:":
+        return SQLitePool(db_path, pool_size=pool_size, **options)
+    
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            pool = SQLitePool(db_path, pool_size=pool_size, **options)
+            _pools[key] = pool
+        return pool
+
+def close_all_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+# ==========================
+# طابور الكتابة المؤجلة (Write-Behind / Group Commit)
+# ==========================
+
+DEFAULT_WB_MAX_QUEUE = int(os.environ.get("HAWSA_WB_MAX_QUEUE", "10000"))
+DEFAULT_WB_BATCH_SIZE = int(os.environ.get("HAWSA_WB_BATCH_SIZE", "256"))
+DEFAULT_WB_FLUSH_MS = int(os.environ.get("HAWSA_WB_FLUSH_MS", "50"))
+# كل كم ثانية يتأكد submit / flush إن خيط الكتابة حي وهم ينتظرون
+WB_LIVENESS_POLL_S = 0.5
+# آخر كتابات فشلت (للتشخيص في stats / failures)
+WB_FAILURE_HISTORY = 20
+
+class WriteBehindError(RuntimeError):
+    """خيط الكتابة المؤجلة وقف، فالكتابات الجديدة ما راح توصل للقرص."""
+
+class _WriteOp:
+    __slots__ = ("pool", "sql", "params", "guard", "on_commit", "rowid")
+    
+    def __init__(self, pool, sql, params, guard, on_commit):
+        self.pool = pool
+        self.sql = sql
+        self.params = params
+        self.guard = guard
+        self.on_commit = on_commit
+        self.rowid: Optional[int] = None
+
+class WriteBehindQueue:
+    """
+    طابور كتابة محدود الحجم + خيط خلفي يفرّغه في معاملات مجمّعة:
+    - تفريغ عند امتلاء الدفعة (batch_size) أو بعد مهلة (flush_ms)
+    - flush() / close() يضمنون وصول كل شيء للقرص (ومسجلة في atexit)
+    - guard: قفل يُمسك أثناء commit + on_commit حتى يقدر القارئ يشوف
+      الكتابات المعلقة بدون تكرار أو فقدان (read-your-writes)
+    - on_commit(rowid): rowid = lastrowid للـ INSERT (أو None لو فشلت الكتابة)
+    - أي خطأ في دفعة أو في on_commit ينحسب في stats() وما يوقف الخيط؛ ولو وقف الخيط لأي سبب،
+      submit / flush يرفعون WriteBehindError بدل الانتظار للأبد أو الرجوع بصمت
+    """
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_ms: Optional[int] = None
+    ):
+        self.batch_size = max(1, batch_size or DEFAULT_WB_BATCH_SIZE)
+        self.flush_interval = (flush_ms if flush_ms is not None else DEFAULT_WB_FLUSH_MS) / 1000.0
+        self._queue: "queue.Queue[Optional[_WriteOp]]" = queue.Queue(maxsize=max_size or DEFAULT_WB_MAX_QUEUE)
+        self._closed = False
+        
+        # مقاييس
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.committed = 0
+        self.batches = 0
+        # errors = كل خطأ (دفعة فشلت، كتابة انحذفت، on_commit رمى)؛ dropped = كتابات ما وصلت للقرص
+        self.errors = 0
+        self.dropped = 0
+        self.callback_errors = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        # الكتابات اللي انحذفت من آخر flush() (ترجعها flush) + آخر WB_FAILURE_HISTORY للتشخيص
+        self._dropped_since_flush = 0
+        self._failures: List[Dict[str, Any]] = []
+        
+        self._thread = threading.Thread(target=self._run, name="hawsa-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+    
+    def _check_writer(self):
+        if not self._thread.is_alive():
+            raise WriteBehindError("write-behind writer thread is not running; pending writes will not be persisted")
+    
+    def submit(
+        self,
+        pool: SQLitePool,
+        sql: str,
+        params: Sequence[Any] = (),
+        guard: Optional[threading.Lock] = None,
+        on_commit: Optional[Callable[[Optional[int]], None]] = None
+    ):
+        """إضافة كتابة للطابور (تنتظر لو الطابور ممتلئ = backpressure طبيعي)."""
+        if self._closed:
+            raise RuntimeError("WriteBehindQueue is closed")
+        op = _WriteOp(pool, sql, params, guard, on_commit)
+        while True:
+            self._check_writer()
+            try:
+                self._queue.put(op, timeout=WB_LIVENESS_POLL_S)
+                break
+            except queue.Full:
+                continue
+        with self._stats_lock:
+            self.enqueued += 1
+    
+    def _collect_batch(self, first: _WriteOp) -> List[Optional[_WriteOp]]:
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                op = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(op)
+            if op is None:
+                break
+        return batch
+    
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                self._queue.task_done()
+                return
+            batch = [first]
+            try:
+                batch = self._collect_batch(first)
+                self._commit_batch([op for op in batch if op is not None])
+            except Exception as e:
+                # ما نخلي خطأ غير متوقع يقتل الخيط (الطابور يوقف وflush ينتظر للأبد)
+                self._record_failure(None, e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if None in batch:
+                return
+    
+    def _record_failure(self, op: Optional[_WriteOp], error: BaseException, dropped: bool = False, callback: bool = False):
+        with self._stats_lock:
+            self.errors += 1
+            if dropped:
+                self.dropped += 1
+                self._dropped_since_flush += 1
+            if callback:
+                self.callback_errors += 1
+            self._failures.append({
+                "kind": "dropped" if dropped else "callback" if callback else "batch",
+                "sql": " ".join(op.sql.split())[:120] if op is not None else None,
+                "error": f"{type(error).__name__}: {error}",
+                "at": time.time(),
+            })
+            del self._failures[:-WB_FAILURE_HISTORY]
+    
+    def _commit_batch(self, ops: List[_WriteOp]):
+        # تجميع حسب ملف القاعدة مع الحفاظ على ترتيب الكتابات
+        by_pool: Dict[int, List[_WriteOp]] = {}
+        for op in ops:
+            by_pool.setdefault(id(op.pool), []).append(op)
+        
+        for pool_ops in by_pool.values():
+            pool = pool_ops[0].pool
+            guards = sorted({id(op.guard): op.guard for op in pool_ops if op.guard}.items())
+            for _, guard in guards:
+                guard.acquire()
+            try:
+                try:
+                    with pool.transaction() as conn:
+                        for op in pool_ops:
+                            op.rowid = conn.execute(op.sql, op.params).lastrowid
+                    committed = pool_ops
+                except Exception as e:
+                    print(f"[Write-Behind Error] batch of {len(pool_ops)}: {e}")
+                    self._record_failure(None, e)
+                    committed = self._commit_one_by_one(pool, pool_ops)
+                for op in pool_ops:
+                    if op.on_commit:
+                        try:
+                            op.on_commit(op.rowid)
+                        except Exception as e:
+                            print(f"[Write-Behind Error] on_commit: {e}")
+                            self._record_failure(op, e, callback=True)
+            finally:
+                for _, guard in reversed(guards):
+                    guard.release()
+            
+            with self._stats_lock:
+                self.committed += len(committed)
+                self.batches += 1
+                self.last_batch_size = len(pool_ops)
+                self.max_batch_size = max(self.max_batch_size, len(pool_ops))
+    
+    def _commit_one_by_one(self, pool: SQLitePool, ops: List[_WriteOp]) -> List[_WriteOp]:
+        """لو فشلت الدفعة: نعزل الكتابة المعطوبة ونحفظ الباقي (المعطوبة تنحسب dropped)."""
+        committed = []
+        for op in ops:
+            try:
+                op.rowid = None
+                with pool.transaction() as conn:
+                    op.rowid = conn.execute(op.sql, op.params).lastrowid
+                committed.append(op)
+            except Exception as e:
+                self._record_failure(op, e, dropped=True)
+                print(f"[Write-Behind Error] dropped write: {e}")
+        return committed
+    
+    def flush(self) -> int:
+        """
+        انتظار حتى تُكتب كل العناصر الموجودة في الطابور.
+        ترجع عدد الكتابات اللي فشلت وانحذفت من آخر flush (0 = كل شي وصل للقرص).
+        WriteBehindError لو الخيط وقف بدون close() (الكتابات الجاية ما راح تنكتب).
+        """
+        if not self._closed:
+            self._check_writer()
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                if not self._thread.is_alive():
+                    raise WriteBehindError(
+                        f"write-behind writer thread stopped with {self._queue.unfinished_tasks} writes pending"
+                    )
+                self._queue.all_tasks_done.wait(WB_LIVENESS_POLL_S)
+        with self._stats_lock:
+            dropped, self._dropped_since_flush = self._dropped_since_flush, 0
+        return dropped
+    
+    def close(self):
+        """flush + إيقاف الخيط الخلفي (آمن للاستدعاء أكثر من مرة)."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+    
+    def failures(self) -> List[Dict[str, Any]]:
+        """آخر الأخطاء (kind: batch / dropped / callback، الاستعلام، الخطأ، الوقت)."""
+        with self._stats_lock:
+            return [dict(item) for item in self._failures]
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "writer_alive": self._thread.is_alive(),
+                "enqueued": self.enqueued,
+                "committed": self.committed,
+                "batches": self.batches,
+                "errors": self.errors,
+                "dropped": self.dropped,
+                "callback_errors": self.callback_errors,
+                "last_error": self._failures[-1]["error"] if self._failures else None,
+                "last_batch_size": self.last_batch_size,
+                "max_batch_size": self.max_batch_size,
+                "avg_batch_size": (self.committed / self.batches) if self.batches else 0.0,
+            }
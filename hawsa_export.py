@@ -0,0 +1,414 @@
+import gzip
+import io
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from hawsa_migrations import ANALYTICS_MIGRATIONS, MEMORY_MIGRATIONS, ensure_schema
+from hawsa_storage import DEFAULT_SHARDS, Storage, copy_rows, open_storage, rowid_column, shard_paths
+
+# ==========================
+# تصدير / استيراد الذاكرة (NDJSON) وإعادة تشغيل سجل الطلبات
+# ==========================
+# بدل نسخ ملفات .db: سطر JSON لكل صف {"table": ..., "row": {...}}، فالملف يقرأ ويكتب بالتدفق
+# (ذاكرة ثابتة مهما كبرت القاعدة) ويمر بين أي تخطيطين (ملف واحد / shards بأي عدد):
+# - التصدير: cursor لكل ملف وجدول، fetchmany بدفعات EXPORT_BATCH_SIZE، وفلتر اختياري بالمستخدمين
+#   (الملفات المسؤولة عنهم فقط) وبالوقت
+# - الاستيراد: دفعات IMPORT_BATCH_SIZE صف، كل دفعة تتوزع على ملفاتها (group_by_pool) بمعاملة لكل ملف،
+#   بنفس قواعد migrate_layout (copy_rows): id يبقى إلا لو تعارض مع صف ثاني، والـ id الجديد ينسجل
+#   في hawsa_id_map فالاستيراد مرة ثانية ما يكرر شي، والبروفايل الموجود يبقى كما هو
+# - replay: تمرير سجل طلبات (JSONL) على HawsaCore بمعدل محدد، لتسخين الكاش وبناء البروفايلات بعد الترحيل
+#
+# الاستيراد يكتب مباشرة في الملفات: السيرفر الشغال ما يشوف الصفوف الجديدة في كاش السياق لين يعاد تشغيله.
+
+EXPORT_BATCH_SIZE = int(os.environ.get("HAWSA_EXPORT_BATCH", "1000"))
+IMPORT_BATCH_SIZE = int(os.environ.get("HAWSA_IMPORT_BATCH", "1000"))
+
+MEMORY_TABLES = ("conversation_memory", "long_term_notes")
+ANALYTICS_TABLES = ("user_profiles",)
+EXPORT_TABLES = MEMORY_TABLES + ANALYTICS_TABLES
+
+# عمود الوقت لفلتر --since / --until (نص UTC بصيغة YYYY-MM-DD HH:MM:SS، فالمقارنة النصية تكفي)
+TIME_COLUMNS = {
+    "conversation_memory": "created_at",
+    "long_term_notes": "COALESCE(last_seen_at, created_at)",
+    "user_profiles": "updated_at",
+}
+
+# حقول سجل الطلبات المقبولة في replay (بالترتيب)؛ requests.jsonl فيه title / body بدل message
+REPLAY_USER_FIELDS = ("user_id", "user")
+# أعمدة تنحسب من باقي الصف (fts_body = نص البحث المفهرس): ما تنصدّر، والاستيراد يحسبها من جديد
+DERIVED_COLUMNS = frozenset({"fts_body"})
+REPLAY_MESSAGE_FIELDS = ("message", "text", "body", "title")
+# تقرير replay: أماكن الطلبات الفاشلة (العدد في failed دائمًا كامل)
+REPLAY_MAX_FAILED_INDICES = int(os.environ.get("HAWSA_REPLAY_MAX_FAILED_INDICES", "1000"))
+
+def normalize_timestamp(value: Optional[str]) -> Optional[str]:
+    """'2024-05-01' أو '2024-05-01T10:00:00Z' -> '2024-05-01 10:00:00' (نفس صيغة القاعدة)."""
+    if not value:
+        return None
+    text = value.strip().replace("T", " ").rstrip("Z")
+    if len(text) == 10:
+        text += " 00:00:00"
+    return text[:19]
+
+@contextmanager
+def open_ndjson(path: str, mode: str) -> Iterator[IO[str]]:
+    """'-' = stdin/stdout، و .gz مضغوط gzip (كتابة وقراءة بالتدفق)."""
+    if path == "-":
+        stream = sys.stdout if mode == "w" else sys.stdin
+        yield stream
+        if mode == "w":
+            stream.flush()
+        return
+    if path.endswith(".gz"):
+        handle = gzip.open(path, mode + "t", encoding="utf-8")
+    else:
+        handle = io.open(path, mode, encoding="utf-8", newline="\n")
+    with handle:
+        yield handle
+
+def _table_columns(conn, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})") if row[1] not in DERIVED_COLUMNS]
+
+def _export_selects(
+    storage: Storage,
+    table: str,
+    users: Optional[Sequence[str]],
+    since: Optional[str],
+    until: Optional[str]
+) -> Iterator[Tuple[Any, str, List[Any]]]:
+    """(pool, where, params) لكل ملف لازم نقرأه: مع users بس الملفات المسؤولة عنهم."""
+    clauses: List[str] = []
+    params: List[Any] = []
+    time_column = TIME_COLUMNS[table]
+    if since:
+        clauses.append(f"{time_column} >= ?")
+        params.append(since)
+    if until:
+        clauses.append(f"{time_column} < ?")
+        params.append(until)
+    if users is None:
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        for pool in storage.pools():
+            yield pool, where, params
+        return
+    for pool, items in storage.group_by_pool(users, lambda user_id: user_id):
+        pool_users = [user_id for _pos, user_id in items]
+        user_clause = f"user_id IN ({', '.join('?' * len(pool_users))})"
+        yield pool, " WHERE " + " AND ".join([user_clause] + clauses), pool_users + params
+
+def export_rows(
+    storages: Dict[str, Storage],
+    tables: Sequence[str] = EXPORT_TABLES,
+    users: Optional[Sequence[str]] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    batch_size: Optional[int] = None
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    (table, row) لكل صف، بترتيب rowid داخل كل ملف (نفس ترتيب الكتابة).
+    storages: {"memory": Storage, "analytics": Storage}.
+    """
+    batch_size = max(1, batch_size or EXPORT_BATCH_SIZE)
+    since, until = normalize_timestamp(since), normalize_timestamp(until)
+    for table in tables:
+        storage = storages["analytics" if table in ANALYTICS_TABLES else "memory"]
+        for pool, where, params in _export_selects(storage, table, users, since, until):
+            with pool.connection() as conn:
+                columns = _table_columns(conn, table)
+                if not columns:
+                    continue
+                cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table}{where} ORDER BY rowid", params)
+                try:
+                    while True:
+                        rows = cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        for row in rows:
+                            yield table, dict(zip(columns, row))
+                finally:
+                    cursor.close()
+
+def export_ndjson(
+    storages: Dict[str, Storage],
+    out: IO[str],
+    tables: Sequence[str] = EXPORT_TABLES,
+    users: Optional[Sequence[str]] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    batch_size: Optional[int] = None
+) -> Dict[str, Any]:
+    counts = {table: 0 for table in tables}
+    for table, row in export_rows(storages, tables, users, since, until, batch_size):
+        out.write(json.dumps({"table": table, "row": row}, ensure_ascii=False))
+        out.write("\n")
+        counts[table] += 1
+    return {"tables": counts, "rows": sum(counts.values())}
+
+def _flush_import(
+    storage: Storage,
+    table: str,
+    columns: Tuple[str, ...],
+    rows: List[tuple],
+    id_columns: Dict[str, Optional[str]],
+    counts: Dict[str, int]
+):
+    id_column = id_columns[table]
+    user_pos = columns.index("user_id")
+    for pool, items in storage.group_by_pool(rows, lambda row: row[user_pos]):
+        with pool.transaction() as conn:
+            copy_rows(conn, table, columns, id_column if id_column in columns else None, [row for _pos, row in items], counts)
+
+def import_ndjson(
+    storages: Dict[str, Storage],
+    lines: Iterable[str],
+    tables: Sequence[str] = EXPORT_TABLES,
+    users: Optional[Sequence[str]] = None,
+    batch_size: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    استيراد ملف export_ndjson بدفعات (الذاكرة = دفعة واحدة لكل جدول وشكل أعمدة).
+    الأعمدة اللي ما لها مكان في مخطط الملف الهدف تنحذف (ملف تصدير من نسخة أحدث).
+    """
+    batch_size = max(1, batch_size or IMPORT_BATCH_SIZE)
+    wanted_users = set(users) if users is not None else None
+    
+    # المخطط محدث في كل الملفات الهدف قبل أول صف
+    target_columns: Dict[str, List[str]] = {}
+    id_columns: Dict[str, Optional[str]] = {}
+    for kind, migrations, kind_tables in (
+        ("memory", MEMORY_MIGRATIONS, MEMORY_TABLES), ("analytics", ANALYTICS_MIGRATIONS, ANALYTICS_TABLES)
+    ):
+        for pool in storages[kind].pools():
+            ensure_schema(pool, migrations)
+        with storages[kind].pools()[0].connection() as conn:
+            for table in kind_tables:
+                target_columns[table] = _table_columns(conn, table)
+                id_columns[table] = rowid_column(conn, table)
+    
+    report: Dict[str, Any] = {"tables": {}, "filtered": 0, "invalid": 0}
+    pending: Dict[Tuple[str, Tuple[str, ...]], List[tuple]] = {}
+    buffered = 0
+    
+    def flush():
+        nonlocal buffered
+        for (table, columns), rows in pending.items():
+            storage = storages["analytics" if table in ANALYTICS_TABLES else "memory"]
+            _flush_import(storage, table, columns, rows, id_columns, report["tables"][table])
+        pending.clear()
+        buffered = 0
+    
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            table, row = record["table"], record["row"]
+        except (ValueError, KeyError, TypeError):
+            report["invalid"] += 1
+            continue
+        if table not in tables or table not in target_columns or not isinstance(row, dict) or "user_id" not in row:
+            report["filtered" if table not in tables else "invalid"] += 1
+            continue
+        if wanted_users is not None and row["user_id"] not in wanted_users:
+            report["filtered"] += 1
+            continue
+        report["tables"].setdefault(table, {"copied": 0, "renumbered": 0, "skipped": 0})
+        columns = tuple(column for column in target_columns[table] if column in row)
+        pending.setdefault((table, columns), []).append(tuple(row[column] for column in columns))
+        buffered += 1
+        if buffered >= batch_size:
+            flush()
+    flush()
+    return report
+
+# ==========================
+# replay: سجل طلبات -> HawsaCore بمعدل محدد
+# ==========================
+
+def read_request_log(
+    lines: Iterable[str],
+    default_user: str = "replay_user",
+    user_field: Optional[str] = None,
+    message_field: Optional[str] = None
+) -> Iterator[Optional[Tuple[str, str]]]:
+    """(user_id, message) لكل سطر، أو None لسطر بدون رسالة (ينحسب skipped)."""
+    user_fields = (user_field,) if user_field else REPLAY_USER_FIELDS
+    message_fields = (message_field,) if message_field else REPLAY_MESSAGE_FIELDS
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        if not isinstance(record, dict):
+            yield None
+            continue
+        message = next((record[f] for f in message_fields if isinstance(record.get(f), str) and record[f].strip()), None)
+        if message is None:
+            yield None
+            continue
+        user_id = next((str(record[f]) for f in user_fields if record.get(f) not in (None, "")), default_user)
+        yield user_id, message
+
+def replay_requests(
+    core,
+    requests: Iterable[Optional[Tuple[str, str]]],
+    rate: float = 0.0,
+    batch: int = 1,
+    limit: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    تمرير الطلبات بالترتيب. rate = طلب/ثانية (0 = بأقصى سرعة)؛ الجدول ثابت (start + i/rate)
+    فالتأخير في طلب ما يتراكم على اللي بعده. batch > 1 يستخدم process_batch (أسرع لإعادة البناء).
+    failed_indices: مكان كل طلب فشل في requests (من 0، = ترتيب الأسطر غير الفاضية في السجل،
+    أول REPLAY_MAX_FAILED_INDICES).
+    """
+    batch = max(1, batch)
+    report: Dict[str, Any] = {"replayed": 0, "failed": 0, "skipped": 0, "failed_indices": []}
+    started = time.perf_counter()
+    chunk: List[Tuple[int, Tuple[str, str]]] = []
+    
+    def fail(indices: List[int], error: Any):
+        print(f"[Replay Error] requests {indices}: {error}", file=sys.stderr)
+        report["failed"] += len(indices)
+        room = REPLAY_MAX_FAILED_INDICES - len(report["failed_indices"])
+        report["failed_indices"].extend(indices[:max(0, room)])
+    
+    def run(items: List[Tuple[int, Tuple[str, str]]]):
+        try:
+            if len(items) == 1:
+                core.process_comprehensive_query(*items[0][1])
+                report["replayed"] += 1
+                return
+            # process_batch ما يرفع لو فشل الحفظ: الرسائل اللي ما انحفظت ترجع success=False
+            results = core.process_batch([item for _index, item in items])
+        except Exception as e:
+            fail([index for index, _item in items], e)
+            return
+        failed = [(index, result) for (index, _item), result in zip(items, results) if not result.get("success")]
+        report["replayed"] += len(items) - len(failed)
+        if failed:
+            fail([index for index, _result in failed], failed[0][1].get("error"))
+    
+    sent = 0
+    for index, item in enumerate(requests):
+        if limit is not None and sent >= limit:
+            break
+        if item is None:
+            report["skipped"] += 1
+            continue
+        if rate > 0:
+            delay = started + sent / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        sent += 1
+        chunk.append((index, item))
+        # مع rate الدفعة تنرسل لما يجي وقت آخر طلب فيها
+        if len(chunk) >= batch:
+            run(chunk)
+            chunk = []
+    if chunk:
+        run(chunk)
+    core.flush()
+    seconds = time.perf_counter() - started
+    report["seconds"] = round(seconds, 3)
+    report["rate"] = round(report["replayed"] / seconds, 1) if seconds > 0 else None
+    return report
+
+def open_storages(
+    memory_db: str,
+    analytics_db: str,
+    shards: Optional[int] = None,
+    must_exist: bool = False
+) -> Dict[str, Storage]:
+    """must_exist: للتصدير (فتح ملف ناقص ينشئه فاضي وتطلع النسخة فاضية بدون ما ننتبه)."""
+    if must_exist:
+        count = DEFAULT_SHARDS if shards is None else shards
+        missing = [
+            path for db_path in (memory_db, analytics_db) for path in shard_paths(db_path, count)
+            if not os.path.exists(path)
+        ]
+        if missing:
+            raise FileNotFoundError(f"Missing database files: {missing}")
+    return {"memory": open_storage(memory_db, shards), "analytics": open_storage(analytics_db, shards)}
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="تصدير / استيراد ذاكرة Hawsa AI (NDJSON) وإعادة تشغيل سجل طلبات")
+    sub = parser.add_subparsers(dest="command", required=True)
+    
+    def add_storage_args(p):
+        p.add_argument("--memory-db", default="hawsa_ai_memory.db")
+        p.add_argument("--analytics-db", default="hawsa_ai_advanced.db")
+        p.add_argument("--shards", type=int, default=None, help="تخطيط الملفات (الافتراضي HAWSA_DB_SHARDS)")
+        p.add_argument("--tables", default=",".join(EXPORT_TABLES))
+        p.add_argument("--user", action="append", dest="users", help="مستخدم واحد (يتكرر)")
+        p.add_argument("--batch", type=int, default=None)
+    
+    export = sub.add_parser("export", help="كل الصفوف -> NDJSON (- = stdout، .gz مضغوط)")
+    add_storage_args(export)
+    export.add_argument("--since", help="من هذا الوقت (UTC، شامل)")
+    export.add_argument("--until", help="لين هذا الوقت (UTC، غير شامل)")
+    export.add_argument("output")
+    
+    load = sub.add_parser("import", help="NDJSON -> القاعدة (التخطيط الحالي، بدون تكرار)")
+    add_storage_args(load)
+    load.add_argument("input")
+    
+    replay = sub.add_parser("replay", help="سجل طلبات JSONL -> HawsaCore")
+    replay.add_argument("input")
+    replay.add_argument("--rate", type=float, default=0.0, help="طلب/ثانية (0 = بأقصى سرعة)")
+    replay.add_argument("--batch", type=int, default=1, help="رسائل لكل process_batch")
+    replay.add_argument("--limit", type=int, default=None)
+    replay.add_argument("--shards", type=int, default=None)
+    replay.add_argument("--default-user", default="replay_user", help="للأسطر بدون user_id")
+    replay.add_argument("--user-field", default=None)
+    replay.add_argument("--message-field", default=None)
+    args = parser.parse_args()
+    
+    if args.command == "replay":
+        from hawsa_core import HawsaCore, prepare_storage
+        
+        prepare_storage(args.shards)
+        core = HawsaCore(shards=args.shards)
+        try:
+            with open_ndjson(args.input, "r") as handle:
+                result = replay_requests(
+                    core,
+                    read_request_log(handle, args.default_user, args.user_field, args.message_field),
+                    rate=args.rate,
+                    batch=args.batch,
+                    limit=args.limit
+                )
+        finally:
+            core.close()
+    else:
+        tables = [t.strip() for t in args.tables.split(",") if t.strip()]
+        unknown = [t for t in tables if t not in EXPORT_TABLES]
+        if unknown:
+            parser.error(f"unknown tables: {', '.join(unknown)} (choose from {', '.join(EXPORT_TABLES)})")
+        storages = open_storages(args.memory_db, args.analytics_db, args.shards, must_exist=args.command == "export")
+        try:
+            if args.command == "export":
+                with open_ndjson(args.output, "w") as handle:
+                    result = export_ndjson(storages, handle, tables, args.users, args.since, args.until, args.batch)
+            else:
+                with open_ndjson(args.input, "r") as handle:
+                    result = import_ndjson(storages, handle, tables, args.users, args.batch)
+        finally:
+            for storage in storages.values():
+                storage.close()
+    # مع export إلى stdout التقرير يروح stderr حتى ما يخرب الملف
+    print(json.dumps(result, ensure_ascii=False), file=sys.stderr if getattr(args, "output", None) == "-" else sys.stdout)
+    if args.command == "replay" and result["failed"]:
+        sys.exit(1)
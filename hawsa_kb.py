@@ -0,0 +1,409 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from hawsa_keywords import KeywordIndex, KeywordMatch, normalize_text
+
+# ==========================
+# قاعدة معرفة ECU / DTC (فهارس مبنية من ملف على القرص)
+# ==========================
+# الملف (JSON أو JSON.gz) فيه:
+# - families: عائلات حسب بادئة الرمز (P03 = إشعال، P030 = misfire ...) تنبني منها شجرة بادئات (trie)،
+#   فأي رمز له تفسير عام حتى لو ما هو موجود بالاسم
+# - ranges: مدى رموز متتالية بقالب واحد (P0301..P0312 = الأسطوانة {n}) يتفرد وقت التحميل
+# - codes: رموز محددة (تغطي اللي في ranges) مع الأسباب وملاحظات لكل سيارة
+# - vehicles: السيارات وأسماؤها في الرسائل (aliases)
+# - rules: توصيات تنطلق بكلمات مفتاحية أو ببادئة رمز، ومقيدة بسيارات معينة اختياريًا
+#
+# كل تحميل يبني KBSnapshot جديد غير قابل للتعديل ويستبدل القديم مرة وحدة، فالطلب اللي ماسك نسخة
+# يكمل عليها حتى لو صار reload في نفس اللحظة. تغيير الملف ينلقط تلقائيًا (mtime) في كل Worker.
+
+KB_PATH = os.environ.get("HAWSA_KB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "hawsa_kb.json"))
+# كل كم ثانية نفحص mtime الملف وقت الاستخدام (0 = بدون إعادة تحميل تلقائية)
+KB_RELOAD_SECONDS = float(os.environ.get("HAWSA_KB_RELOAD_SECONDS", "2"))
+# أقصى عدد رموز تنقرأ من رسالة واحدة
+KB_MAX_CODES = int(os.environ.get("HAWSA_KB_MAX_CODES", "8"))
+
+# رمز OBD-II: حرف النظام + رقم 0-3 + ثلاث خانات hex، بدون حروف/أرقام لاتينية ملاصقة
+_DTC_PATTERN = re.compile(r"(?<![0-9A-Za-z])([PBCUpbcu][0-3][0-9A-Fa-f]{3})(?![0-9A-Za-z])")
+_DTC_CODE = re.compile(r"^[PBCU][0-3][0-9A-F]{3}$")
+
+RULE_GROUP_PREFIX = "ecu.rule."
+VEHICLE_GROUP_PREFIX = "ecu.vehicle."
+UNKNOWN_VEHICLES = ("", "UNKNOWN")
+
+# لو الملف مفقود: نفس توصيات النسخة القديمة
+DEFAULT_KB: Dict[str, Any] = {
+    "version": "builtin",
+    "rules": [
+        {
+            "code": "BOOST_MAP_TUNE",
+            "description": "ضبط خرائط البوست مع مراعاة حدود الأمان للـ AFR والحرارة.",
+            "keywords": ["boost", "توربو"]
+        },
+        {
+            "code": "DTC_ANALYSIS",
+            "description": "تحليل رموز الأعطال وربطها بحالات فعلية من سجلات سابقة.",
+            "keywords": ["dtc", "رمز"]
+        },
+    ],
+}
+
+class KBError(ValueError):
+    """ملف قاعدة المعرفة غير صالح (القديمة تبقى شغالة)."""
+
+class DTCEntry:
+    """رمز محدد أو عائلة رموز (code = البادئة)."""
+    __slots__ = ("code", "system", "title", "advice", "severity", "causes", "vehicle_notes")
+    
+    def __init__(
+        self,
+        code: str,
+        system: str = "",
+        title: str = "",
+        advice: str = "",
+        severity: str = "",
+        causes: Tuple[str, ...] = (),
+        vehicle_notes: Optional[Dict[str, str]] = None
+    ):
+        self.code = code
+        self.system = system
+        self.title = title
+        self.advice = advice
+        self.severity = severity
+        self.causes = causes
+        self.vehicle_notes = vehicle_notes or {}
+
+class KBRule:
+    __slots__ = ("code", "description", "keywords", "dtc_prefixes", "vehicles")
+    
+    def __init__(self, code: str, description: str, keywords: frozenset, dtc_prefixes: Tuple[str, ...], vehicles: frozenset):
+        self.code = code
+        self.description = description
+        self.keywords = keywords
+        self.dtc_prefixes = dtc_prefixes
+        self.vehicles = vehicles
+    
+    @property
+    def group(self) -> str:
+        return RULE_GROUP_PREFIX + self.code
+
+class _TrieNode:
+    __slots__ = ("children", "family", "rules")
+    
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.family: Optional[DTCEntry] = None
+        self.rules: List[KBRule] = []
+
+class KBSnapshot:
+    """
+    نسخة محملة من قاعدة المعرفة + فهارسها:
+    - codes: الرمز الكامل -> DTCEntry (O(1))
+    - trie: بادئات العائلات والقواعد؛ حل رمز = مرور واحد على حروفه (O(طول الرمز))
+    - vehicles / aliases: السيارة بالـ id أو بأي اسم لها
+    - keywords: فهرس Aho–Corasick لكلمات القواعد وأسماء السيارات (نفس hawsa_keywords)
+    """
+    def __init__(self, data: Dict[str, Any], path: Optional[str] = None, stat: Optional[Tuple[int, int]] = None, digest: str = ""):
+        self.path = path
+        self.stat = stat
+        self.digest = digest
+        self.version = str(data.get("version", "unversioned"))
+        self.loaded_at = time.time()
+        self.codes: Dict[str, DTCEntry] = {}
+        self.trie = _TrieNode()
+        self.vehicles: Dict[str, Dict[str, Any]] = {}
+        self.aliases: Dict[str, str] = {}
+        self.rules: List[KBRule] = []
+        self.families = 0
+        
+        for item in data.get("families", []):
+            prefix = self._check_prefix(item.get("prefix"), "family")
+            self._node(prefix).family = self._entry(prefix, item)
+            self.families += 1
+        
+        for item in data.get("ranges", []):
+            start, end = self._check_code(item.get("from")), self._check_code(item.get("to"))
+            # المدى بالأرقام العشرية (P0301..P0312)، نفس الحرفين الأولين
+            if start[:2] != end[:2] or not (start[2:] + end[2:]).isdigit() or end < start:
+                raise KBError(f"invalid range {start}..{end}")
+            first = int(item.get("first", 1))
+            for offset in range(int(end[2:]) - int(start[2:]) + 1):
+                code = f"{start[:2]}{int(start[2:]) + offset:03d}"
+                entry = dict(item, title=str(item.get("title", "")).replace("{n}", str(first + offset)))
+                self.codes[code] = self._entry(code, entry)
+        
+        for item in data.get("codes", []):
+            code = self._check_code(item.get("code"))
+            self.codes[code] = self._entry(code, item)
+        
+        for item in data.get("vehicles", []):
+            vehicle_id = str(item.get("id") or "").strip()
+            if not vehicle_id:
+                raise KBError("vehicle without id")
+            self.vehicles[vehicle_id] = {"id": vehicle_id, "name": item.get("name", vehicle_id)}
+            for alias in [vehicle_id, *item.get("aliases", [])]:
+                alias = normalize_text(alias)
+                if alias:
+                    self.aliases[alias] = vehicle_id
+        
+        for item in data.get("rules", []):
+            code = str(item.get("code") or "").strip()
+            keywords = frozenset(filter(None, (normalize_text(k) for k in item.get("keywords", []))))
+            prefixes = tuple(self._check_prefix(p, f"rule {code}") for p in item.get("dtc_prefixes", []))
+            vehicles = frozenset(item.get("vehicles", []))
+            if not code or not item.get("description"):
+                raise KBError(f"rule without code/description: {item!r}")
+            if not keywords and not prefixes:
+                raise KBError(f"rule {code} needs keywords or dtc_prefixes")
+            unknown = vehicles - set(self.vehicles)
+            if unknown:
+                raise KBError(f"rule {code} references unknown vehicles: {sorted(unknown)}")
+            rule = KBRule(code, item["description"], keywords, prefixes, vehicles)
+            self.rules.append(rule)
+            for prefix in prefixes:
+                self._node(prefix).rules.append(rule)
+        
+        self.keywords = KeywordIndex(self.keyword_groups())
+        self.keywords.build()
+    
+    @staticmethod
+    def _check_code(code: Any) -> str:
+        code = str(code or "").strip().upper()
+        if not _DTC_CODE.match(code):
+            raise KBError(f"invalid DTC code: {code!r}")
+        return code
+    
+    @staticmethod
+    def _check_prefix(prefix: Any, where: str) -> str:
+        prefix = str(prefix or "").strip().upper()
+        if not prefix or len(prefix) > 5 or prefix[0] not in "PBCU":
+            raise KBError(f"invalid DTC prefix in {where}: {prefix!r}")
+        return prefix
+    
+    @staticmethod
+    def _entry(code: str, item: Dict[str, Any]) -> DTCEntry:
+        return DTCEntry(
+            code,
+            system=item.get("system", ""),
+            title=item.get("title", ""),
+            advice=item.get("advice", ""),
+            severity=item.get("severity", ""),
+            causes=tuple(item.get("causes", [])),
+            vehicle_notes=item.get("vehicles")
+        )
+    
+    def _node(self, prefix: str) -> _TrieNode:
+        node = self.trie
+        for ch in prefix:
+            node = node.children.setdefault(ch, _TrieNode())
+        return node
+    
+    def keyword_groups(self) -> Dict[str, Iterable[str]]:
+        """مجموعات الكلمات اللي تنسجل في فهرس HawsaCore المشترك."""
+        groups: Dict[str, Iterable[str]] = {rule.group: rule.keywords for rule in self.rules if rule.keywords}
+        for alias, vehicle_id in self.aliases.items():
+            groups.setdefault(VEHICLE_GROUP_PREFIX + vehicle_id, set()).add(alias)
+        return groups
+    
+    def resolve(self, code: str) -> Tuple[Optional[DTCEntry], Optional[DTCEntry], List[KBRule]]:
+        """(الرمز المحدد، أقرب عائلة، قواعد بادئاته) بمرور واحد على حروف الرمز."""
+        code = code.upper()
+        node = self.trie
+        family = None
+        rules: List[KBRule] = []
+        for ch in code:
+            node = node.children.get(ch)
+            if node is None:
+                break
+            if node.family is not None:
+                family = node.family
+            rules.extend(node.rules)
+        return self.codes.get(code), family, rules
+    
+    def resolve_vehicle(self, vehicle_id: Optional[str], match: Optional[KeywordMatch] = None) -> Optional[str]:
+        """السيارة من vehicle_id (id أو اسم)، وإلا من الرسالة إذا ذكرت سيارة وحدة بس."""
+        if vehicle_id and vehicle_id not in UNKNOWN_VEHICLES:
+            if vehicle_id in self.vehicles:
+                return vehicle_id
+            return self.aliases.get(normalize_text(vehicle_id))
+        if match is None:
+            return None
+        found = {
+            group[len(VEHICLE_GROUP_PREFIX):] for group in match.groups
+            if group.startswith(VEHICLE_GROUP_PREFIX) and group[len(VEHICLE_GROUP_PREFIX):] in self.vehicles
+        }
+        return found.pop() if len(found) == 1 else None
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "digest": self.digest,
+            "path": self.path,
+            "loaded_at": self.loaded_at,
+            "codes": len(self.codes),
+            "families": self.families,
+            "vehicles": len(self.vehicles),
+            "rules": len(self.rules),
+        }
+
+def extract_codes(text: str, limit: int = KB_MAX_CODES) -> List[str]:
+    """رموز DTC في الرسالة بترتيب ظهورها (بدون تكرار)، بمرور regex واحد."""
+    codes: List[str] = []
+    for found in _DTC_PATTERN.finditer(text or ""):
+        code = found.group(1).upper()
+        if code not in codes:
+            codes.append(code)
+            if len(codes) >= limit:
+                break
+    return codes
+
+def _file_stat(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def load_snapshot(path: str) -> KBSnapshot:
+    stat = _file_stat(path)
+    with open(path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.blake2b(raw, digest_size=8).hexdigest()
+    if path.endswith(".gz"):
+        raw = gzip.decompress(raw)
+    try:
+        data = json.loads(raw.decode("utf-8"))
+    except ValueError as e:
+        raise KBError(f"{path}: {e}") from e
+    if not isinstance(data, dict):
+        raise KBError(f"{path}: top level must be an object")
+    return KBSnapshot(data, path, stat, digest)
+
+class KnowledgeBase:
+    """
+    قاعدة المعرفة الحالية + إعادة التحميل بدون إعادة تشغيل:
+    - تلقائيًا: عند الاستخدام، كل KB_RELOAD_SECONDS نقارن mtime/size الملف
+    - يدويًا: reload() (api_server: POST /kb/reload)
+    ملف تالف = نحتفظ بالنسخة الحالية ونطبع الخطأ.
+    """
+    def __init__(self, path: Optional[str] = None, reload_seconds: Optional[float] = None):
+        self.path = path or KB_PATH
+        self.reload_seconds = KB_RELOAD_SECONDS if reload_seconds is None else reload_seconds
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._checked_at = time.monotonic()
+        self._seen_stat: Optional[Tuple[int, int]] = None
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_error: Optional[str] = None
+        try:
+            self._snapshot = load_snapshot(self.path)
+        except (OSError, KBError) as e:
+            print(f"[KB Error] {e}; using built-in rules")
+            self.last_error = str(e)
+            self._snapshot = KBSnapshot(DEFAULT_KB, digest="builtin")
+        self._seen_stat = self._snapshot.stat
+    
+    @property
+    def snapshot(self) -> KBSnapshot:
+        self.maybe_reload()
+        return self._snapshot
+    
+    def reload_due(self) -> bool:
+        """هل حان فحص الملف؟ (مقارنة وقت فقط، بدون I/O؛ المسار async يفحص على خيط لو True)."""
+        return self.reload_seconds > 0 and time.monotonic() - self._checked_at >= self.reload_seconds
+    
+    def maybe_reload(self):
+        """فحص mtime الملف لو مر KB_RELOAD_SECONDS من آخر فحص (رخيص: مقارنة وقت فقط غالبًا)."""
+        if self.reload_due():
+            self._check_file()
+    
+    @property
+    def version(self) -> str:
+        # يتغير مع أي تعديل في محتوى الملف (للكاش اللي يعتمد على التوصيات)
+        snapshot = self.snapshot
+        return f"{snapshot.version}:{snapshot.digest}"
+    
+    def on_reload(self, callback):
+        """callback(snapshot) بعد كل تحميل ناجح (مثلاً لتسجيل الكلمات الجديدة في الفهرس المشترك)."""
+        self._listeners.append(callback)
+    
+    def _check_file(self):
+        if not self._lock.acquire(blocking=False):
+            return  # خيط ثاني يفحص الحين
+        try:
+            self._checked_at = time.monotonic()
+            try:
+                stat = _file_stat(self.path)
+            except OSError:
+                return
+            if stat != self._seen_stat:
+                self._load()
+        finally:
+            self._lock.release()
+    
+    def _load(self) -> bool:
+        try:
+            snapshot = load_snapshot(self.path)
+        except (OSError, KBError) as e:
+            print(f"[KB Error] {e}")
+            self.reload_errors += 1
+            self.last_error = str(e)
+            # نفس الملف التالف ما ينعاد تحميله لين يتغير
+            try:
+                self._seen_stat = _file_stat(self.path)
+            except OSError:
+                pass
+            return False
+        for callback in self._listeners:
+            callback(snapshot)
+        self._snapshot = snapshot
+        self._seen_stat = snapshot.stat
+        self.reloads += 1
+        self.last_error = None
+        return True
+    
+    def reload(self) -> Dict[str, Any]:
+        """تحميل الملف الآن (حتى لو ما تغير mtime)."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            ok = self._load()
+        return {"reloaded": ok, "error": None if ok else self.last_error, **self._snapshot.stats()}
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.snapshot.stats(),
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "last_error": self.last_error,
+        }
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="فحص قاعدة معرفة ECU / DTC")
+    parser.add_argument("--path", default=KB_PATH)
+    parser.add_argument("--lookup", nargs="*", default=[], help="رموز DTC للبحث")
+    parser.add_argument("--scan", help="استخراج الرموز والقواعد من رسالة")
+    args = parser.parse_args()
+    
+    snapshot = load_snapshot(args.path)
+    result: Dict[str, Any] = {"kb": snapshot.stats()}
+    for code in args.lookup:
+        entry, family, rules = snapshot.resolve(code)
+        result[code.upper()] = {
+            "entry": entry and {s: getattr(entry, s) for s in DTCEntry.__slots__},
+            "family": family and family.code,
+            "rules": [rule.code for rule in rules],
+        }
+    if args.scan:
+        match = snapshot.keywords.scan(args.scan)
+        result["scan"] = {
+            "codes": extract_codes(args.scan),
+            "vehicle": snapshot.resolve_vehicle(None, match),
+            "groups": sorted(match.groups),
+        }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,155 @@
+import re
+import threading
+import unicodedata
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Set, Tuple
+
+# ==========================
+# مطابقة الكلمات المفتاحية بمرور واحد (Aho–Corasick)
+# ==========================
+# بدل ما كل مكوّن يسوي any(k in msg.lower() ...) لحاله، نبني آلة واحدة وقت تشغيل HawsaCore
+# من كلمات كل المكوّنات، ونمسح الرسالة مرة وحدة لكل طلب. زمن المسح يعتمد على طول الرسالة
+# وليس على عدد الكلمات المسجلة.
+
+# التشكيل (فتحة، ضمة، شدة، ...) + الألف الخنجرية + التطويل
+_ARABIC_MARKS = re.compile("[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+_ALEF_FORMS = str.maketrans({"\u0623": "\u0627", "\u0625": "\u0627", "\u0622": "\u0627", "\u0671": "\u0627"})
+
+def normalize_text(text: str) -> str:
+    """
+    توحيد النص قبل المطابقة (للكلمات وللرسائل بنفس الدالة):
+    NFKC (أشكال العرض العربية) + casefold (اللاتيني) + حذف التشكيل والتطويل + توحيد الألف.
+    """
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = _ARABIC_MARKS.sub("", text)
+    return text.translate(_ALEF_FORMS)
+
+class KeywordMatch:
+    """نتيجة مسح رسالة واحدة، تُشارك بين كل المستهلكين في نفس الطلب."""
+    __slots__ = ("keywords", "groups")
+    
+    def __init__(self, keywords: FrozenSet[str], groups: Dict[str, FrozenSet[str]]):
+        self.keywords = keywords
+        self.groups = groups
+    
+    def has(self, group: str) -> bool:
+        return group in self.groups
+    
+    def matched(self, group: str) -> FrozenSet[str]:
+        return self.groups.get(group, frozenset())
+    
+    def __repr__(self):
+        return f"KeywordMatch(groups={sorted(self.groups)})"
+
+class _Automaton:
+    """آلة Aho–Corasick غير قابلة للتعديل (تُستبدل كاملة عند إعادة البناء)."""
+    __slots__ = ("goto", "fail", "out", "keyword_groups")
+    
+    def __init__(self, keyword_groups: Mapping[str, FrozenSet[str]]):
+        self.keyword_groups = dict(keyword_groups)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        out: List[Set[str]] = [set()]
+        
+        for keyword in self.keyword_groups:
+            state = 0
+            for ch in keyword:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    out.append(set())
+                state = nxt
+            out[state].add(keyword)
+        
+        # روابط الفشل بترتيب BFS + دمج المخرجات عبرها
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                out[nxt] |= out[self.fail[nxt]]
+        
+        self.out: List[Optional[Tuple[str, ...]]] = [tuple(o) if o else None for o in out]
+    
+    def scan(self, text: str) -> Set[str]:
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        hits: Set[str] = set()
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                hits.update(out[state])
+        return hits
+
+class KeywordIndex:
+    """
+    سجل مجموعات الكلمات (group -> keywords) + آلة مطابقة مبنية منها.
+    التسجيل بعد البناء يعيد البناء مرة واحدة عند أول مسح.
+    """
+    def __init__(self, groups: Optional[Mapping[str, Iterable[str]]] = None):
+        self._groups: Dict[str, Set[str]] = {}
+        self._automaton: Optional[_Automaton] = None
+        self._lock = threading.Lock()
+        if groups:
+            self.register_groups(groups)
+    
+    def register(self, group: str, keywords: Iterable[str]):
+        normalized = {normalize_text(k) for k in keywords}
+        normalized.discard("")
+        with self._lock:
+            self._groups.setdefault(group, set()).update(normalized)
+            self._automaton = None
+    
+    def register_groups(self, groups: Mapping[str, Iterable[str]]):
+        for group, keywords in groups.items():
+            self.register(group, keywords)
+    
+    def build(self) -> _Automaton:
+        with self._lock:
+            if self._automaton is None:
+                keyword_groups: Dict[str, Set[str]] = {}
+                for group, keywords in self._groups.items():
+                    for keyword in keywords:
+                        keyword_groups.setdefault(keyword, set()).add(group)
+                self._automaton = _Automaton({k: frozenset(g) for k, g in keyword_groups.items()})
+            return self._automaton
+    
+    def scan(self, text: str) -> KeywordMatch:
+        automaton = self._automaton or self.build()
+        hits = automaton.scan(normalize_text(text))
+        groups: Dict[str, Set[str]] = {}
+        for keyword in hits:
+            for group in automaton.keyword_groups[keyword]:
+                groups.setdefault(group, set()).add(keyword)
+        return KeywordMatch(frozenset(hits), {g: frozenset(k) for g, k in groups.items()})
+    
+    @property
+    def groups(self) -> Dict[str, FrozenSet[str]]:
+        with self._lock:
+            return {g: frozenset(k) for g, k in self._groups.items()}
+
+# فهارس احتياطية لكل مكوّن يُستدعى بدون match جاهز (مثلاً خارج HawsaCore)
+_fallback_indexes: Dict[int, KeywordIndex] = {}
+_fallback_lock = threading.Lock()
+
+def index_for(groups: Mapping[str, Iterable[str]]) -> KeywordIndex:
+    key = id(groups)
+    index = _fallback_indexes.get(key)
+    if index is None:
+        with _fallback_lock:
+            index = _fallback_indexes.get(key)
+            if index is None:
+                index = KeywordIndex(groups)
+                _fallback_indexes[key] = index
+    return index
@@ -0,0 +1,273 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: BEGIN IMMEDIATE وحده يحمي الترقية
+    fcntl = None
+
+from hawsa_notes import collapse_duplicate_notes
+from hawsa_search import FTS_BODY_MIGRATION_STEPS, FTS_MIGRATION_STEPS
+
+# ==========================
+# نظام ترحيل المخطط (Schema Migrations)
+# ==========================
+# كل قاعدة لها قائمة ترحيلات مرقمة، ورقم النسخة الحالي محفوظ في PRAGMA user_version.
+# الترحيل 1 يستخدم IF NOT EXISTS حتى يترقى ملف الإنتاج القديم (user_version = 0) في مكانه.
+
+MigrationStep = Union[str, Callable[[sqlite3.Connection], None]]
+Migration = Tuple[int, str, Sequence[MigrationStep]]
+
+MEMORY_MIGRATIONS: List[Migration] = [
+    (1, "conversation_memory + long_term_notes", [
+        """
+        CREATE TABLE IF NOT EXISTS conversation_memory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            role TEXT,                -- 'user' أو 'assistant'
+            content TEXT,
+            summary TEXT,
+            tags TEXT,                -- JSON list
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS long_term_notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            note_type TEXT,           -- 'preference', 'project', 'skill'
+            note_text TEXT,
+            importance REAL DEFAULT 1.0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "user_id indexes for recent context and notes", [
+        # get_recent_context: WHERE user_id = ? ORDER BY id DESC LIMIT ?
+        """
+        CREATE INDEX IF NOT EXISTS idx_conversation_user_id
+        ON conversation_memory (user_id, id)
+        """,
+        # get_long_term_notes: فهارس مغطية (covering) بدون فرز مؤقت
+        """
+        CREATE INDEX IF NOT EXISTS idx_notes_user_importance
+        ON long_term_notes (user_id, importance DESC, id DESC, note_text)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_notes_user_type_importance
+        ON long_term_notes (user_id, note_type, importance DESC, id DESC, note_text)
+        """,
+    ]),
+    (3, "aggregated long_term_notes (dedupe + hit_count + decaying score)", [
+        lambda conn: _add_columns(conn, "long_term_notes", [
+            ("note_key", "TEXT"),
+            ("hit_count", "INTEGER DEFAULT 1"),
+            ("score", "REAL"),
+            ("last_seen_at", "DATETIME"),
+        ]),
+        # دمج آلاف الصفوف المكررة في الملفات القديمة قبل إنشاء الفهرس الفريد
+        collapse_duplicate_notes,
+        "DROP INDEX IF EXISTS idx_notes_user_importance",
+        "DROP INDEX IF EXISTS idx_notes_user_type_importance",
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_notes_user_type_key
+        ON long_term_notes (user_id, note_type, note_key)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_notes_user_score
+        ON long_term_notes (user_id, score DESC, note_text)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_notes_user_type_score
+        ON long_term_notes (user_id, note_type, score DESC, note_text)
+        """,
+    ]),
+    # فهارس FTS5 contentless (hawsa_search.py)
+    (4, "full-text search over conversation_memory + long_term_notes", FTS_MIGRATION_STEPS),
+    # النص المفهرس في عمود fts_body + triggers بـ SQL فقط (تشتغل على أي اتصال sqlite3)
+    (5, "fts_body column + SQL-only FTS triggers", FTS_BODY_MIGRATION_STEPS),
+    # أرشفة حسب العمر (hawsa_retention.py): المسح بترتيب created_at مو id
+    (6, "created_at index for retention", [
+        """
+        CREATE INDEX IF NOT EXISTS idx_conversation_created_at
+        ON conversation_memory (created_at, id)
+        """,
+    ]),
+    # نقل / استيراد الصفوف (hawsa_storage.copy_rows): id المصدر -> id الجديد لو انعاد ترقيمه
+    (7, "id map for re-runnable copies", [
+        """
+        CREATE TABLE IF NOT EXISTS hawsa_id_map (
+            table_name TEXT,
+            user_id TEXT,
+            source_id INTEGER,
+            target_id INTEGER,
+            PRIMARY KEY (table_name, user_id, source_id)
+        ) WITHOUT ROWID
+        """,
+    ]),
+]
+
+ANALYTICS_MIGRATIONS: List[Migration] = [
+    (1, "user_profiles", [
+        """
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id TEXT PRIMARY KEY,
+            personality TEXT,
+            expertise TEXT,
+            interests TEXT,
+            confidence REAL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+]
+
+def _add_columns(conn: sqlite3.Connection, table: str, columns: Sequence[Tuple[str, str]]):
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def apply_migrations(conn: sqlite3.Connection, migrations: Sequence[Migration]) -> List[int]:
+    """
+    تطبيق الترحيلات الناقصة بالترتيب، كل ترحيل في معاملة مستقلة.
+    ترجع أرقام الترحيلات التي تم تطبيقها.
+    """
+    applied = []
+    for version, _description, steps in sorted(migrations, key=lambda m: m[0]):
+        if get_schema_version(conn) >= version:
+            continue
+        
+        # BEGIN IMMEDIATE يمنع عمليتين من ترقية نفس الملف بنفس الوقت
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # إعادة الفحص بعد أخذ القفل (ممكن عملية ثانية سبقتنا)
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+def latest_version(migrations: Sequence[Migration]) -> int:
+    return max((m[0] for m in migrations), default=0)
+
+@contextmanager
+def schema_lock(db_path: str) -> Iterator[None]:
+    """
+    قفل ملف (<db>.lock) بين العمليات طول مدة الترقية. BEGIN IMMEDIATE لحاله ينتظر busy_timeout بس،
+    وترحيل طويل (مثل تعبئة FTS لملف كبير) يخلي باقي العمليات تفشل بـ "database is locked" وقت الإقلاع.
+    """
+    if fcntl is None or db_path == ":memory:":
+        yield
+        return
+    with open(os.path.abspath(db_path) + ".lock", "a+") as handle:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+def ensure_schema(pool, migrations: Sequence[Migration]) -> List[int]:
+    """
+    ترقية ملف المجمّع (SQLitePool) لو ناقص: قراءة user_version بدون أي قفل لو المخطط محدث
+    (الحالة العادية لكل Worker بعد أول إقلاع)، وإلا الترقية تحت schema_lock.
+    """
+    with pool.connection() as conn:
+        if get_schema_version(conn) >= latest_version(migrations):
+            return []
+    with schema_lock(pool.db_path):
+        with pool.connection() as conn:
+            return apply_migrations(conn, migrations)
+
+# ==========================
+# فحص خطط الاستعلامات الساخنة (Query Plans)
+# ==========================
+
+def explain_query(conn: sqlite3.Connection, sql: str, params: Sequence[Any]) -> List[str]:
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return [row[-1] for row in rows]
+
+def plan_uses_index(plan: List[str]) -> bool:
+    """الخطة مقبولة فقط إذا كل وصول للجداول عبر فهرس وبدون فرز مؤقت."""
+    for detail in plan:
+        if "TEMP B-TREE" in detail:
+            return False
+        if detail.startswith("SCAN") and "INDEX" not in detail:
+            return False
+    return True
+
+def check_query_plans(
+    conn: sqlite3.Connection,
+    queries: Dict[str, Tuple[str, Sequence[Any]]]
+) -> List[Dict[str, Any]]:
+    report = []
+    for name, (sql, params) in queries.items():
+        plan = explain_query(conn, sql, params)
+        report.append({"query": name, "plan": plan, "uses_index": plan_uses_index(plan)})
+    return report
+
+# ==========================
+# واجهة سطر الأوامر: ترقية ملفات الإنتاج + فحص الخطط
+# ==========================
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    
+    from hawsa_core import AdvancedUserAnalytics, HawsaAdvancedMemory
+    from hawsa_search import fill_fts_bodies
+    from hawsa_storage import DEFAULT_SHARDS, shard_paths
+    
+    parser = argparse.ArgumentParser(description="ترقية مخطط قواعد Hawsa AI وفحص خطط الاستعلامات")
+    parser.add_argument("--memory-db", default="hawsa_ai_memory.db")
+    parser.add_argument("--analytics-db", default="hawsa_ai_advanced.db")
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS, help="عدد ملفات كل قاعدة (hawsa_storage.py)")
+    parser.add_argument("--check", action="store_true", help="فشل (exit 1) لو فيه استعلام ساخن بدون فهرس")
+    args = parser.parse_args()
+    
+    targets = [
+        (db_path, migrations, queries)
+        for base, migrations, queries in (
+            (args.memory_db, MEMORY_MIGRATIONS, HawsaAdvancedMemory.HOT_QUERIES),
+            (args.analytics_db, ANALYTICS_MIGRATIONS, AdvancedUserAnalytics.HOT_QUERIES),
+        )
+        for db_path in shard_paths(base, args.shards)
+    ]
+    
+    failed = False
+    for db_path, migrations, queries in targets:
+        conn = sqlite3.connect(db_path)
+        try:
+            before = get_schema_version(conn)
+            applied = apply_migrations(conn, migrations)
+            print(f"{db_path}: schema v{before} -> v{get_schema_version(conn)} (applied: {applied or 'none'})")
+            if migrations is MEMORY_MIGRATIONS:
+                # صفوف كتبتها أداة خارجية بدون fts_body
+                with conn:
+                    filled = fill_fts_bodies(conn)
+                if filled:
+                    print(f"  indexed {filled} rows without fts_body")
+            for item in check_query_plans(conn, queries):
+                status = "OK " if item["uses_index"] else "BAD"
+                print(f"  [{status}] {item['query']}: {' | '.join(item['plan'])}")
+                failed = failed or not item["uses_index"]
+        finally:
+            conn.close()
+    
+    if args.check and failed:
+        sys.exit(1)
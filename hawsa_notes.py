@@ -0,0 +1,228 @@
+import math
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+# ==========================
+# ملاحظات طويلة المدى: تجميع + تلاشي الأهمية + ضغط
+# ==========================
+# كل ملاحظة تُخزن مرة واحدة لكل (user_id, note_type, note_key) مع عدد مرات التكرار.
+# الأهمية تتلاشى بنصف عمر ثابت؛ نخزن مفتاح ترتيب score = log2(importance) + days / half_life
+# حتى يبقى الترتيب حسب الأهمية "الحالية" مجرد ORDER BY score DESC على فهرس، بدون إعادة حساب.
+
+NOTE_HALF_LIFE_DAYS = float(os.environ.get("HAWSA_NOTE_HALF_LIFE_DAYS", "30"))
+MAX_NOTES_PER_USER = int(os.environ.get("HAWSA_MAX_NOTES_PER_USER", "200"))
+
+_SPACES = re.compile(r"\s+")
+
+def normalize_note_text(text: str) -> str:
+    """مفتاح المقارنة: NFKC + casefold + توحيد المسافات."""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return _SPACES.sub(" ", text).strip()
+
+def now_days() -> float:
+    return time.time() / 86400.0
+
+def timestamp_days(value: Optional[str]) -> float:
+    """تحويل CURRENT_TIMESTAMP الخاص بـ SQLite (UTC) إلى أيام منذ epoch."""
+    if not value:
+        return now_days()
+    try:
+        # fromisoformat أسرع بكثير من strptime (تُستدعى لكل نتيجة بحث)
+        dt = datetime.fromisoformat(str(value)[:19])
+    except ValueError:
+        return now_days()
+    return (dt - datetime(1970, 1, 1)).total_seconds() / 86400.0
+
+def note_score(importance: float, at_days: float) -> float:
+    return math.log2(max(importance, 1e-6)) + at_days / NOTE_HALF_LIFE_DAYS
+
+def combine_scores(a: Optional[float], b: float) -> float:
+    """جمع أهميتين بعد التلاشي (log-sum-exp بأساس 2، بدون الحاجة لوقت مرجعي)."""
+    if a is None:
+        return b
+    high, low = (a, b) if a >= b else (b, a)
+    return high + math.log2(1.0 + 2.0 ** (low - high))
+
+def merge_note_score(old_score: Optional[float], importance: float, at_days: float) -> float:
+    """الأهمية الحالية للملاحظة القديمة (بعد التلاشي) + أهمية التكرار الجديد."""
+    return combine_scores(old_score, note_score(importance, at_days))
+
+def effective_importance(score: float, at_days: Optional[float] = None) -> float:
+    at_days = now_days() if at_days is None else at_days
+    return 2.0 ** (score - at_days / NOTE_HALF_LIFE_DAYS)
+
+# دوال SQL تُسجل على كل اتصالات المجمّع (hawsa_db.register_sql_function)
+SQL_FUNCTIONS = {
+    "hawsa_note_merge": (3, merge_note_score),
+}
+
+# ==========================
+# ضغط الملاحظات المكررة (يُستدعى من الترحيل 3 ومن أداة الضغط)
+# ==========================
+
+def collapse_duplicate_notes(conn: sqlite3.Connection) -> int:
+    """
+    دمج الصفوف المكررة لنفس (user_id, note_type, نص مُطبّع) في صف واحد:
+    hit_count = مجموع التكرارات، importance = الأعلى، score = مجموع الأهميات بعد التلاشي.
+    ترجع عدد الصفوف المحذوفة.
+    """
+    groups: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    rows = conn.execute("""
+        SELECT id, user_id, note_type, note_text, importance, created_at,
+               COALESCE(hit_count, 1), last_seen_at, score, note_key
+        FROM long_term_notes
+        ORDER BY id
+    """)
+    for note_id, user_id, note_type, note_text, importance, created_at, hits, last_seen, score, stored_key in rows:
+        key = (user_id, note_type, normalize_note_text(note_text))
+        seen_at = last_seen or created_at
+        importance = importance if importance is not None else 1.0
+        dirty = score is None or stored_key != key[2]
+        if score is None:
+            score = note_score(importance, timestamp_days(seen_at))
+        group = groups.get(key)
+        if group is None:
+            groups[key] = {
+                "id": note_id,
+                "note_text": note_text,
+                "importance": importance,
+                "hit_count": hits,
+                "score": score,
+                "last_seen_at": seen_at,
+                "dirty": dirty,
+            }
+            continue
+        group["dirty"] = True
+        group["id"] = note_id
+        group["note_text"] = note_text
+        group["importance"] = max(group["importance"], importance)
+        group["hit_count"] += hits
+        group["score"] = combine_scores(group["score"], score)
+        group["last_seen_at"] = seen_at
+    
+    before = conn.execute("SELECT COUNT(*) FROM long_term_notes").fetchone()[0]
+    
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS notes_keep (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.notes_keep")
+    conn.executemany("INSERT INTO temp.notes_keep (id) VALUES (?)", ((g["id"],) for g in groups.values()))
+    conn.execute("DELETE FROM long_term_notes WHERE id NOT IN (SELECT id FROM temp.notes_keep)")
+    conn.execute("DROP TABLE temp.notes_keep")
+    
+    conn.executemany("""
+        UPDATE long_term_notes
+        SET note_text = ?, note_key = ?, importance = ?, hit_count = ?, score = ?, last_seen_at = ?
+        WHERE id = ?
+    """, (
+        (g["note_text"], key[2], g["importance"], g["hit_count"], g["score"], g["last_seen_at"], g["id"])
+        for key, g in groups.items()
+        if g["dirty"]
+    ))
+    return before - len(groups)
+
+def enforce_note_cap(conn: sqlite3.Connection, user_id: Optional[str] = None, cap: Optional[int] = None) -> int:
+    """حذف الملاحظات الأضعف فوق الحد لكل مستخدم. ترجع عدد الصفوف المحذوفة."""
+    cap = MAX_NOTES_PER_USER if cap is None else cap
+    if user_id is not None:
+        users = [user_id]
+    else:
+        users = [row[0] for row in conn.execute("""
+            SELECT user_id FROM long_term_notes GROUP BY user_id HAVING COUNT(*) > ?
+        """, (cap,))]
+    removed = 0
+    for uid in users:
+        removed += conn.execute(NOTE_CAP_SQL, (uid, cap)).rowcount
+    return removed
+
+NOTE_CAP_SQL = """
+    DELETE FROM long_term_notes WHERE id IN (
+        SELECT id FROM long_term_notes
+        WHERE user_id = ?
+        ORDER BY score DESC
+        LIMIT -1 OFFSET ?
+    )
+"""
+
+def _db_size_bytes(conn: sqlite3.Connection) -> int:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    return page_size * page_count
+
+def compact_notes(
+    db_path: str,
+    cap: Optional[int] = None,
+    min_importance: float = 0.0,
+    vacuum: bool = True
+) -> Dict[str, Any]:
+    """
+    مهمة الضغط (CLI / دورية): ترقية المخطط، دمج المكرر، تطبيق الحد لكل مستخدم،
+    حذف الملاحظات التي تلاشت تحت min_importance، ثم VACUUM وتقرير المساحة المستعادة.
+    """
+    from hawsa_migrations import MEMORY_MIGRATIONS, apply_migrations
+    
+    conn = sqlite3.connect(db_path)
+    try:
+        for name, (nargs, fn) in SQL_FUNCTIONS.items():
+            conn.create_function(name, nargs, fn, deterministic=True)
+        size_before = _db_size_bytes(conn)
+        has_notes = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'long_term_notes'").fetchone()
+        rows_before = conn.execute("SELECT COUNT(*) FROM long_term_notes").fetchone()[0] if has_notes else 0
+        
+        # الترحيل 3 يدمج المكرر تلقائيًا في الملفات القديمة
+        apply_migrations(conn, MEMORY_MIGRATIONS)
+        migrated = conn.execute("SELECT COUNT(*) FROM long_term_notes").fetchone()[0]
+        
+        with conn:
+            duplicates = (rows_before - migrated) + collapse_duplicate_notes(conn)
+            capped = enforce_note_cap(conn, cap=cap)
+            faded = 0
+            if min_importance > 0:
+                threshold = note_score(min_importance, now_days())
+                faded = conn.execute("DELETE FROM long_term_notes WHERE score < ?", (threshold,)).rowcount
+        
+        rows_after = conn.execute("SELECT COUNT(*) FROM long_term_notes").fetchone()[0]
+        if vacuum:
+            conn.execute("VACUUM")
+        size_after = _db_size_bytes(conn)
+    finally:
+        conn.close()
+    
+    return {
+        "db_path": db_path,
+        "rows_before": rows_before,
+        "rows_after": rows_after,
+        "duplicates_removed": duplicates,
+        "capped_removed": capped,
+        "faded_removed": faded,
+        "bytes_before": size_before,
+        "bytes_after": size_after,
+        "bytes_reclaimed": size_before - size_after,
+    }
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    
+    parser = argparse.ArgumentParser(description="ضغط ودمج long_term_notes في قاعدة ذاكرة Hawsa AI")
+    parser.add_argument("--db", default="hawsa_ai_memory.db")
+    parser.add_argument("--shards", type=int, default=None, help="عدد ملفات القاعدة (الافتراضي HAWSA_DB_SHARDS)")
+    parser.add_argument("--cap", type=int, default=None, help="أقصى عدد ملاحظات لكل مستخدم")
+    parser.add_argument("--min-importance", type=float, default=0.0, help="حذف الملاحظات التي تلاشت أهميتها تحت هذا الحد")
+    parser.add_argument("--no-vacuum", action="store_true")
+    parser.add_argument("--interval", type=float, default=0.0, help="تشغيل دوري كل N ثانية (0 = مرة واحدة)")
+    args = parser.parse_args()
+    
+    from hawsa_storage import DEFAULT_SHARDS, shard_paths
+    
+    paths = shard_paths(args.db, DEFAULT_SHARDS if args.shards is None else args.shards)
+    while True:
+        for path in paths:
+            report = compact_notes(path, cap=args.cap, min_importance=args.min_importance, vacuum=not args.no_vacuum)
+            print(json.dumps(report, ensure_ascii=False))
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,481 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from hawsa_cache import CONTEXT_CACHE_ROWS
+
+# ==========================
+# أرشفة المحادثات القديمة (hot DB -> أرشيف شهري مضغوط)
+# ==========================
+# conversation_memory يكبر بصفين لكل طلب، وصفوف المساعد فيها الرد كامل. الصف ينتقل للأرشيف لو:
+# - أقدم من RETENTION_MAX_AGE_DAYS، أو
+# - خارج أحدث RETENTION_MAX_ROWS صف لنفس المستخدم
+# وبكل الأحوال أحدث RETENTION_MIN_KEEP_ROWS صف لكل مستخدم تبقى (حلقة السياق + آخر N).
+#
+# الأرشيف: مجلد فيه ملف SQLite لكل شهر (conversation_YYYY_MM.db) والمحتوى مضغوط zlib لكل صف،
+# و index.db ((user_id, id) -> الشهر) حتى get_interaction / السجل القديم يلقون الصف بدون المرور على كل الملفات.
+# التشغيل على دفعات صغيرة: نكتب الأرشيف ونثبته أولاً، بعدين نحذف من القاعدة بمعاملة قصيرة
+# (triggers فهرس البحث تشيل الصفوف من FTS)، فالكتّاب ما ينحجزون. لو انقطع التشغيل بين الخطوتين،
+# التشغيل الجاي يكمل (INSERT OR IGNORE في الأرشيف).
+
+RETENTION_MAX_AGE_DAYS = float(os.environ.get("HAWSA_RETENTION_MAX_AGE_DAYS", "90"))
+RETENTION_MAX_ROWS = int(os.environ.get("HAWSA_RETENTION_MAX_ROWS", "2000"))
+RETENTION_MIN_KEEP_ROWS = int(os.environ.get("HAWSA_RETENTION_MIN_KEEP_ROWS", str(CONTEXT_CACHE_ROWS)))
+RETENTION_BATCH_SIZE = int(os.environ.get("HAWSA_RETENTION_BATCH", "500"))
+RETENTION_PAUSE_MS = int(os.environ.get("HAWSA_RETENTION_PAUSE_MS", "20"))
+ARCHIVE_DIR = os.environ.get("HAWSA_ARCHIVE_DIR", "hawsa_archive")
+ARCHIVE_ZLIB_LEVEL = int(os.environ.get("HAWSA_ARCHIVE_ZLIB_LEVEL", "6"))
+
+_MONTH_FILE = "conversation_{month}.db"
+
+_ARCHIVE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS archived_turns (
+        id INTEGER,                   -- نفس id في conversation_memory
+        user_id TEXT,
+        role TEXT,
+        content BLOB,                 -- zlib(UTF-8)
+        summary TEXT,
+        tags TEXT,
+        created_at DATETIME,
+        PRIMARY KEY (user_id, id)     -- id فريد داخل ملف القاعدة فقط (hawsa_storage.py)
+    ) WITHOUT ROWID
+    """,
+]
+
+_INDEX_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS archive_index (
+        user_id TEXT,
+        id INTEGER,
+        month TEXT,                   -- YYYY_MM
+        PRIMARY KEY (user_id, id)
+    ) WITHOUT ROWID
+    """,
+]
+
+# صفوف conversation_memory بنفس ترتيب أعمدة الأرشيف
+_HOT_COLUMNS = "id, user_id, role, content, summary, tags, created_at"
+
+def compress_text(text: Optional[str], level: Optional[int] = None) -> bytes:
+    return zlib.compress((text or "").encode("utf-8"), ARCHIVE_ZLIB_LEVEL if level is None else level)
+
+def decompress_text(blob: Optional[bytes]) -> str:
+    return zlib.decompress(blob).decode("utf-8") if blob else ""
+
+def month_of(created_at: Any) -> str:
+    # "2024-05-01 10:00:00" -> "2024_05" (صف بدون تاريخ يروح لملف "unknown")
+    text = str(created_at or "")
+    return text[:7].replace("-", "_") if len(text) >= 7 else "unknown"
+
+class ConversationArchive:
+    """
+    قراءة/كتابة الأرشيف الشهري. الملفات تنشأ أول كتابة فقط، فالقراءة من مجلد غير موجود ترجع فاضي.
+    آمن بين الخيوط (قفل واحد؛ القراءة من الأرشيف نادرة ومو في المسار الساخن).
+    """
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        self._conns: Dict[str, sqlite3.Connection] = {}
+        self._lock = threading.RLock()
+    
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+    
+    def _open(self, name: str, schema: Sequence[str], create: bool) -> Optional[sqlite3.Connection]:
+        conn = self._conns.get(name)
+        if conn is not None:
+            return conn
+        path = self._path(name)
+        if not create and not os.path.exists(path):
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            for statement in schema:
+                conn.execute(statement)
+        self._conns[name] = conn
+        return conn
+    
+    def _index(self, create: bool = False) -> Optional[sqlite3.Connection]:
+        return self._open("index.db", _INDEX_SCHEMA, create)
+    
+    def _month(self, month: str, create: bool = False) -> Optional[sqlite3.Connection]:
+        return self._open(_MONTH_FILE.format(month=month), _ARCHIVE_SCHEMA, create)
+    
+    def months(self) -> List[str]:
+        prefix, suffix = _MONTH_FILE.split("{month}")
+        names = sorted(glob.glob(self._path(_MONTH_FILE.format(month="*"))))
+        return [os.path.basename(n)[len(prefix):-len(suffix)] for n in names]
+    
+    def write(self, rows: Iterable[tuple]) -> Dict[str, Any]:
+        """
+        rows: (id, user_id, role, content, summary, tags, created_at) من conversation_memory.
+        ملفات الشهر تُثبت قبل index.db، فأي id في الفهرس محتواه موجود.
+        """
+        by_month: Dict[str, List[tuple]] = {}
+        raw_bytes = 0
+        stored_bytes = 0
+        for row_id, user_id, role, content, summary, tags, created_at in rows:
+            blob = compress_text(content)
+            raw_bytes += len((content or "").encode("utf-8"))
+            stored_bytes += len(blob)
+            by_month.setdefault(month_of(created_at), []).append(
+                (row_id, user_id, role, blob, summary, tags, created_at)
+            )
+        with self._lock:
+            for month, month_rows in by_month.items():
+                conn = self._month(month, create=True)
+                with conn:
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO archived_turns (id, user_id, role, content, summary, tags, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        month_rows,
+                    )
+            index = self._index(create=True)
+            with index:
+                index.executemany(
+                    "INSERT OR IGNORE INTO archive_index (user_id, id, month) VALUES (?, ?, ?)",
+                    ((row[1], row[0], month) for month, month_rows in by_month.items() for row in month_rows),
+                )
+        return {
+            "rows": sum(len(r) for r in by_month.values()),
+            "months": sorted(by_month),
+            "raw_bytes": raw_bytes,
+            "stored_bytes": stored_bytes,
+        }
+    
+    def _fetch(self, user_id: str, refs: List[Tuple[int, str]]) -> Dict[int, tuple]:
+        by_month: Dict[str, List[int]] = {}
+        for row_id, month in refs:
+            by_month.setdefault(month, []).append(row_id)
+        found: Dict[int, tuple] = {}
+        for month, ids in by_month.items():
+            conn = self._month(month)
+            if conn is None:
+                continue
+            placeholders = ", ".join("?" * len(ids))
+            for row in conn.execute(
+                "SELECT id, role, content, summary, created_at, tags FROM archived_turns "
+                f"WHERE user_id = ? AND id IN ({placeholders})",
+                (user_id, *ids),
+            ):
+                found[row[0]] = (row[0], row[1], decompress_text(row[2]), row[3], row[4], row[5])
+        return found
+    
+    def get(self, user_id: str, interaction_id: int) -> Optional[tuple]:
+        """(id, role, content, summary, created_at, tags) بنفس شكل صفوف RECENT_CONTEXT_SQL."""
+        with self._lock:
+            index = self._index()
+            if index is None:
+                return None
+            ref = index.execute(
+                "SELECT id, month FROM archive_index WHERE id = ? AND user_id = ?", (interaction_id, user_id)
+            ).fetchone()
+            if ref is None:
+                return None
+            return self._fetch(user_id, [ref]).get(interaction_id)
+    
+    def history(self, user_id: str, limit: int = 20, before_id: Optional[int] = None) -> List[tuple]:
+        """أحدث limit صفوف مؤرشفة للمستخدم قبل before_id (أقدم -> أحدث)."""
+        with self._lock:
+            index = self._index()
+            if index is None or limit <= 0:
+                return []
+            refs = index.execute(
+                "SELECT id, month FROM archive_index WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (user_id, before_id if before_id is not None else 2 ** 63 - 1, limit),
+            ).fetchall()
+            found = self._fetch(user_id, refs)
+        return [found[row_id] for row_id, _month in reversed(refs) if row_id in found]
+    
+    def stats(self) -> Dict[str, Any]:
+        months = self.months()
+        size = 0
+        for month in months:
+            path = self._path(_MONTH_FILE.format(month=month))
+            for suffix in ("", "-wal"):
+                if os.path.exists(path + suffix):
+                    size += os.path.getsize(path + suffix)
+        with self._lock:
+            index = self._index()
+            rows = index.execute("SELECT COUNT(*) FROM archive_index").fetchone()[0] if index else 0
+        return {"directory": self.directory, "months": months, "rows": rows, "bytes": size}
+    
+    def close(self):
+        with self._lock:
+            for conn in self._conns.values():
+                conn.close()
+            self._conns.clear()
+
+# ==========================
+# تشغيل الأرشفة على القاعدة الساخنة
+# ==========================
+
+def _live_bytes(conn: sqlite3.Connection) -> int:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return page_size * (page_count - freelist)
+
+def _file_bytes(db_path: str) -> int:
+    return sum(os.path.getsize(db_path + s) for s in ("", "-wal") if os.path.exists(db_path + s))
+
+def _keep_boundary(conn: sqlite3.Connection, user_id: str, keep: int, skip: Optional[Set[int]] = None) -> int:
+    """
+    أكبر id خارج أحدث keep صف للمستخدم (0 = كل صفوفه داخل الـ keep).
+    skip: ids انحسبت في dry run (كأنها انحذفت)، فما تاخذ مكان من الـ keep.
+    """
+    if keep <= 0:
+        return 2 ** 63 - 1
+    if skip:
+        kept = 0
+        for (row_id,) in conn.execute(
+            "SELECT id FROM conversation_memory WHERE user_id = ? ORDER BY id DESC", (user_id,)
+        ):
+            if row_id in skip:
+                continue
+            if kept == keep:
+                return row_id
+            kept += 1
+        return 0
+    row = conn.execute(
+        "SELECT id FROM conversation_memory WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+        (user_id, keep),
+    ).fetchone()
+    return row[0] if row else 0
+
+def _move_batch(
+    conn: sqlite3.Connection,
+    archive: ConversationArchive,
+    rows: List[tuple],
+    totals: Dict[str, Any],
+    dry_run: bool
+):
+    if not rows:
+        return
+    if dry_run:
+        totals["rows_archived"] += len(rows)
+        totals["raw_bytes"] += sum(len((r[3] or "").encode("utf-8")) for r in rows)
+        totals["users"].update(r[1] for r in rows)
+        return
+    written = archive.write(rows)
+    ids = [r[0] for r in rows]
+    # معاملة قصيرة لكل دفعة (BEGIN IMMEDIATE = ننتظر دورنا بدل الفشل وسط الحذف)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"DELETE FROM conversation_memory WHERE id IN ({', '.join('?' * len(ids))})", ids)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    totals["rows_archived"] += len(rows)
+    totals["raw_bytes"] += written["raw_bytes"]
+    totals["stored_bytes"] += written["stored_bytes"]
+    totals["months"].update(written["months"])
+    totals["users"].update(r[1] for r in rows)
+
+def run_retention(
+    conn: sqlite3.Connection,
+    archive: ConversationArchive,
+    max_age_days: Optional[float] = None,
+    max_rows: Optional[int] = None,
+    min_keep_rows: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    pause_ms: Optional[int] = None,
+    dry_run: bool = False,
+    reclaim: str = "incremental"
+) -> Dict[str, Any]:
+    """
+    نقل الصفوف المؤهلة للأرشيف على دفعات. conn: اتصال للقاعدة الساخنة (أي اتصال sqlite3).
+    reclaim: none / incremental (PRAGMA incremental_vacuum لو auto_vacuum=INCREMENTAL) / vacuum (يحجز الكتّاب).
+    ترجع تقرير: عدد الصفوف، حجم المحتوى قبل/بعد الضغط، والمساحة المستعادة من القاعدة الساخنة.
+    """
+    max_age_days = RETENTION_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    max_rows = RETENTION_MAX_ROWS if max_rows is None else max_rows
+    min_keep_rows = RETENTION_MIN_KEEP_ROWS if min_keep_rows is None else min_keep_rows
+    batch_size = max(1, RETENTION_BATCH_SIZE if batch_size is None else batch_size)
+    pause = (RETENTION_PAUSE_MS if pause_ms is None else pause_ms) / 1000.0
+    if reclaim not in ("none", "incremental", "vacuum"):
+        raise ValueError(f"Invalid reclaim mode: {reclaim}")
+    
+    started = time.perf_counter()
+    db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+    live_before = _live_bytes(conn)
+    file_before = _file_bytes(db_path) if db_path else 0
+    totals: Dict[str, Any] = {"rows_archived": 0, "raw_bytes": 0, "stored_bytes": 0, "months": set(), "users": set()}
+    boundaries: Dict[str, int] = {}
+    # dry run ما يحذف: ids الخطوة 1 تنحفظ حتى ما تنعد مرة ثانية في الخطوة 2
+    counted: Set[int] = set()
+    counted_per_user: Counter = Counter()
+    
+    # 1) حسب العمر: فهرس (created_at, id) (الترحيل 6) والمسح بالصفحات على (created_at, id)،
+    #    فكل تشغيل يقرأ الجزء القديم فقط بدل كل الجدول. ما نعتمد على ترتيب id: صفوف مستوردة / منقولة
+    #    تاخذ id جديد كبير مع created_at قديم. صفوف created_at فيها NULL ما لها عمر: حد العدد (2) بس.
+    if max_age_days > 0:
+        cutoff = conn.execute(
+            "SELECT datetime('now', ?)", (f"-{max_age_days * 86400:.0f} seconds",)
+        ).fetchone()[0]
+        last: Optional[Tuple[Any, int]] = None
+        while True:
+            if last is None:
+                rows = conn.execute(
+                    f"SELECT {_HOT_COLUMNS} FROM conversation_memory "
+                    "WHERE created_at < ? ORDER BY created_at, id LIMIT ?",
+                    (cutoff, batch_size),
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    f"SELECT {_HOT_COLUMNS} FROM conversation_memory "
+                    "WHERE created_at < ? AND (created_at, id) > (?, ?) ORDER BY created_at, id LIMIT ?",
+                    (cutoff, last[0], last[1], batch_size),
+                ).fetchall()
+            if not rows:
+                break
+            last = (rows[-1][6], rows[-1][0])
+            batch = []
+            for row in rows:
+                user_id = row[1]
+                if user_id not in boundaries:
+                    boundaries[user_id] = _keep_boundary(conn, user_id, min_keep_rows)
+                if row[0] <= boundaries[user_id]:
+                    batch.append(row)
+            if dry_run:
+                counted.update(row[0] for row in batch)
+                counted_per_user.update(row[1] for row in batch)
+            _move_batch(conn, archive, batch, totals, dry_run)
+            if batch and pause > 0:
+                time.sleep(pause)
+    
+    # 2) حسب العدد: المستخدمين اللي عندهم أكثر من max_rows صف
+    if max_rows > 0:
+        keep = max(max_rows, min_keep_rows)
+        heavy = [row[0] for row in conn.execute(
+            "SELECT user_id, COUNT(*) FROM conversation_memory GROUP BY user_id HAVING COUNT(*) > ?", (keep,)
+        ) if row[1] - counted_per_user[row[0]] > keep]
+        for user_id in heavy:
+            boundary = _keep_boundary(conn, user_id, keep, counted)
+            last_id = 0
+            while True:
+                rows = conn.execute(
+                    f"SELECT {_HOT_COLUMNS} FROM conversation_memory "
+                    "WHERE user_id = ? AND id > ? AND id <= ? ORDER BY id LIMIT ?",
+                    (user_id, last_id, boundary, batch_size),
+                ).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                if counted:
+                    rows = [row for row in rows if row[0] not in counted]
+                _move_batch(conn, archive, rows, totals, dry_run)
+                if pause > 0:
+                    time.sleep(pause)
+    
+    # 3) استعادة المساحة: الحذف يحول الصفحات لـ freelist، والملف ما يصغر إلا بـ vacuum
+    if not dry_run and totals["rows_archived"]:
+        if reclaim == "vacuum":
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        elif reclaim == "incremental" and conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+                # خطوات صغيرة حتى ما نمسك قفل الكتابة طويل
+                conn.execute("PRAGMA incremental_vacuum(256)").fetchall()
+                if pause > 0:
+                    time.sleep(pause)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    
+    live_after = _live_bytes(conn)
+    file_after = _file_bytes(db_path) if db_path else 0
+    return {
+        "db_path": db_path,
+        "dry_run": dry_run,
+        "rows_archived": totals["rows_archived"],
+        "users_affected": len(totals["users"]),
+        "archive_months": sorted(totals["months"]),
+        "content_raw_bytes": totals["raw_bytes"],
+        "content_archived_bytes": totals["stored_bytes"],
+        "compression_ratio": round(totals["raw_bytes"] / totals["stored_bytes"], 2) if totals["stored_bytes"] else None,
+        "hot_live_bytes_before": live_before,
+        "hot_live_bytes_after": live_after,
+        "hot_bytes_reclaimed": live_before - live_after,
+        "hot_file_bytes_before": file_before,
+        "hot_file_bytes_after": file_after,
+        "hot_file_bytes_reclaimed": file_before - file_after,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+def archive_old_turns(
+    db_path: str = "hawsa_ai_memory.db",
+    archive_dir: Optional[str] = None,
+    **options
+) -> Dict[str, Any]:
+    """نفس run_retention على ملف (CLI / مهمة دورية في عملية منفصلة عن السيرفر)."""
+    from hawsa_migrations import MEMORY_MIGRATIONS, apply_migrations
+    
+    archive = ConversationArchive(archive_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), ARCHIVE_DIR))
+    # isolation_level=None: المعاملات يدوية (BEGIN IMMEDIATE لكل دفعة)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        apply_migrations(conn, MEMORY_MIGRATIONS)
+        report = run_retention(conn, archive, **options)
+    finally:
+        conn.close()
+        archive.close()
+    return report
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="نقل المحادثات القديمة من hawsa_ai_memory.db لأرشيف شهري مضغوط")
+    parser.add_argument("--db", default="hawsa_ai_memory.db")
+    parser.add_argument("--shards", type=int, default=None, help="عدد ملفات القاعدة (الافتراضي HAWSA_DB_SHARDS)")
+    parser.add_argument("--archive-dir", default=None, help=f"الافتراضي: {ARCHIVE_DIR} بجانب القاعدة")
+    parser.add_argument("--max-age-days", type=float, default=None, help="أرشفة الأقدم من N يوم (0 = تعطيل)")
+    parser.add_argument("--max-rows", type=int, default=None, help="أقصى صفوف ساخنة لكل مستخدم (0 = تعطيل)")
+    parser.add_argument("--min-keep-rows", type=int, default=None, help="أحدث N صف لكل مستخدم ما تتأرشف أبدًا")
+    parser.add_argument("--batch", type=int, default=None)
+    parser.add_argument("--pause-ms", type=int, default=None, help="استراحة بين الدفعات (للكتّاب)")
+    parser.add_argument("--reclaim", choices=["none", "incremental", "vacuum"], default="incremental")
+    parser.add_argument("--dry-run", action="store_true", help="حساب المؤهل بدون نقل")
+    parser.add_argument("--stats", action="store_true", help="طباعة إحصائيات الأرشيف فقط")
+    parser.add_argument("--interval", type=float, default=0.0, help="تشغيل دوري كل N ثانية (0 = مرة واحدة)")
+    args = parser.parse_args()
+    
+    if args.stats:
+        archive = ConversationArchive(
+            args.archive_dir or os.path.join(os.path.dirname(os.path.abspath(args.db)), ARCHIVE_DIR)
+        )
+        print(json.dumps(archive.stats(), ensure_ascii=False))
+        archive.close()
+    else:
+        from hawsa_storage import DEFAULT_SHARDS, shard_paths
+        
+        # كل الملفات تكتب لنفس الأرشيف (بجانب --db)
+        archive_dir = args.archive_dir or os.path.join(os.path.dirname(os.path.abspath(args.db)), ARCHIVE_DIR)
+        paths = shard_paths(args.db, DEFAULT_SHARDS if args.shards is None else args.shards)
+        while True:
+            for path in paths:
+                report = archive_old_turns(
+                    path,
+                    archive_dir,
+                    max_age_days=args.max_age_days,
+                    max_rows=args.max_rows,
+                    min_keep_rows=args.min_keep_rows,
+                    batch_size=args.batch,
+                    pause_ms=args.pause_ms,
+                    dry_run=args.dry_run,
+                    reclaim=args.reclaim,
+                )
+                print(json.dumps(report, ensure_ascii=False))
+            if args.interval <= 0:
+                break
+            time.sleep(args.interval)
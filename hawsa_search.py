@@ -0,0 +1,234 @@
+import hashlib
+import math
+import os
+import re
+import sqlite3
+from typing import Any, Dict, List, Optional, Sequence
+
+from hawsa_keywords import normalize_text
+from hawsa_notes import now_days, timestamp_days
+
+# ==========================
+# بحث نصي (FTS5) في المحادثات والملاحظات
+# ==========================
+# الفهرس contentless (content='') يخزن فقط النص بعد التوحيد العربي. النص المفهرس يُحسب في Python
+# وقت الكتابة ويُحفظ في عمود fts_body بالجدول الأصلي، والـ triggers تنسخه للفهرس بـ SQL عادي:
+# أي اتصال sqlite3 (CLI، أدوات خارجية) يقدر يكتب ويحذف بدون دوال مسجلة.
+# صف انكتب بدون fts_body (أداة خارجية / استيراد) ما يظهر في البحث لين fill_fts_bodies تعبيه.
+# unicode61 ما يشيل التشكيل العربي ولا يوحد الهمزات، فالتوحيد يصير هنا قبل الفهرسة وقبل البحث.
+#
+# كل كلمة تُفهرس ملصوقة بتوكن المستخدم (u<hash>كلمة)، فقائمة كل كلمة تخص مستخدم واحد:
+# البحث ما يمر على رسائل المستخدمين الآخرين ولا يحتاج تقاطع مع قائمة كل رسائل المستخدم.
+# ولكل كلمة نقرأ أحدث RETRIEVAL_CANDIDATES تطابق فقط (ORDER BY rowid DESC)، فالكلفة محدودة
+# حتى لو المستخدم عنده 100k+ رسالة والكلمة موجودة في نصها.
+
+RETRIEVAL_ENABLED = os.environ.get("HAWSA_RETRIEVAL", "1") == "1"
+RETRIEVAL_TURNS = int(os.environ.get("HAWSA_RETRIEVAL_TURNS", "3"))
+RETRIEVAL_NOTES = int(os.environ.get("HAWSA_RETRIEVAL_NOTES", "3"))
+RETRIEVAL_CANDIDATES = int(os.environ.get("HAWSA_RETRIEVAL_CANDIDATES", "100"))
+RETRIEVAL_RECENCY_WEIGHT = float(os.environ.get("HAWSA_RETRIEVAL_RECENCY_WEIGHT", "0.3"))
+RETRIEVAL_HALF_LIFE_DAYS = float(os.environ.get("HAWSA_RETRIEVAL_HALF_LIFE_DAYS", "14"))
+# المرشحين (حسب BM25) اللي تنقرأ صفوفهم لإعادة الترتيب بالحداثة، لكل نتيجة مطلوبة
+RERANK_PER_HIT = 4
+MAX_QUERY_TERMS = 8
+
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+
+# حروف وأرقام فقط (unicode61 يعتبر _ فاصل، فما نخليه داخل الكلمة)
+_TOKEN = re.compile(r"[^\W_]+")
+# ة/ه و ى/ي والهمزات على الواو والياء تُكتب بالشكلين في الرسائل
+_LETTER_FORMS = str.maketrans({"ة": "ه", "ى": "ي", "ؤ": "و", "ئ": "ي"})
+# أداة التعريف مع حروف الجر/العطف الملتصقة (تقطيع خفيف بدل stemmer كامل)
+_ARTICLE_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+def _light_stem(token: str) -> str:
+    for prefix in _ARTICLE_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    return token
+
+def fts_tokens(text: str) -> List[str]:
+    """نفس التوحيد للنص المفهرس ولنص البحث: normalize_text + أشكال الحروف + حذف أداة التعريف."""
+    text = normalize_text(text).translate(_LETTER_FORMS)
+    return [_light_stem(token) for token in _TOKEN.findall(text)]
+
+def user_token(user_id: Optional[str]) -> str:
+    """بادئة أبجدية-رقمية ثابتة لكل user_id (أي user_id يصير جزء من الكلمة نفسها)."""
+    return "u" + hashlib.blake2b((user_id or "").encode("utf-8"), digest_size=8).hexdigest()
+
+def fts_document(user_id: Optional[str], text: Optional[str]) -> str:
+    """النص كما يُفهرس: كل كلمة ملصوقة ببادئة المستخدم."""
+    prefix = user_token(user_id)
+    return " ".join(prefix + token for token in fts_tokens(text or ""))
+
+_STOPWORDS_RAW = (
+    "في من على الى إلى عن مع هذا هذه ذلك التي الذي و او أو ثم ما لا لم لن ان إن أن كان "
+    "عند انا أنا انت أنت هو هي نحن هم كل بعد قبل يا بس شي شو وش ليش كيف ابي ابغى ابغي "
+    "the a an and or to of in on for is are be with my i you it this that me please"
+)
+STOPWORDS = frozenset(fts_tokens(_STOPWORDS_RAW))
+
+def query_terms(text: str, max_terms: int = MAX_QUERY_TERMS) -> List[str]:
+    """كلمات البحث من الرسالة: بدون الكلمات الشائعة والمكرر، الأطول أولاً (غالبًا أندر وأدق)."""
+    terms = []
+    for token in fts_tokens(text):
+        if len(token) < 2 or token in STOPWORDS or token in terms:
+            continue
+        terms.append(token)
+    return sorted(terms, key=len, reverse=True)[:max_terms]
+
+def term_phrase(user_id: str, term: str) -> str:
+    return f'"{user_token(user_id)}{term}"'
+
+def match_any(user_id: str, terms: List[str]) -> str:
+    return " OR ".join(term_phrase(user_id, term) for term in terms)
+
+def rank_hits(
+    hits: List[Dict[str, Any]],
+    limit: int,
+    time_key: str,
+    recency_weight: Optional[float] = None,
+    half_life_days: Optional[float] = None
+) -> List[Dict[str, Any]]:
+    """
+    إعادة ترتيب مرشحي BM25: relevance = (1 - w) * bm25 / أعلى bm25 + w * 2^(-العمر / نصف العمر).
+    كل hit فيه bm25 (موجب = أنسب) ويُضاف له relevance.
+    """
+    if not hits:
+        return []
+    weight = RETRIEVAL_RECENCY_WEIGHT if recency_weight is None else recency_weight
+    half_life = RETRIEVAL_HALF_LIFE_DAYS if half_life_days is None else half_life_days
+    today = now_days()
+    best = max(hit["bm25"] for hit in hits) or 1.0
+    for hit in hits:
+        age = max(0.0, today - timestamp_days(hit.get(time_key)))
+        recency = math.pow(2.0, -age / half_life) if half_life > 0 else 0.0
+        hit["relevance"] = round((1.0 - weight) * hit["bm25"] / best + weight * recency, 6)
+    hits.sort(key=lambda hit: hit["relevance"], reverse=True)
+    return hits[:limit]
+
+# ==========================
+# المخطط: جداول FTS + عمود fts_body + triggers (الترحيلات 4 و5 في hawsa_migrations.py)
+# ==========================
+
+# الجدول -> (جدول FTS، عمود النص)
+FTS_SOURCES = {
+    "conversation_memory": ("conversation_fts", "content"),
+    "long_term_notes": ("notes_fts", "note_text"),
+}
+FTS_FILL_BATCH = 1000
+
+def _scan_texts(conn: sqlite3.Connection, table: str, where: str = ""):
+    """(id, fts_document) لصفوف الجدول بدفعات FTS_FILL_BATCH مرتبة بالـ id (ذاكرة ثابتة لملف كبير)."""
+    _fts, column = FTS_SOURCES[table]
+    condition = f"({where}) AND " if where else ""
+    last_id = -1
+    while True:
+        rows = conn.execute(
+            f"SELECT id, user_id, {column} FROM {table} WHERE {condition}id > ? ORDER BY id LIMIT ?",
+            (last_id, FTS_FILL_BATCH)
+        ).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [(row_id, fts_document(user_id, text)) for row_id, user_id, text in rows]
+
+def _fts_bodies(conn: sqlite3.Connection, table: str, where: str = "") -> int:
+    """تعبئة fts_body لصفوف الجدول (كلها أو حسب where). ترجع عدد الصفوف."""
+    count = 0
+    for batch in _scan_texts(conn, table, where):
+        conn.executemany(f"UPDATE {table} SET fts_body = ? WHERE id = ?", [(body, row_id) for row_id, body in batch])
+        count += len(batch)
+    return count
+
+def fill_fts_bodies(conn: sqlite3.Connection, tables: Sequence[str] = tuple(FTS_SOURCES)) -> int:
+    """
+    فهرسة الصفوف اللي انكتبت بدون fts_body (استيراد، نقل بين ملفات، أداة خارجية).
+    trigger التحديث ينقلها للفهرس؛ فهرس جزئي (fts_body IS NULL) فالفحص رخيص لو ما فيه شي.
+    """
+    return sum(_fts_bodies(conn, table, "fts_body IS NULL") for table in tables)
+
+def _index_existing(table: str):
+    # فهرسة الصفوف الموجودة (ملفات الإنتاج القديمة) بنفس التوحيد، بدون دوال SQL
+    def step(conn: sqlite3.Connection):
+        fts, _column = FTS_SOURCES[table]
+        for batch in _scan_texts(conn, table):
+            conn.executemany(f"INSERT INTO {fts} (rowid, body) VALUES (?, ?)", batch)
+    return step
+
+def _fts_steps(fts: str, table: str) -> List[Any]:
+    return [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts}
+        USING fts5(body, content='', tokenize='{FTS_TOKENIZER}')
+        """,
+        _index_existing(table),
+    ]
+
+def _fts_body_steps(fts: str, table: str) -> List[Any]:
+    # الترحيل 4 القديم كان يزامن عبر triggers تستدعي دالة Python (hawsa_fts_document)،
+    # فأي اتصال بدونها كان يفشل في كل INSERT / DELETE. fts_body = نفس القيمة المفهرسة أصلاً،
+    # فالفهرس نفسه ما يحتاج إعادة بناء.
+    return [
+        f"DROP TRIGGER IF EXISTS {fts}_ai",
+        f"DROP TRIGGER IF EXISTS {fts}_ad",
+        f"DROP TRIGGER IF EXISTS {fts}_au",
+        lambda conn: _add_fts_body(conn, table),
+        lambda conn: _fts_bodies(conn, table),
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_{table}_fts_pending
+        ON {table} (id) WHERE fts_body IS NULL
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts} (rowid, body) VALUES (new.id, new.fts_body);
+        END
+        """,
+        # contentless: الحذف يحتاج نفس القيم المفهرسة، وهي المحفوظة في fts_body
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, body) VALUES ('delete', old.id, old.fts_body);
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF fts_body ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, body) VALUES ('delete', old.id, old.fts_body);
+            INSERT INTO {fts} (rowid, body) VALUES (new.id, new.fts_body);
+        END
+        """,
+    ]
+
+def _add_fts_body(conn: sqlite3.Connection, table: str):
+    if "fts_body" not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN fts_body TEXT")
+
+FTS_MIGRATION_STEPS: List[Any] = [
+    step for table, (fts, _column) in FTS_SOURCES.items() for step in _fts_steps(fts, table)
+]
+
+FTS_BODY_MIGRATION_STEPS: List[Any] = [
+    step for table, (fts, _column) in FTS_SOURCES.items() for step in _fts_body_steps(fts, table)
+]
+
+# ==========================
+# استعلامات البحث
+# ==========================
+
+# أحدث تطابقات كلمة وحدة مع BM25 (يُحسب للصفوف المرجعة فقط، بدون ترتيب كل التطابقات)
+SEARCH_TERM_SQL = """
+    SELECT rowid, -bm25(conversation_fts)
+    FROM conversation_fts
+    WHERE conversation_fts MATCH ?
+    ORDER BY rowid DESC
+    LIMIT ?
+"""
+
+# الملاحظات محدودة لكل مستخدم (MAX_NOTES_PER_USER)، فالترتيب الكامل بـ BM25 رخيص
+SEARCH_NOTES_SQL = """
+    SELECT n.id, n.note_type, n.note_text, n.last_seen_at, -f.rank
+    FROM notes_fts AS f
+    JOIN long_term_notes AS n ON n.id = f.rowid
+    WHERE notes_fts MATCH ?
+    ORDER BY f.rank
+    LIMIT ?
+"""
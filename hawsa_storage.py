@@ -0,0 +1,316 @@
+import hashlib
+import os
+import sqlite3
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+from hawsa_db import SQLitePool, get_pool
+from hawsa_search import FTS_SOURCES, fill_fts_bodies
+
+# ==========================
+# طبقة التخزين: أي ملف SQLite يخدم أي مستخدم
+# ==========================
+# HawsaAdvancedMemory / AdvancedUserAnalytics ما يعرفون مسار الملف: يطلبون pool_for(user_id).
+# كل الجداول مفتاحها user_id (محادثات، ملاحظات، بروفايلات)، فبيانات المستخدم الواحد كلها في ملف واحد
+# وكل استعلام يمر على ملف واحد بس.
+# - SingleFileStorage: الوضع القديم (ملف واحد)
+# - ShardedStorage:    N ملف، المستخدم يروح لـ hash(user_id) % N؛ كل ملف له قفل كتابة خاص،
+#                      فالكتابة لمستخدمين مختلفين ما تنتظر بعضها
+# - InMemoryStorage:   قواعد :memory: للاختبارات (بدون ملفات)
+#
+# id الصفوف (conversation_memory / long_term_notes) فريد داخل الملف فقط، فكل بحث بالـ id معه user_id.
+
+DEFAULT_SHARDS = int(os.environ.get("HAWSA_DB_SHARDS", "1"))
+
+# hawsa_ai_memory.db + 4 ملفات -> hawsa_ai_memory.shard00-of-04.db ...
+# عدد الملفات جزء من الاسم، فإعادة التوزيع (4 -> 8) تكتب ملفات جديدة بدل الكتابة فوق القديمة
+_SHARD_NAME = "{stem}.shard{index:02d}-of-{count:02d}{ext}"
+
+T = TypeVar("T")
+
+def shard_index(user_id: str, shards: int) -> int:
+    """رقم ملف المستخدم (hash ثابت بين العمليات والتشغيلات، بعكس hash() في بايثون)."""
+    if shards <= 1:
+        return 0
+    digest = hashlib.blake2b(str(user_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+def shard_paths(db_path: str, shards: int) -> List[str]:
+    if shards <= 1:
+        return [db_path]
+    stem, ext = os.path.splitext(db_path)
+    return [_SHARD_NAME.format(stem=stem, index=i, count=shards, ext=ext or ".db") for i in range(shards)]
+
+class Storage:
+    """واجهة التخزين المشتركة. الكلاسات تتعامل مع SQLitePool فقط (connection / transaction)."""
+    kind = "base"
+    
+    def pool_for(self, user_id: str) -> SQLitePool:
+        raise NotImplementedError
+    
+    def pools(self) -> List[SQLitePool]:
+        """كل الملفات (للترحيلات والأدوات اللي تمر على كل المستخدمين)."""
+        raise NotImplementedError
+    
+    @property
+    def sharded(self) -> bool:
+        return len(self.pools()) > 1
+    
+    def group_by_pool(self, items: Iterable[T], user_of: Callable[[T], str]) -> List[Tuple[SQLitePool, List[Tuple[int, T]]]]:
+        """
+        تقسيم دفعة حسب الملف مع الحفاظ على الترتيب: [(pool, [(position, item), ...]), ...].
+        position = مكان العنصر في الدفعة الأصلية (لإرجاع النتائج بنفس الترتيب).
+        """
+        groups: Dict[int, Tuple[SQLitePool, List[Tuple[int, T]]]] = {}
+        for position, item in enumerate(items):
+            pool = self.pool_for(user_of(item))
+            groups.setdefault(id(pool), (pool, []))[1].append((position, item))
+        return list(groups.values())
+    
+    def describe(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "files": [pool.db_path for pool in self.pools()]}
+    
+    def close(self):
+        for pool in self.pools():
+            pool.close()
+
+class SingleFileStorage(Storage):
+    kind = "single"
+    
+    def __init__(self, db_path: str, pool_size: Optional[int] = None, pool: Optional[SQLitePool] = None):
+        self.db_path = db_path
+        self.pool = pool or get_pool(db_path, pool_size)
+    
+    def pool_for(self, user_id: str) -> SQLitePool:
+        return self.pool
+    
+    def pools(self) -> List[SQLitePool]:
+        return [self.pool]
+
+class ShardedStorage(Storage):
+    kind = "sharded"
+    
+    def __init__(self, db_path: str, shards: int, pool_size: Optional[int] = None):
+        if shards < 1:
+            raise ValueError(f"Invalid shard count: {shards}")
+        self.db_path = db_path
+        self.shards = shards
+        self._pools = [get_pool(path, pool_size) for path in shard_paths(db_path, shards)]
+    
+    def pool_for(self, user_id: str) -> SQLitePool:
+        return self._pools[shard_index(user_id, self.shards)]
+    
+    def pools(self) -> List[SQLitePool]:
+        return list(self._pools)
+
+class InMemoryStorage(Storage):
+    """قواعد :memory: مستقلة (shards > 1 يختبر التوجيه بدون ملفات)."""
+    kind = "memory"
+    
+    def __init__(self, shards: int = 1):
+        self.shards = max(1, shards)
+        self._pools = [get_pool(":memory:") for _ in range(self.shards)]
+    
+    def pool_for(self, user_id: str) -> SQLitePool:
+        return self._pools[shard_index(user_id, self.shards)]
+    
+    def pools(self) -> List[SQLitePool]:
+        return list(self._pools)
+
+def open_storage(db_path: str, shards: Optional[int] = None, pool_size: Optional[int] = None) -> Storage:
+    """التخزين الافتراضي لملف: :memory: -> InMemoryStorage، shards > 1 -> ShardedStorage (HAWSA_DB_SHARDS)."""
+    shards = DEFAULT_SHARDS if shards is None else shards
+    if db_path == ":memory:":
+        return InMemoryStorage(shards)
+    if shards > 1:
+        return ShardedStorage(db_path, shards, pool_size)
+    return SingleFileStorage(db_path, pool_size)
+
+# ==========================
+# نقل البيانات بين تخطيطين (ملف واحد -> shards، أو 4 -> 8)
+# ==========================
+
+MIGRATE_BATCH_SIZE = int(os.environ.get("HAWSA_MIGRATE_BATCH", "1000"))
+# صف أخذ id جديد في الملف الهدف: (الجدول، المستخدم، id المصدر) -> id الهدف (الترحيل 7 في hawsa_migrations.py)،
+# حتى ما يتكرر لو انعاد النقل / الاستيراد. (user_id, id) فريد في أي تخطيط لأن المستخدم كله في ملف واحد.
+ID_MAP_TABLE = "hawsa_id_map"
+
+def user_tables(conn: sqlite3.Connection) -> List[str]:
+    """الجداول العادية اللي فيها عمود user_id (بدون FTS وجداوله الداخلية)."""
+    virtual = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'"
+    )]
+    tables = []
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"):
+        if name == ID_MAP_TABLE or name in virtual or any(name.startswith(v + "_") for v in virtual):
+            continue
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({name})")]
+        if "user_id" in columns:
+            tables.append(name)
+    return tables
+
+def rowid_column(conn: sqlite3.Connection, table: str) -> Optional[str]:
+    """عمود INTEGER PRIMARY KEY (id) لو موجود."""
+    keys = [row for row in conn.execute(f"PRAGMA table_info({table})") if row[5]]
+    if len(keys) == 1 and keys[0][2].upper() == "INTEGER":
+        return keys[0][1]
+    return None
+
+def copy_rows(
+    conn: sqlite3.Connection,
+    table: str,
+    columns: Sequence[str],
+    id_column: Optional[str],
+    rows: List[tuple],
+    counts: Dict[str, int]
+):
+    """
+    INSERT OR IGNORE لصفوف من ملف ثاني: counts[copied / renumbered / skipped].
+    التشغيل مرة ثانية (نفس المصدر) ما يكرر أي صف. fts_body ما ينسخ (ممكن يكون NULL في المصدر):
+    يُحسب من جديد للصفوف المنسوخة في نفس المعاملة.
+    """
+    if "fts_body" in columns:
+        keep = [i for i, column in enumerate(columns) if column != "fts_body"]
+        columns = [columns[i] for i in keep]
+        rows = [tuple(row[i] for i in keep) for row in rows]
+    _copy_rows(conn, table, columns, id_column, rows, counts)
+    if table in FTS_SOURCES:
+        fill_fts_bodies(conn, (table,))
+
+def _copy_rows(
+    conn: sqlite3.Connection,
+    table: str,
+    columns: Sequence[str],
+    id_column: Optional[str],
+    rows: List[tuple],
+    counts: Dict[str, int]
+):
+    placeholders = ", ".join("?" * len(columns))
+    insert = f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    if id_column is None:
+        for row in rows:
+            counts["copied" if conn.execute(insert, row).rowcount else "skipped"] += 1
+        return
+    id_pos = columns.index(id_column)
+    user_pos = columns.index("user_id")
+    other = [c for c in columns if c != id_column]
+    renumber = f"INSERT OR IGNORE INTO {table} ({', '.join(other)}) VALUES ({', '.join('?' * len(other))})"
+    select = f"SELECT {', '.join(columns)} FROM {table} WHERE {id_column} = ?"
+    for row in rows:
+        key = (table, row[user_pos], row[id_pos])
+        if conn.execute(
+            f"SELECT 1 FROM {ID_MAP_TABLE} WHERE table_name = ? AND user_id = ? AND source_id = ?", key
+        ).fetchone():
+            # انحفظ بـ id جديد في تشغيل سابق
+            counts["skipped"] += 1
+            continue
+        if conn.execute(insert, row).rowcount:
+            counts["copied"] += 1
+            continue
+        existing = conn.execute(select, (row[id_pos],)).fetchone()
+        if existing is not None and tuple(existing) != tuple(row):
+            # نفس id لصف ثاني (مستخدم في shard ثاني، أو بيانات موجودة في الهدف): id جديد + نسجله
+            cursor = conn.execute(renumber, [v for i, v in enumerate(row) if i != id_pos])
+            if cursor.rowcount:
+                conn.execute(
+                    f"INSERT INTO {ID_MAP_TABLE} (table_name, user_id, source_id, target_id) VALUES (?, ?, ?, ?)",
+                    key + (cursor.lastrowid,)
+                )
+                counts["renumbered"] += 1
+                continue
+        # الصف منسوخ من تشغيل سابق بنفس id (أو مكرر بمفتاح فريد ثاني)
+        counts["skipped"] += 1
+
+def migrate_layout(
+    db_path: str,
+    migrations: Sequence[Any],
+    from_shards: int,
+    to_shards: int,
+    batch_size: Optional[int] = None,
+    allow_existing: bool = False
+) -> Dict[str, Any]:
+    """
+    نسخ كل صفوف المستخدمين من تخطيط from_shards لتخطيط to_shards (الملفات القديمة ما تنحذف).
+    ids تبقى كما هي إلا لو تعارضت في الملف الهدف (renumbered). التشغيل مرة ثانية ما يكرر الصفوف.
+    بعد النسخ: HAWSA_DB_SHARDS=to_shards وإعادة تشغيل السيرفر.
+    """
+    from hawsa_migrations import apply_migrations
+    
+    batch_size = max(1, batch_size or MIGRATE_BATCH_SIZE)
+    sources = shard_paths(db_path, from_shards)
+    targets = shard_paths(db_path, to_shards)
+    overlap = set(map(os.path.abspath, sources)) & set(map(os.path.abspath, targets))
+    if overlap:
+        raise ValueError(f"Source and target layouts share files: {sorted(overlap)}")
+    missing = [path for path in sources if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"Missing source files: {missing}")
+    
+    target = ShardedStorage(db_path, to_shards) if to_shards > 1 else SingleFileStorage(db_path)
+    for pool in target.pools():
+        with pool.connection() as conn:
+            apply_migrations(conn, migrations)
+            if not allow_existing:
+                for table in user_tables(conn):
+                    if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                        raise ValueError(f"{pool.db_path} already has rows in {table} (use --allow-existing to resume)")
+    
+    report: Dict[str, Any] = {"db_path": db_path, "from": sources, "to": targets, "tables": {}}
+    for source_path in sources:
+        source = sqlite3.connect(source_path)
+        try:
+            for table in user_tables(source):
+                counts = report["tables"].setdefault(table, {"copied": 0, "renumbered": 0, "skipped": 0})
+                columns = [row[1] for row in source.execute(f"PRAGMA table_info({table})")]
+                id_column = rowid_column(source, table)
+                user_pos = columns.index("user_id")
+                # بالترتيب (rowid) حتى تحافظ الصفوف الجديدة (renumbered) على ترتيب الوقت
+                cursor = source.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid")
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for pool, items in target.group_by_pool(rows, lambda row: row[user_pos]):
+                        with pool.transaction() as conn:
+                            copy_rows(conn, table, columns, id_column, [row for _pos, row in items], counts)
+        finally:
+            source.close()
+    return report
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    
+    from hawsa_migrations import ANALYTICS_MIGRATIONS, MEMORY_MIGRATIONS
+    
+    parser = argparse.ArgumentParser(description="توزيع قواعد Hawsa AI على عدة ملفات (shards) أو إعادة توزيعها")
+    sub = parser.add_subparsers(dest="command", required=True)
+    
+    show = sub.add_parser("show", help="الملف المسؤول عن كل مستخدم / ملفات تخطيط معين")
+    show.add_argument("--db", default="hawsa_ai_memory.db")
+    show.add_argument("--shards", type=int, default=DEFAULT_SHARDS)
+    show.add_argument("users", nargs="*")
+    
+    migrate = sub.add_parser("migrate", help="نسخ البيانات من تخطيط لتخطيط (1 -> N، N -> M، N -> 1)")
+    migrate.add_argument("--memory-db", default="hawsa_ai_memory.db")
+    migrate.add_argument("--analytics-db", default="hawsa_ai_advanced.db")
+    migrate.add_argument("--from-shards", type=int, default=1)
+    migrate.add_argument("--to-shards", type=int, required=True)
+    migrate.add_argument("--batch", type=int, default=None)
+    migrate.add_argument("--allow-existing", action="store_true", help="إكمال نقل سابق انقطع (الملفات الهدف فيها بيانات)")
+    args = parser.parse_args()
+    
+    if args.command == "show":
+        paths = shard_paths(args.db, args.shards)
+        if args.users:
+            for user_id in args.users:
+                print(f"{user_id}: {paths[shard_index(user_id, args.shards)]}")
+        else:
+            for path in paths:
+                size = os.path.getsize(path) if os.path.exists(path) else None
+                print(f"{path}: {size if size is not None else 'missing'}")
+    else:
+        for db_path, migrations in ((args.memory_db, MEMORY_MIGRATIONS), (args.analytics_db, ANALYTICS_MIGRATIONS)):
+            report = migrate_layout(
+                db_path, migrations, args.from_shards, args.to_shards, args.batch, args.allow_existing
+            )
+            print(json.dumps(report, ensure_ascii=False))
@@ -0,0 +1,332 @@
+import contextvars
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# ==========================
+# تتبع المراحل + مقاييس Prometheus (/metrics)
+# ==========================
+# span(name, trace) حول كل مرحلة في خط المعالجة، والمجمّع (hawsa_db.py) يسجل كل استعارة اتصال.
+# الوقت من perf_counter (monotonic) فقط. المقاييس تتجمع في REGISTRY وتنعرض بصيغة Prometheus النصية.
+# HAWSA_TRACING=0: span ترجع كائن ثابت بدون أي قياس (إلا لو الطلب نفسه طلب timings).
+
+TRACING_ENABLED = os.environ.get("HAWSA_TRACING", "1") == "1"
+# إرجاع timings_ms داخل analytics لكل طلب (أو لكل طلب يطلبه عبر timings=True)
+TIMING_BREAKDOWN = os.environ.get("HAWSA_TIMING_BREAKDOWN", "0") == "1"
+
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_state = {"enabled": TRACING_ENABLED}
+
+def is_enabled() -> bool:
+    return _state["enabled"]
+
+def set_enabled(enabled: bool):
+    """تشغيل/إيقاف القياس وقت التشغيل (مقارنة الكلفة في benchmarks مثلاً)."""
+    _state["enabled"] = bool(enabled)
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def value(self, labels: Tuple = ()) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+    
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """هيستوغرام تراكمي بنفس شكل Prometheus (buckets + sum + count) لكل مجموعة labels."""
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [عدادات الـ buckets (غير تراكمية)..., +Inf, sum]
+        self._series: Dict[Tuple, List[float]] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, labels: Tuple = ()):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+    
+    def snapshot(self, labels: Tuple = ()) -> Dict[str, float]:
+        with self._lock:
+            series = list(self._series.get(labels) or [0] * (len(self.buckets) + 1) + [0.0])
+        return {"count": sum(series[:-1]), "sum": series[-1]}
+    
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+# collector: دالة ترجع [(name, type, help, [(labels dict, value), ...]), ...] وقت العرض
+# (قيم جاهزة في مكان ثاني: إحصائيات الكاش، طابور الكتابة، المهارات)
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]]]
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: Dict[str, Collector] = {}
+        self._lock = threading.Lock()
+    
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+    
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labelnames)
+    
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets)
+    
+    def register_collector(self, key: str, collector: Collector):
+        """نفس key يستبدل القديم (نسخة HawsaCore جديدة في نفس العملية مثلاً)."""
+        with self._lock:
+            self._collectors[key] = collector
+    
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"[Metrics Error] {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    label_text = _format_labels(list(labels), list(labels.values()))
+                    lines.append(f"{name}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "hawsa_stage_seconds", "Pipeline stage latency", ("stage",)
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "hawsa_request_seconds", "End-to-end pipeline latency per request", ("path",)
+)
+DB_SECONDS = REGISTRY.histogram(
+    "hawsa_db_seconds", "Time a pooled SQLite connection was held", ("db", "op")
+)
+DB_QUERIES = REGISTRY.counter(
+    "hawsa_db_queries_total", "Pooled SQLite read borrows (connection())", ("db",)
+)
+DB_COMMITS = REGISTRY.counter(
+    "hawsa_db_commits_total", "Committed SQLite transactions", ("db",)
+)
+DB_ROLLBACKS = REGISTRY.counter(
+    "hawsa_db_rollbacks_total", "Rolled back SQLite transactions", ("db",)
+)
+SKILL_SECONDS = REGISTRY.histogram(
+    "hawsa_skill_seconds", "Skill handle() latency", ("skill", "outcome")
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "hawsa_stage_errors_total", "Pipeline stage failures (retrieval, persist, ...)", ("stage",)
+)
+
+# ==========================
+# تتبع طلب واحد (timings_ms في analytics)
+# ==========================
+
+class Trace:
+    """أوقات مراحل طلب واحد + وقت/عدد عمليات القاعدة خلالها (ممكن تتوازى في المسار async)."""
+    __slots__ = ("stages", "db_seconds", "db_calls", "_lock")
+    
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.db_seconds = 0.0
+        self.db_calls = 0
+        self._lock = threading.Lock()
+    
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+    
+    def add_db(self, seconds: float):
+        with self._lock:
+            self.db_seconds += seconds
+            self.db_calls += 1
+    
+    def as_dict(self, total_seconds: Optional[float] = None) -> Dict[str, Any]:
+        with self._lock:
+            result: Dict[str, Any] = {stage: round(s * 1000, 3) for stage, s in self.stages.items()}
+            result["db"] = round(self.db_seconds * 1000, 3)
+            result["db_calls"] = self.db_calls
+        if total_seconds is not None:
+            result["total"] = round(total_seconds * 1000, 3)
+        return result
+
+# الطلب الجاري (لنسب وقت القاعدة له). AsyncDBExecutor ينسخ الـ context لخيوط القاعدة.
+_current_trace: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar(
+    "hawsa_trace", default=None
+)
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+class _Span:
+    __slots__ = ("name", "trace", "start", "token")
+    
+    def __init__(self, name: str, trace: Optional[Trace]):
+        self.name = name
+        self.trace = trace
+        self.token = None
+    
+    def __enter__(self):
+        if self.trace is not None:
+            self.token = _current_trace.set(self.trace)
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        if self.token is not None:
+            _current_trace.reset(self.token)
+        if _state["enabled"]:
+            STAGE_SECONDS.observe(seconds, (self.name,))
+        if self.trace is not None:
+            self.trace.add(self.name, seconds)
+        return False
+
+class _NullSpan:
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+def span(name: str, trace: Optional[Trace] = None):
+    """with span("retrieval", ctx.trace): ... (بدون كلفة لو القياس مطفأ وما فيه trace)."""
+    if trace is None and not _state["enabled"]:
+        return NULL_SPAN
+    return _Span(name, trace)
+
+class activate:
+    """ربط trace بالكود الجاري (بدون span) حتى تنحسب عمليات القاعدة داخله على الطلب."""
+    __slots__ = ("trace", "token")
+    
+    def __init__(self, trace: Optional[Trace]):
+        self.trace = trace
+        self.token = None
+    
+    def __enter__(self):
+        if self.trace is not None:
+            self.token = _current_trace.set(self.trace)
+        return self.trace
+    
+    def __exit__(self, exc_type, exc, tb):
+        if self.token is not None:
+            _current_trace.reset(self.token)
+        return False
+
+def db_tracing() -> bool:
+    """هل نقيس استعارة الاتصال الحالية؟ (فحص رخيص يسبق perf_counter في المجمّع)."""
+    return _state["enabled"] or _current_trace.get() is not None
+
+def record_db(db: str, op: str, seconds: float, committed: Optional[bool] = None):
+    if _state["enabled"]:
+        DB_SECONDS.observe(seconds, (db, op))
+        if committed is None:
+            DB_QUERIES.inc((db,))
+        elif committed:
+            DB_COMMITS.inc((db,))
+        else:
+            DB_ROLLBACKS.inc((db,))
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_db(seconds)
+
+def record_skill(skill: str, seconds: float, outcome: str):
+    if _state["enabled"]:
+        SKILL_SECONDS.observe(seconds, (skill, outcome))
+
+def record_request(path: str, seconds: float):
+    if _state["enabled"]:
+        REQUEST_SECONDS.observe(seconds, (path,))
+
+def record_stage_error(stage: str):
+    # الأخطاء تنعد حتى لو القياس متوقف (HAWSA_TRACING=0): رخيصة ونادرة
+    STAGE_ERRORS.inc((stage,))
+
+def render_metrics() -> str:
+    return REGISTRY.render()
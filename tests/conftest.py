@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hawsa_db import close_all_pools  # noqa: E402
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """مجلد مؤقت كمجلد العمل: HawsaCore يفتح hawsa_ai_memory.db / hawsa_ai_advanced.db فيه."""
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+    close_all_pools()
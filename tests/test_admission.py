@@ -0,0 +1,117 @@
+import asyncio
+import threading
+
+import pytest
+
+from hawsa_admission import AdmissionController, AdmissionRejected
+
+def _controller(**options):
+    options.setdefault("max_per_user", 0)
+    return AdmissionController(metrics_key=f"test_admission_{id(options)}", **options)
+
+def test_global_limit_queues_until_a_slot_frees():
+    controller = _controller(max_concurrent=2, max_queue=4, queue_timeout=5.0)
+    first, second = controller.acquire("a"), controller.acquire("b")
+    admitted = threading.Event()
+
+    def third():
+        with controller.acquire("c"):
+            admitted.set()
+
+    thread = threading.Thread(target=third)
+    thread.start()
+    assert not admitted.wait(0.1)
+    assert controller.stats()["active"] == 2
+    assert controller.stats()["queue_depth"] == 1
+
+    first.release()
+    thread.join(timeout=5)
+    assert admitted.is_set()
+    second.release()
+    assert controller.stats()["active"] == 0
+
+def test_per_user_limit_returns_429():
+    controller = _controller(max_concurrent=10, max_per_user=2)
+    tickets = [controller.acquire("greedy"), controller.acquire("greedy")]
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("greedy")
+    assert rejected.value.status == 429
+    assert rejected.value.reason == "user_limit"
+    assert rejected.value.retry_after >= 1
+    # المستخدمين الثانيين ما يتأثرون
+    controller.acquire("polite").release()
+    for ticket in tickets:
+        ticket.release()
+    controller.acquire("greedy").release()
+
+def test_queue_full_returns_503_with_retry_after():
+    controller = _controller(max_concurrent=1, max_queue=0)
+    with controller.acquire("a"):
+        with pytest.raises(AdmissionRejected) as rejected:
+            controller.acquire("b")
+    assert rejected.value.status == 503
+    assert rejected.value.reason == "queue_full"
+    assert rejected.value.retry_after >= 1
+    assert controller.stats()["rejected"]["queue_full"] == 1
+
+def test_queue_timeout_returns_503_with_retry_after():
+    controller = _controller(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+    with controller.acquire("a"):
+        with pytest.raises(AdmissionRejected) as rejected:
+            controller.acquire("b")
+        stats = controller.stats()
+    assert rejected.value.status == 503
+    assert rejected.value.reason == "queue_timeout"
+    assert rejected.value.retry_after >= 1
+    assert stats["queue_depth"] == 0 and stats["rejected"]["queue_timeout"] == 1
+
+def test_queued_users_are_served_round_robin():
+    controller = _controller(max_concurrent=1, max_queue=10, queue_timeout=5.0)
+    order = []
+
+    async def request(user_id, name):
+        ticket = await controller.aacquire(user_id)
+        order.append(name)
+        ticket.release()
+
+    async def run():
+        holder = await controller.aacquire("holder")
+        tasks = []
+        # a يملأ الطابور أول، و b يوصل بعده بطلب واحد
+        for user_id, name in (("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1")):
+            tasks.append(asyncio.ensure_future(request(user_id, name)))
+            await asyncio.sleep(0)
+        holder.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ["a1", "b1", "a2", "a3"]
+
+def test_waiter_cancelled_after_grant_hands_slot_back():
+    controller = _controller(max_concurrent=1, max_queue=4, queue_timeout=5.0)
+
+    async def run():
+        holder = await controller.aacquire("holder")
+        waiter = asyncio.ensure_future(controller.aacquire("late"))
+        await asyncio.sleep(0)
+        assert controller.stats()["queue_depth"] == 1
+        # المكان ينعطى للمنتظر، والعميل يقطع قبل ما يصحى
+        holder.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return controller.stats()
+
+    stats = asyncio.run(run())
+    assert stats["active"] == 0
+    assert stats["queue_depth"] == 0
+    # المكان رجع فعلاً: طلب جديد ينقبل فورًا
+    controller.acquire("next").release()
+
+def test_api_rejection_sets_retry_after_header(workdir):
+    pytest.importorskip("fastapi")
+    from api_server import admission_rejected
+
+    response = admission_rejected(None, AdmissionRejected(503, "queue_full", 3))
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
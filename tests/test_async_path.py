@@ -0,0 +1,93 @@
+import asyncio
+
+from hawsa_core import HawsaCore
+from hawsa_db import close_all_pools
+
+# رسائل تطابق ملاحظة الاهتمامات (programming / design) ورسائل سابقة لنفس المستخدم
+MESSAGES = [
+    ("alice", "code programming script for the ecu boost map"),
+    ("bob", "design ui ideas for a platform"),
+    ("alice", "programming the boost map again, code review P0300"),
+    ("alice", "ecu code programming: boost turbo P0300 systems"),
+    ("bob", "design ux platform ui again"),
+    ("alice", "automation programming code for boost logging"),
+    ("alice", "boost map programming code P0300 follow up"),
+    ("alice", "systems programming code boost turbo final"),
+    ("alice", "programming code boost P0300 after eight turns"),
+]
+
+def normalize(result):
+    """النتيجة بدون الحقول اللي تختلف بين تشغيلين (ids، أوقات)."""
+    result = dict(result, analytics={k: v for k, v in result["analytics"].items() if k != "processing_time_seconds"})
+    result["context_used"] = [
+        {k: v for k, v in item.items() if k not in ("id", "created_at", "relevance")}
+        for item in result["context_used"]
+    ]
+    return result
+
+def _run_sync(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path / "sync")
+    core = HawsaCore()
+    try:
+        return [core.process_comprehensive_query(user_id, message) for user_id, message in MESSAGES]
+    finally:
+        core.close()
+        close_all_pools()
+
+def _run_async(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path / "async")
+    core = HawsaCore()
+
+    async def run():
+        return [await core.aprocess_comprehensive_query(user_id, message) for user_id, message in MESSAGES]
+
+    try:
+        return asyncio.run(run())
+    finally:
+        core.close()
+        close_all_pools()
+
+def test_async_result_matches_sync(tmp_path, monkeypatch):
+    (tmp_path / "sync").mkdir()
+    (tmp_path / "async").mkdir()
+    expected = _run_sync(tmp_path, monkeypatch)
+    actual = _run_async(tmp_path, monkeypatch)
+    assert any(r["response"]["personalized_notes"] for r in expected)
+    assert [normalize(r) for r in actual] == [normalize(r) for r in expected]
+
+def test_failed_stage_cancels_pending_tasks(workdir, monkeypatch):
+    core = HawsaCore()
+
+    def broken(*_args, **_kwargs):
+        raise RuntimeError("media failed")
+    monkeypatch.setattr(core, "_stage_media", broken)
+
+    async def run():
+        try:
+            await core.aprocess_comprehensive_query("carol", "boost code programming")
+        except RuntimeError as e:
+            assert str(e) == "media failed"
+        else:
+            raise AssertionError("expected RuntimeError")
+        # ما يبقى شي شغال من الطلب الفاشل على الـ loop
+        await asyncio.sleep(0)
+        return [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+
+    try:
+        assert asyncio.run(run()) == []
+    finally:
+        core.close()
+
+def test_response_cache_keeps_raw_message_spelling(workdir):
+    import unicodedata
+
+    core = HawsaCore()
+    try:
+        nfc = unicodedata.normalize("NFC", "café boost P0300")
+        nfd = unicodedata.normalize("NFD", nfc)
+        core.process_comprehensive_query("dave", nfc)
+        text = core.process_comprehensive_query("dave", nfd)["response"]["text"]
+        # الرد يقتبس الرسالة حرفيًا، فما ينفع يرجع نص محفوظ بالترميز الثاني
+        assert f"- المحتوى: {nfd}\n" in text
+    finally:
+        core.close()
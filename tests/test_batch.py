@@ -0,0 +1,57 @@
+import pytest
+
+from hawsa_core import HawsaCore
+from hawsa_db import close_all_pools
+from test_async_path import MESSAGES, normalize
+
+def _run(tmp_path, monkeypatch, name, batch, write_behind=False):
+    (tmp_path / name).mkdir()
+    monkeypatch.chdir(tmp_path / name)
+    core = HawsaCore(write_behind=write_behind)
+    try:
+        if batch:
+            return core.process_batch(MESSAGES)
+        return [core.process_comprehensive_query(user_id, message) for user_id, message in MESSAGES]
+    finally:
+        core.close()
+        close_all_pools()
+
+def _normalize(result):
+    result = normalize(result)
+    result["analytics"] = {k: v for k, v in result["analytics"].items() if k != "timings_ms"}
+    return result
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_batch_matches_sequential(tmp_path, monkeypatch, write_behind):
+    expected = _run(tmp_path, monkeypatch, "sequential", batch=False)
+    actual = _run(tmp_path, monkeypatch, "batch", batch=True, write_behind=write_behind)
+    # الرسائل المتكررة لنفس المستخدم تشوف ملاحظات وسياق الرسائل اللي قبلها في نفس الدفعة
+    assert any(r["response"]["personalized_notes"] for r in expected)
+    assert [_normalize(r) for r in actual] == [_normalize(r) for r in expected]
+
+def test_failed_save_marks_results_failed(workdir, monkeypatch):
+    core = HawsaCore()
+
+    def broken(_rows):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(core.memory, "save_interactions", broken)
+    try:
+        results = core.process_batch(MESSAGES)
+    finally:
+        core.close()
+    assert len(results) == len(MESSAGES)
+    # أول حفظ (قبل رسالة alice الثانية) فشل: ولا رسالة ترجع نجاح
+    assert all(not r["success"] for r in results)
+    assert [r["user_id"] for r in results] == [user_id for user_id, _message in MESSAGES]
+    assert all(r["error"] == "disk full" for r in results)
+
+def test_batch_endpoint_rejects_per_item_options(workdir):
+    pytest.importorskip("fastapi")
+    from fastapi.testclient import TestClient
+
+    from api_server import app
+
+    client = TestClient(app)
+    item = {"user_id": "u1", "message": "boost", "context_mode": "full"}
+    response = client.post("/analyze/batch", json={"items": [item]})
+    assert response.status_code == 422
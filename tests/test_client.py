@@ -0,0 +1,121 @@
+import asyncio
+import http.client
+import json
+
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+import hawsa_client
+from hawsa_client import AsyncHawsaClient, HawsaAPIError, HawsaClient
+
+FIRST = json.dumps({"stage": "user_profile", "data": {"personality": "analytical"}})
+
+class _BrokenResponse:
+    status_code = 200
+
+    def iter_lines(self, decode_unicode=False):
+        yield FIRST
+        raise requests.exceptions.ChunkedEncodingError("connection broken mid-stream")
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class _Session(requests.Session):
+    def __init__(self, error=None):
+        super().__init__()
+        self.error = error
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return _BrokenResponse()
+
+def test_sync_stream_wraps_mid_stream_errors():
+    client = HawsaClient("http://hawsa.test", session=_Session(), retries=0)
+    events = []
+    with pytest.raises(HawsaAPIError, match="stream interrupted"):
+        for event in client.stream("u1", "boost"):
+            events.append(event)
+    assert events == [("user_profile", {"personality": "analytical"})]
+
+def _refused():
+    reason = NewConnectionError(None, "Connection refused")
+    return requests.ConnectionError(MaxRetryError(None, "/analyze", reason))
+
+def _dropped_after_send():
+    reason = ProtocolError("Connection aborted.", http.client.RemoteDisconnected("closed"))
+    return requests.ConnectionError(reason)
+
+@pytest.mark.parametrize("error, calls", [
+    (_refused(), 3),
+    (requests.exceptions.ConnectTimeout("connect timed out"), 3),
+    # الطلب وصل للسيرفر (ممكن انحفظ): ما ينعاد
+    (_dropped_after_send(), 1),
+])
+def test_sync_retries_only_unsent_requests(monkeypatch, error, calls):
+    monkeypatch.setattr(hawsa_client, "backoff_delay", lambda *_args: 0.0)
+    session = _Session(error)
+    client = HawsaClient("http://hawsa.test", session=session, retries=2)
+    with pytest.raises(HawsaAPIError, match="connection failed"):
+        client.analyze("u1", "boost")
+    assert session.calls == calls
+
+def _async_client(handler, **options):
+    httpx = pytest.importorskip("httpx")
+    client = AsyncHawsaClient("http://hawsa.test", retries=0, **options)
+    client.client = httpx.AsyncClient(base_url="http://hawsa.test", transport=httpx.MockTransport(handler))
+    return client
+
+def test_async_stream_wraps_mid_stream_errors():
+    httpx = pytest.importorskip("httpx")
+
+    class BrokenStream(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            yield (FIRST + "\n").encode()
+            raise httpx.ReadTimeout("read timed out mid-stream")
+
+    async def run():
+        client = _async_client(lambda request: httpx.Response(200, stream=BrokenStream()))
+        events = []
+        try:
+            with pytest.raises(HawsaAPIError, match="stream interrupted"):
+                async for event in client.stream("u1", "boost"):
+                    events.append(event)
+        finally:
+            await client.aclose()
+        return events
+
+    assert asyncio.run(run()) == [("user_profile", {"personality": "analytical"})]
+
+def test_async_batch_failed_item_raises():
+    httpx = pytest.importorskip("httpx")
+
+    def handler(request):
+        assert request.url.path == "/analyze/batch"
+        return httpx.Response(200, json={"results": [
+            {"success": True, "user_id": "ok"},
+            {"success": False, "user_id": "lost", "error": "disk full"},
+        ]})
+
+    async def run():
+        client = _async_client(handler, batch_wait_ms=50)
+        try:
+            return await asyncio.gather(
+                client.analyze("ok", "boost"), client.analyze("lost", "boost"), return_exceptions=True
+            )
+        finally:
+            await client.aclose()
+
+    ok, lost = asyncio.run(run())
+    assert ok == {"success": True, "user_id": "ok"}
+    assert isinstance(lost, HawsaAPIError)
+    assert lost.status == 500 and "disk full" in str(lost)
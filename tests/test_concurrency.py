@@ -0,0 +1,90 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from hawsa_core import HawsaCore
+
+USERS = 300
+ROUNDS = 2
+THREADS = 64
+
+def _user(n: int) -> str:
+    return f"stress_user_{n}"
+
+def _marker(n: int) -> str:
+    # كلمة وحدة يفهرسها FTS كما هي، وما تطابق مستخدم ثاني (stress7 مو بادئة stress71 ككلمة)
+    return f"stress{n}marker"
+
+def _message(n: int, round_no: int) -> str:
+    topic = "code script" if n % 2 == 0 else "design ui"
+    return f"{topic} {_marker(n)} round {round_no} " + "x" * (n % 40)
+
+def _seed_notes(core: HawsaCore):
+    for n in range(USERS):
+        core.memory.add_long_term_note(_user(n), f"project {_marker(n)}", note_type="project", importance=3.0)
+    core.flush()
+
+def _check(core: HawsaCore, n: int, round_no: int, result):
+    user_id, marker = _user(n), _marker(n)
+    assert result["success"]
+    assert result["user_id"] == user_id
+
+    expected = core.user_analytics.infer_profile(user_id, _message(n, round_no))
+    profile = result["user_profile"]
+    assert profile["personality"] == expected.personality_type.value
+    assert profile["interests"] == expected.technical_interests
+    assert profile["confidence"] == expected.confidence_score
+
+    # كل رسالة في السياق (رسالة المستخدم أو رد المساعد اللي يكررها) فيها علامة نفس المستخدم
+    foreign = [item for item in result["context_used"] if marker not in item["content"]]
+    assert not foreign, foreign
+    if round_no > 0:
+        assert result["context_used"]
+    for item in result["context_used"]:
+        if item["id"] is not None:
+            assert core.memory.get_interaction(user_id, item["id"]) is not None
+
+    notes = result["response"]["personalized_notes"]
+    assert f"project {marker}" in notes
+    own_notes = set(core.memory.get_long_term_notes(user_id))
+    assert set(notes) <= own_notes
+    assert "stress" not in " ".join(notes).replace(marker, "")
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_threaded_requests_do_not_leak_between_users(workdir, write_behind):
+    core = HawsaCore(write_behind=write_behind)
+    try:
+        _seed_notes(core)
+        for round_no in range(ROUNDS):
+            with ThreadPoolExecutor(max_workers=THREADS) as pool:
+                futures = {
+                    n: pool.submit(
+                        core.process_comprehensive_query, _user(n), _message(n, round_no), context_mode="full"
+                    )
+                    for n in range(USERS)
+                }
+                results = {n: future.result() for n, future in futures.items()}
+            core.flush()
+            for n, result in results.items():
+                _check(core, n, round_no, result)
+    finally:
+        core.close()
+
+def test_async_requests_do_not_leak_between_users(workdir):
+    core = HawsaCore()
+
+    async def run_round(round_no: int):
+        return await asyncio.gather(*(
+            core.aprocess_comprehensive_query(_user(n), _message(n, round_no), context_mode="full")
+            for n in range(USERS)
+        ))
+
+    try:
+        _seed_notes(core)
+        for round_no in range(ROUNDS):
+            results = asyncio.run(run_round(round_no))
+            for n, result in enumerate(results):
+                _check(core, n, round_no, result)
+    finally:
+        core.close()
@@ -0,0 +1,62 @@
+import io
+import sqlite3
+
+from hawsa_core import HawsaAdvancedMemory
+from hawsa_export import export_ndjson, import_ndjson, open_storages, replay_requests
+from hawsa_storage import SingleFileStorage
+
+def _export(path):
+    memory = HawsaAdvancedMemory(storage=SingleFileStorage(path))
+    memory.save_interaction("A", "user", "boost leak question")
+    memory.add_long_term_note("A", "project boost build", note_type="project")
+    storages = open_storages(path, "source_analytics.db", shards=1)
+    out = io.StringIO()
+    export_ndjson(storages, out)
+    return out.getvalue().splitlines()
+
+def test_reimport_does_not_duplicate_renumbered_rows(workdir):
+    lines = _export("source.db")
+    storages = open_storages("target.db", "target_analytics.db", shards=1)
+    memory = HawsaAdvancedMemory(storage=storages["memory"])
+    # id 1 في الهدف لمستخدم ثاني: صف A ياخذ id جديد
+    with storages["memory"].pools()[0].transaction() as conn:
+        conn.execute("INSERT INTO conversation_memory (id, user_id, role, content) VALUES (1, 'B', 'user', 'b')")
+
+    first = import_ndjson(storages, lines)
+    again = import_ndjson(storages, lines)
+
+    assert first["tables"]["conversation_memory"]["renumbered"] == 1
+    assert again["tables"]["conversation_memory"] == {"copied": 0, "renumbered": 0, "skipped": 1}
+    assert again["tables"]["long_term_notes"]["copied"] == 0
+    conn = sqlite3.connect("target.db")
+    try:
+        assert conn.execute("SELECT id, user_id FROM conversation_memory ORDER BY id").fetchall() == [(1, "B"), (2, "A")]
+    finally:
+        conn.close()
+    # المستورد منفهرس للبحث
+    assert [hit["content"] for hit in memory.search_interactions("A", "boost leak")] == ["boost leak question"]
+
+class _FlakyCore:
+    def process_comprehensive_query(self, user_id, message):
+        if message == "bad":
+            raise RuntimeError("boom")
+        return {"success": True}
+
+    def process_batch(self, items):
+        return [
+            {"success": False, "user_id": user_id, "error": "disk full"} if message == "bad" else {"success": True}
+            for user_id, message in items
+        ]
+
+    def flush(self):
+        return 0
+
+def test_replay_reports_failed_indices():
+    requests = [("u", "ok"), ("u", "bad"), None, ("u", "ok"), ("u", "bad")]
+    single = replay_requests(_FlakyCore(), requests)
+    batched = replay_requests(_FlakyCore(), requests, batch=2)
+    for report in (single, batched):
+        assert report["failed"] == 2
+        assert report["failed_indices"] == [1, 4]
+        assert report["replayed"] == 2
+        assert report["skipped"] == 1
@@ -0,0 +1,44 @@
+import pytest
+
+from hawsa_core import AdvancedUserAnalytics
+
+OLD = "2000-01-01 00:00:00"
+
+def _updated_at(analytics, user_id):
+    with analytics.storage.pool_for(user_id).connection() as conn:
+        return conn.execute("SELECT updated_at FROM user_profiles WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+def _age(analytics, user_id):
+    with analytics.storage.pool_for(user_id).transaction() as conn:
+        conn.execute("UPDATE user_profiles SET updated_at = ? WHERE user_id = ?", (OLD, user_id))
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_unchanged_profile_still_advances_updated_at(workdir, batch):
+    analytics = AdvancedUserAnalytics(db_path="profiles.db")
+    profile = analytics.infer_profile("dana", "code programming script")
+    analytics.save_profile(profile)
+    _age(analytics, "dana")
+
+    # نفس البروفايل: الكاش يطابق، بس export --since لازم يشوف إن المستخدم نشط
+    if batch:
+        analytics.save_profiles([profile, profile])
+    else:
+        analytics.save_profile(profile)
+    assert _updated_at(analytics, "dana") > OLD
+
+def test_multi_process_never_skips_upsert(workdir):
+    analytics = AdvancedUserAnalytics(db_path="profiles.db", multi_process=True)
+    profile = analytics.infer_profile("erin", "design ui ideas")
+    analytics.save_profile(profile)
+    assert analytics._cached_params("erin") is None
+
+    # عملية ثانية غيرت الصف: الحفظ التالي لازم يرجعه (ما في كاش يقارن به)
+    with analytics.storage.pool_for("erin").transaction() as conn:
+        conn.execute("UPDATE user_profiles SET personality = 'practical', updated_at = ? WHERE user_id = 'erin'", (OLD,))
+    analytics.save_profile(profile)
+    with analytics.storage.pool_for("erin").connection() as conn:
+        personality, updated_at = conn.execute(
+            "SELECT personality, updated_at FROM user_profiles WHERE user_id = 'erin'"
+        ).fetchone()
+    assert personality == profile.personality_type.value
+    assert updated_at > OLD
@@ -0,0 +1,46 @@
+import sqlite3
+
+from hawsa_core import HawsaAdvancedMemory
+from hawsa_retention import archive_old_turns
+
+def test_old_row_with_high_id_is_archived_by_age(workdir):
+    memory = HawsaAdvancedMemory(db_path="memory.db")
+    for n in range(3):
+        memory.save_interaction("ivan", "user", f"recent question {n}")
+    # صف مستورد: created_at قديم بس id أكبر من كل الصفوف الحديثة
+    conn = sqlite3.connect("memory.db")
+    with conn:
+        imported_id = conn.execute(
+            "INSERT INTO conversation_memory (user_id, role, content, created_at) "
+            "VALUES ('ivan', 'user', 'imported old question', '2001-01-01 00:00:00')"
+        ).lastrowid
+    conn.close()
+
+    report = archive_old_turns("memory.db", max_age_days=30, max_rows=0, min_keep_rows=0, batch_size=1, pause_ms=0)
+    assert report["rows_archived"] == 1
+    assert report["archive_months"] == ["2001_01"]
+    assert [row["content"] for row in memory.get_recent_context("ivan", limit=10)] == [
+        f"recent question {n}" for n in range(3)
+    ]
+    archived = memory.get_interaction("ivan", imported_id)
+    assert archived["archived"] and archived["content"] == "imported old question"
+
+def test_dry_run_counts_each_row_once(workdir):
+    HawsaAdvancedMemory(db_path="memory.db")
+    conn = sqlite3.connect("memory.db")
+    with conn:
+        for n in range(1, 9):
+            # id 5 و 6 قديمة بالعمر، والباقي حديث: الخطوتين يلقون نفس الصفوف
+            created_at = "2001-01-01 00:00:00" if n in (5, 6) else "2999-01-01 00:00:00"
+            conn.execute(
+                "INSERT INTO conversation_memory (id, user_id, role, content, created_at) VALUES (?, 'judy', 'user', ?, ?)",
+                (n, f"turn {n}", created_at),
+            )
+    conn.close()
+
+    options = dict(max_age_days=30, max_rows=4, min_keep_rows=1, batch_size=2, pause_ms=0)
+    dry = archive_old_turns("memory.db", dry_run=True, **options)
+    real = archive_old_turns("memory.db", **options)
+    assert real["rows_archived"] == 4
+    assert dry["rows_archived"] == real["rows_archived"]
+    assert dry["content_raw_bytes"] == real["content_raw_bytes"]
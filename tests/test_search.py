@@ -0,0 +1,73 @@
+import sqlite3
+
+from hawsa_core import HawsaAdvancedMemory, HawsaCore
+from hawsa_migrations import MEMORY_MIGRATIONS, apply_migrations, get_schema_version, latest_version
+from hawsa_search import fill_fts_bodies, fts_document
+from hawsa_tracing import STAGE_ERRORS
+
+def _texts(hits):
+    return [hit.get("content") or hit.get("note_text") for hit in hits]
+
+def test_plain_connection_can_write_and_delete(workdir):
+    memory = HawsaAdvancedMemory(db_path="memory.db")
+    memory.save_interaction("frank", "user", "turbo boost wastegate question")
+    memory.add_long_term_note("frank", "project wastegate build", note_type="project")
+
+    # اتصال sqlite3 عادي بدون أي دالة مسجلة (أداة خارجية / CLI)
+    conn = sqlite3.connect("memory.db")
+    with conn:
+        conn.execute(
+            "INSERT INTO conversation_memory (user_id, role, content) VALUES ('frank', 'user', 'wastegate spring swap')"
+        )
+        conn.execute("DELETE FROM long_term_notes WHERE user_id = 'frank'")
+    assert _texts(memory.search_notes("frank", "wastegate")) == []
+    assert _texts(memory.search_interactions("frank", "wastegate")) == ["turbo boost wastegate question"]
+
+    with conn:
+        assert fill_fts_bodies(conn) == 1
+        assert fill_fts_bodies(conn) == 0
+    conn.close()
+    assert sorted(_texts(memory.search_interactions("frank", "wastegate"))) == [
+        "turbo boost wastegate question", "wastegate spring swap"
+    ]
+
+def test_upgrade_replaces_function_triggers(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    # ملف بنسخة 4 القديمة: triggers تستدعي hawsa_fts_document
+    apply_migrations(conn, [m for m in MEMORY_MIGRATIONS if m[0] <= 4])
+    conn.create_function("hawsa_fts_document", 2, fts_document, deterministic=True)
+    with conn:
+        conn.execute("""
+            CREATE TRIGGER conversation_fts_ai AFTER INSERT ON conversation_memory BEGIN
+                INSERT INTO conversation_fts (rowid, body) VALUES (new.id, hawsa_fts_document(new.user_id, new.content));
+            END
+        """)
+        conn.execute("INSERT INTO conversation_memory (user_id, role, content) VALUES ('gail', 'user', 'injector pulse')")
+    conn.close()
+
+    conn = sqlite3.connect(path)
+    try:
+        apply_migrations(conn, MEMORY_MIGRATIONS)
+        assert get_schema_version(conn) == latest_version(MEMORY_MIGRATIONS)
+        with conn:
+            conn.execute("INSERT INTO conversation_memory (user_id, role, content) VALUES ('gail', 'user', 'x')")
+            conn.execute("DELETE FROM conversation_memory WHERE content = 'x'")
+        body = conn.execute("SELECT fts_body FROM conversation_memory WHERE user_id = 'gail'").fetchone()[0]
+        assert body == fts_document("gail", "injector pulse")
+    finally:
+        conn.close()
+
+def test_retrieval_errors_are_counted(workdir, monkeypatch):
+    core = HawsaCore()
+
+    def broken(*_args, **_kwargs):
+        raise sqlite3.OperationalError("fts broken")
+    monkeypatch.setattr(core.memory, "search_notes", broken)
+    before = STAGE_ERRORS.value(("retrieval",))
+    try:
+        result = core.process_comprehensive_query("hana", "boost code programming")
+    finally:
+        core.close()
+    assert result["success"]
+    assert STAGE_ERRORS.value(("retrieval",)) == before + 1
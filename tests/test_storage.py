@@ -0,0 +1,55 @@
+import sqlite3
+
+from hawsa_core import HawsaAdvancedMemory
+from hawsa_migrations import MEMORY_MIGRATIONS, apply_migrations
+from hawsa_storage import ShardedStorage, copy_rows, migrate_layout, shard_index
+
+COLUMNS = ("id", "user_id", "role", "content")
+
+def _rows(conn):
+    return conn.execute("SELECT id, user_id FROM conversation_memory ORDER BY id").fetchall()
+
+def test_copy_rows_rerun_does_not_renumber_again():
+    conn = sqlite3.connect(":memory:")
+    apply_migrations(conn, MEMORY_MIGRATIONS)
+    conn.execute("INSERT INTO conversation_memory (id, user_id, role, content) VALUES (1, 'B', 'user', 'b')")
+
+    first = {"copied": 0, "renumbered": 0, "skipped": 0}
+    copy_rows(conn, "conversation_memory", COLUMNS, "id", [(1, "A", "user", "a")], first)
+    again = {"copied": 0, "renumbered": 0, "skipped": 0}
+    copy_rows(conn, "conversation_memory", COLUMNS, "id", [(1, "A", "user", "a")], again)
+
+    assert _rows(conn) == [(1, "B"), (2, "A")]
+    assert first == {"copied": 0, "renumbered": 1, "skipped": 0}
+    assert again == {"copied": 0, "renumbered": 0, "skipped": 1}
+
+def _users_in_both_shards():
+    users, shards = [], set()
+    n = 0
+    while len(users) < 2:
+        user_id = f"user_{n}"
+        if shard_index(user_id, 2) not in shards:
+            shards.add(shard_index(user_id, 2))
+            users.append(user_id)
+        n += 1
+    return users
+
+def test_migrate_layout_rerun_is_idempotent(workdir):
+    # id 1 و 2 موجودين في الملفين لمستخدمين مختلفين: النقل لملف واحد لازم يعيد ترقيم نصها
+    memory = HawsaAdvancedMemory(storage=ShardedStorage("memory.db", 2))
+    for user_id in _users_in_both_shards():
+        memory.save_interaction(user_id, "user", f"{user_id} boost question")
+        memory.save_interaction(user_id, "assistant", f"{user_id} boost answer")
+
+    first = migrate_layout("memory.db", MEMORY_MIGRATIONS, from_shards=2, to_shards=1)
+    again = migrate_layout("memory.db", MEMORY_MIGRATIONS, from_shards=2, to_shards=1, allow_existing=True)
+
+    assert first["tables"]["conversation_memory"]["renumbered"] == 2
+    assert again["tables"]["conversation_memory"] == {"copied": 0, "renumbered": 0, "skipped": 4}
+    conn = sqlite3.connect("memory.db")
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM conversation_memory").fetchone()[0] == 4
+        # الصفوف المعاد ترقيمها منفهرسة للبحث
+        assert conn.execute("SELECT COUNT(*) FROM conversation_memory WHERE fts_body IS NULL").fetchone()[0] == 0
+    finally:
+        conn.close()
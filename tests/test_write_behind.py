@@ -0,0 +1,93 @@
+import pytest
+
+from hawsa_db import SQLitePool, WriteBehindError, WriteBehindQueue
+
+class _WriterKilled(BaseException):
+    pass
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = SQLitePool(str(tmp_path / "wb.db"), pool_size=2)
+    with pool.transaction() as conn:
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT NOT NULL)")
+    yield pool
+    pool.close()
+
+def _count(pool):
+    with pool.connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+def test_on_commit_error_keeps_writer_alive(pool):
+    queue = WriteBehindQueue(flush_ms=1)
+    try:
+        def broken(_rowid):
+            raise ValueError("callback bug")
+        queue.submit(pool, "INSERT INTO items (value) VALUES (?)", ("a",), on_commit=broken)
+        assert queue.flush() == 0
+        queue.submit(pool, "INSERT INTO items (value) VALUES (?)", ("b",))
+        assert queue.flush() == 0
+        stats = queue.stats()
+        assert stats["writer_alive"]
+        assert stats["callback_errors"] == 1
+        assert stats["committed"] == 2
+        assert _count(pool) == 2
+    finally:
+        queue.close()
+
+def test_failed_write_is_counted_and_reported_by_flush(pool):
+    queue = WriteBehindQueue(flush_ms=50)
+    try:
+        rowids = []
+        queue.submit(pool, "INSERT INTO items (value) VALUES (?)", ("ok",), on_commit=rowids.append)
+        queue.submit(pool, "INSERT INTO items (value) VALUES (?)", (None,), on_commit=rowids.append)
+        assert queue.flush() == 1
+        assert queue.flush() == 0
+        assert rowids[1] is None
+        stats = queue.stats()
+        assert stats["dropped"] == 1
+        assert "IntegrityError" in stats["last_error"]
+        assert [f["kind"] for f in queue.failures()][-1] == "dropped"
+        assert _count(pool) == 1
+    finally:
+        queue.close()
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_dead_writer_raises_instead_of_hanging(pool, monkeypatch):
+    queue = WriteBehindQueue(max_size=1, flush_ms=1)
+
+    def die(_ops):
+        raise _WriterKilled()
+    monkeypatch.setattr(queue, "_commit_batch", die)
+    queue.submit(pool, "INSERT INTO items (value) VALUES (?)", ("lost",))
+    queue._thread.join(timeout=5)
+    assert not queue._thread.is_alive()
+
+    with pytest.raises(WriteBehindError):
+        queue.flush()
+    with pytest.raises(WriteBehindError):
+        queue.submit(pool, "INSERT INTO items (value) VALUES (?)", ("x",))
+    queue.close()
+    # بعد close الإيقاف مقصود: flush ما يرفع
+    assert queue.flush() == 0
+
+def test_dropped_interaction_leaves_context_cache(workdir):
+    from hawsa_core import HawsaAdvancedMemory
+
+    queue = WriteBehindQueue(flush_ms=1)
+    try:
+        memory = HawsaAdvancedMemory("memory.db", write_behind=queue)
+        memory.save_interaction("u1", "user", "first")
+        queue.flush()
+        assert [row["content"] for row in memory.get_recent_context("u1")] == ["first"]
+        with memory.storage.pool_for("u1").transaction() as conn:
+            conn.execute("""
+                CREATE TRIGGER poison BEFORE INSERT ON conversation_memory WHEN NEW.content = 'poison'
+                BEGIN SELECT RAISE(ABORT, 'poisoned'); END
+            """)
+
+        memory.save_interaction("u1", "user", "poison")
+        assert queue.flush() == 1
+        # الصف المحذوف ما يظل في الكاش
+        assert [row["content"] for row in memory.get_recent_context("u1")] == ["first"]
+    finally:
+        queue.close()